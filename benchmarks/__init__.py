@@ -0,0 +1,44 @@
+"""
+Micro-benchmarks of the signing, verification and message handling done per request.
+
+Needs pytest-benchmark, pip install satosa_openid4vci[benchmark]::
+
+    python -m pytest benchmarks --benchmark-only
+    python -m pytest benchmarks --benchmark-only --benchmark-autosave
+    python -m pytest benchmarks --benchmark-only --benchmark-compare
+
+The runs saved with --benchmark-autosave, in .benchmarks/, are what --benchmark-compare
+compares with.
+"""
+import os
+
+import yaml
+
+BASEDIR = os.path.abspath(os.path.dirname(__file__))
+FRONTEND_CONF = os.path.join(BASEDIR, "..", "openid4vci_oidc", "plugins",
+                             "openid4vci_frontend.yaml")
+INTERNAL_ATTRIBUTES = os.path.join(BASEDIR, "..", "openid4vci_oidc", "internal_attributes.yaml")
+
+ISSUER_ID = "https://ci.example.com"
+WALLET_ID = "https://wallet.example.org"
+
+# The JWS algorithm used with each of the key types in the configuration
+ALGORITHMS = {"RSA": "RS256", "EC": "ES256"}
+
+
+def frontend_key_defs() -> list:
+    """
+    The key definitions of the example frontend configuration, an RSA and a P-256 key.
+    """
+    with open(FRONTEND_CONF) as fp:
+        _conf = yaml.safe_load(fp)
+    return _conf["config"]["op"]["server_info"]["key_config"]["key_defs"]
+
+
+def internal_attributes() -> dict:
+    with open(INTERNAL_ATTRIBUTES) as fp:
+        return yaml.safe_load(fp)
+
+
+def signing_algorithms() -> list:
+    return [ALGORITHMS[_def["type"]] for _def in frontend_key_defs()]
@@ -0,0 +1,34 @@
+"""
+Keys shared by the micro-benchmarks.
+
+The credential issuer's keys are made from the key definitions in the example frontend
+configuration. The wallet has a P-256 key, as the test wallets do.
+"""
+from cryptojwt import KeyJar
+from cryptojwt.jwk.ec import new_ec_key
+from cryptojwt.key_jar import build_keyjar
+import pytest
+
+from benchmarks import ISSUER_ID
+from benchmarks import WALLET_ID
+from benchmarks import frontend_key_defs
+
+
+@pytest.fixture(scope="session")
+def wallet_key():
+    return new_ec_key("P-256", use="sig")
+
+
+@pytest.fixture(scope="session")
+def issuer_keyjar(wallet_key):
+    """The credential issuer's private keys and the wallet's public key."""
+    _keyjar = build_keyjar(frontend_key_defs(), issuer_id=ISSUER_ID)
+    _keyjar.import_jwks({"keys": [wallet_key.serialize()]}, WALLET_ID)
+    return _keyjar
+
+
+@pytest.fixture(scope="session")
+def wallet_keyjar(wallet_key):
+    _keyjar = KeyJar()
+    _keyjar.import_jwks({"keys": [wallet_key.serialize(private=True)]}, WALLET_ID)
+    return _keyjar
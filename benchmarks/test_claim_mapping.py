@@ -0,0 +1,69 @@
+"""
+Mapping attributes to claims and back, as SATOSA's AttributeMapper and combine_claim_values
+did it on every login and authorization, against the compiled plans.
+"""
+from satosa.attribute_mapping import AttributeMapper
+from satosa_idpyop.core.claims import combine_claim_values
+import pytest
+
+from benchmarks import internal_attributes
+from satosa_openid4vci.claim_mapping import ClaimMappingPlans
+
+pytest.importorskip("pytest_benchmark")
+
+# What the authorization server supports by default, and some
+CLAIMS_SUPPORTED = ["sub", "name", "given_name", "family_name", "middle_name", "nickname",
+                    "preferred_username", "profile", "picture", "website", "email",
+                    "email_verified", "gender", "birthdate", "zoneinfo", "locale",
+                    "phone_number", "phone_number_verified", "updated_at"]
+
+# What a backend returns
+ATTRIBUTES = {
+    "givenname": ["Diana", "Maria"],
+    "surname": ["Krall"],
+    "name": ["Diana Krall"],
+    "mail": ["diana@example.com", "dk@example.org"],
+    "edupersontargetedid": ["c4f4a7e1b2d0"],
+    "displayname": ["diana"],
+    "eduPersonAffiliation": ["member", "staff"],
+    "schacHomeOrganization": ["example.com"],
+}
+
+
+@pytest.fixture(scope="module")
+def converter():
+    return AttributeMapper(internal_attributes())
+
+
+@pytest.mark.parametrize("how", ["converter", "plan"])
+def test_claims(benchmark, converter, how):
+    """handle_authn_response"""
+    if how == "converter":
+        def claims(attributes):
+            _claims = converter.from_internal("openid", attributes)
+            claims = {k: v for k, v in _claims.items() if v}
+            return dict([i for i in combine_claim_values(claims.items())])
+    else:
+        _plans = ClaimMappingPlans(converter)
+
+        def claims(attributes):
+            return _plans.get("openid").claims(attributes)
+
+    benchmark.group = "attributes to claims"
+    assert benchmark(claims, ATTRIBUTES)["given_name"] == "Diana Maria"
+
+
+@pytest.mark.parametrize("how", ["converter", "plan"])
+def test_attributes(benchmark, converter, how):
+    """_handle_authn_request"""
+    if how == "converter":
+        def attributes(claims_supported):
+            return converter.to_internal_filter("openid", claims_supported)
+    else:
+        _plans = ClaimMappingPlans(converter)
+
+        def attributes(claims_supported):
+            return list(_plans.get("openid", claims_supported).attributes)
+
+    benchmark.group = "claims to attributes"
+    assert "givenname" in benchmark(attributes, CLAIMS_SUPPORTED)
@@ -0,0 +1,143 @@
+"""
+Signing and verification of the JWSs the credential issuer produces and consumes, with the
+key types of the example configuration.
+"""
+import time
+
+from cryptojwt import JWT
+from cryptojwt.jws.jws import factory
+import pytest
+
+from benchmarks import ISSUER_ID
+from benchmarks import WALLET_ID
+from benchmarks import signing_algorithms
+
+pytest.importorskip("pytest_benchmark")
+
+ALGORITHMS = signing_algorithms()
+
+CREDENTIAL_CONFIGURATION = {
+    "format": "vc+sd-jwt",
+    "vct": "PersonIdentificationData",
+    "cryptographic_binding_methods_supported": ["jwk"],
+    "credential_signing_alg_values_supported": ["ES256"],
+    "display": [{"name": "Example PID", "locale": "en-US"}],
+    "claims": {_claim: {"mandatory": True, "display": [{"name": _claim, "locale": "en-US"}]}
+               for _claim in ["given_name", "family_name", "birth_date", "nationality"]},
+}
+
+# About the size of the Entity Configuration of the example configuration
+ENTITY_CONFIGURATION = {
+    "iss": ISSUER_ID,
+    "sub": ISSUER_ID,
+    "authority_hints": ["https://ta.example.com"],
+    "metadata": {
+        "federation_entity": {"organization_name": "The Credential Issuer",
+                              "homepage_uri": "https://ci.example.com",
+                              "contacts": ["operations@ci.example.com"]},
+        "oauth_authorization_server": {
+            "issuer": ISSUER_ID,
+            "authorization_endpoint": f"{ISSUER_ID}/authorization",
+            "pushed_authorization_request_endpoint": f"{ISSUER_ID}/par",
+            "token_endpoint": f"{ISSUER_ID}/token",
+            "jwks_uri": f"{ISSUER_ID}/jwks/oauth_authorization_server",
+            "grant_types_supported": ["authorization_code", "refresh_token"],
+            "dpop_signing_alg_values_supported": ["ES256"],
+        },
+        "openid_credential_issuer": {
+            "credential_issuer": ISSUER_ID,
+            "credential_endpoint": f"{ISSUER_ID}/credential",
+            "credential_configurations_supported": {
+                f"PID{n}": CREDENTIAL_CONFIGURATION for n in range(3)},
+        },
+    },
+}
+
+ACCESS_TOKEN = {
+    "iss": ISSUER_ID,
+    "aud": [ISSUER_ID],
+    "sub": "d5c5b3c1e4a66d2cab6e5db5bd0f9e8b",
+    "client_id": "wHCOL8s0j5Xg4WzTKO5bqHtmTVqs9eFcGQYhhXmGRMA",
+    "scope": "openid",
+    "cnf": {"jkt": "0ZcOCORZNYy-DWpqq30jZyJGHTN0d2HglBV3uiguA4I"},
+    "authorization_details": [{"type": "openid_credential", "format": "vc+sd-jwt",
+                               "vct": "PersonIdentificationData"}],
+}
+
+# An SD-JWT issuer signed part, ten disclosure digests
+CREDENTIAL = {
+    "iss": ISSUER_ID,
+    "vct": "PersonIdentificationData",
+    "_sd_alg": "sha-256",
+    "_sd": [f"{n:02d}" + "sHv8b4NkCrHd6Lg1rGmR3BKhS0aSLrUQpDDIvf3Ux" for n in range(10)],
+    "cnf": {"jwk": {"kty": "EC", "crv": "P-256",
+                    "x": "TCAER19Zvu3OHF4j4W4vfSVoHIP1ILilDls7vCeGemc",
+                    "y": "ZxjiWWbZMQGHVWKVQ4hbSIirsVfuecCE6t4jT9F2HZQ"}},
+}
+
+# A wallet's authorization request, signed, as it comes to the PAR endpoint
+REQUEST_OBJECT = {
+    "iss": WALLET_ID,
+    "aud": ISSUER_ID,
+    "response_type": "code",
+    "client_id": WALLET_ID,
+    "redirect_uri": "https://127.0.0.1:5005/authz_cb/abc",
+    "state": "AfXgIh6nUcDdjMqdPpvSwN5g",
+    "code_challenge": "qM2hxLQkS5Yz9hXGsfb7MZk7Cx4wj5SDKpEfGEVkgu8",
+    "code_challenge_method": "S256",
+    "authorization_details": ACCESS_TOKEN["authorization_details"],
+}
+
+PAYLOADS = {
+    "entity_configuration": ENTITY_CONFIGURATION,
+    "access_token": ACCESS_TOKEN,
+    "credential": CREDENTIAL,
+}
+
+
+def _signed(keyjar, alg: str, payload: dict) -> str:
+    _jwt = JWT(key_jar=keyjar, iss=ISSUER_ID, sign_alg=alg, lifetime=3600)
+    return _jwt.pack(payload=payload)
+
+
+@pytest.mark.parametrize("alg", ALGORITHMS)
+@pytest.mark.parametrize("artefact", list(PAYLOADS))
+def test_sign(benchmark, issuer_keyjar, artefact, alg):
+    benchmark.group = f"sign {artefact}"
+    _jwt = JWT(key_jar=issuer_keyjar, iss=ISSUER_ID, sign_alg=alg, lifetime=3600)
+    _jws = benchmark(_jwt.pack, payload=PAYLOADS[artefact])
+    assert factory(_jws).jwt.headers["alg"] == alg
+
+
+@pytest.mark.parametrize("alg", ALGORITHMS)
+@pytest.mark.parametrize("artefact", list(PAYLOADS))
+def test_verify(benchmark, issuer_keyjar, artefact, alg):
+    benchmark.group = f"verify {artefact}"
+    _jws = _signed(issuer_keyjar, alg, PAYLOADS[artefact])
+    _jwt = JWT(key_jar=issuer_keyjar)
+    _info = benchmark(_jwt.unpack, _jws)
+    assert _info["iss"] == ISSUER_ID
+
+
+def test_unpack_request_object(benchmark, issuer_keyjar, wallet_keyjar):
+    """What the PAR endpoint does with a signed request: find the issuer, then verify."""
+    _jwt = JWT(key_jar=wallet_keyjar, iss=WALLET_ID, sign_alg="ES256")
+    _request = _jwt.pack(payload=REQUEST_OBJECT)
+
+    def unpack():
+        _iss = factory(_request).jwt.payload()["iss"]
+        assert _iss in issuer_keyjar
+        return JWT(key_jar=issuer_keyjar).unpack(_request)
+
+    benchmark.group = "PAR request object"
+    _info = benchmark(unpack)
+    assert _info["client_id"] == WALLET_ID
+
+
+def test_parse_jws(benchmark, issuer_keyjar):
+    """Splitting and decoding a JWS without verifying it."""
+    _jws = _signed(issuer_keyjar, "ES256", ENTITY_CONFIGURATION)
+    benchmark.group = "PAR request object"
+    _payload = benchmark(lambda: factory(_jws).jwt.payload())
+    assert _payload["iss"] == ISSUER_ID
+    assert _payload["exp"] > time.time()
@@ -0,0 +1,111 @@
+"""
+Parsing and serializing the messages handled per request: the authorization request as it
+is pushed and as it is restored from its urlencoded form, authorization details and the
+token response.
+"""
+import json
+from urllib.parse import urlencode
+
+from idpyoidc.message import Message
+from idpyoidc.message.oauth2 import AccessTokenResponse
+from openid4v.message import AuthorizationDetail
+from openid4v.message import AuthorizationRequest
+import pytest
+
+from benchmarks import WALLET_ID
+from satosa_openid4vci.authorization_details import parse_authorization_details
+
+pytest.importorskip("pytest_benchmark")
+
+AUTHORIZATION_DETAIL = {"type": "openid_credential", "format": "vc+sd-jwt",
+                        "vct": "PersonIdentificationData"}
+
+# As the PAR endpoint gets it, authorization_details decoded
+PUSHED_REQUEST = {
+    "response_type": "code",
+    "client_id": WALLET_ID,
+    "redirect_uri": "https://127.0.0.1:5005/authz_cb/abc",
+    "state": "AfXgIh6nUcDdjMqdPpvSwN5g",
+    "code_challenge": "qM2hxLQkS5Yz9hXGsfb7MZk7Cx4wj5SDKpEfGEVkgu8",
+    "code_challenge_method": "S256",
+    "authorization_details": [AUTHORIZATION_DETAIL],
+}
+
+# What the authorization endpoint gets after PAR, kept in the SATOSA state
+AUTHORIZATION_REQUEST = urlencode({
+    "client_id": WALLET_ID,
+    "request_uri": "urn:ietf:params:oauth:request_uri:2a6a9c5fb6ba4b3fa0a4c6e2f3c2b4b1",
+    "response_type": "code",
+})
+
+TOKEN_RESPONSE = {
+    "access_token": "eyJhbGciOiJFUzI1NiJ9." + 300 * "A" + "." + 86 * "B",
+    "token_type": "DPoP",
+    "expires_in": 3600,
+    "c_nonce": "tZignsnFbp",
+    "c_nonce_expires_in": 86400,
+    "authorization_details": [dict(AUTHORIZATION_DETAIL,
+                                   credential_identifiers=["PID-1", "PID-2"])],
+}
+
+
+def test_message_from_urlencoded(benchmark):
+    """The original request restored from the SATOSA state, in handle_authn_response."""
+    benchmark.group = "authorization request"
+    _msg = benchmark(lambda: Message().from_urlencoded(AUTHORIZATION_REQUEST))
+    assert _msg["client_id"] == WALLET_ID
+
+
+def test_authorization_request_from_urlencoded(benchmark):
+    benchmark.group = "authorization request"
+    _msg = benchmark(lambda: AuthorizationRequest().from_urlencoded(AUTHORIZATION_REQUEST))
+    assert _msg["response_type"] == ["code"]
+
+
+def test_authorization_request_from_dict(benchmark):
+    """The pushed request, parsed and verified."""
+
+    def parse():
+        _msg = AuthorizationRequest(**PUSHED_REQUEST)
+        _msg.verify()
+        return _msg
+
+    benchmark.group = "authorization request"
+    _msg = benchmark(parse)
+    assert _msg["client_id"] == WALLET_ID
+
+
+def test_authorization_request_to_urlencoded(benchmark):
+    _msg = AuthorizationRequest(**PUSHED_REQUEST)
+    benchmark.group = "authorization request"
+    assert benchmark(_msg.to_urlencoded)
+
+
+@pytest.mark.parametrize("form", ["json", "urlencoded"])
+def test_authorization_details(benchmark, form):
+    if form == "json":
+        _value = json.dumps([AUTHORIZATION_DETAIL])
+    else:
+        _value = f'["{urlencode(AUTHORIZATION_DETAIL)}"]'
+    benchmark.group = "authorization details"
+    assert benchmark(parse_authorization_details, _value) == [AUTHORIZATION_DETAIL]
+
+
+def test_authorization_detail_from_urlencoded(benchmark):
+    _value = urlencode(AUTHORIZATION_DETAIL)
+    benchmark.group = "authorization details"
+    _msg = benchmark(lambda: AuthorizationDetail().from_urlencoded(_value))
+    assert _msg["vct"] == AUTHORIZATION_DETAIL["vct"]
+
+
+def test_token_response_to_json(benchmark):
+    _msg = AccessTokenResponse(**TOKEN_RESPONSE)
+    benchmark.group = "token response"
+    assert benchmark(_msg.to_json)
+
+
+def test_token_response_from_json(benchmark):
+    _json = json.dumps(TOKEN_RESPONSE)
+    benchmark.group = "token response"
+    _msg = benchmark(lambda: AccessTokenResponse().from_json(_json))
+    assert _msg["token_type"] == "DPoP"
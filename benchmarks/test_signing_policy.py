@@ -0,0 +1,41 @@
+"""
+Signing with the algorithm the library picks, the behaviour before there was a signing policy,
+against signing with the algorithm the default policy picks. The entity configuration is also
+measured when signed by fedservice and then re-signed, which is what the frontend does.
+"""
+from cryptojwt import JWT
+from cryptojwt.jws.jws import factory
+import pytest
+
+from benchmarks import ISSUER_ID
+from benchmarks.test_jws import PAYLOADS
+from satosa_openid4vci.signing_policy import SigningPolicy
+
+pytest.importorskip("pytest_benchmark")
+
+POLICY = SigningPolicy()
+
+
+@pytest.mark.parametrize("policy", ["library", "policy"])
+@pytest.mark.parametrize("artefact", list(PAYLOADS))
+def test_sign(benchmark, issuer_keyjar, artefact, policy):
+    if policy == "library":
+        _jwt = JWT(key_jar=issuer_keyjar, iss=ISSUER_ID, lifetime=3600)
+    else:
+        _alg = POLICY.algorithm(artefact, issuer_keyjar, [ISSUER_ID])
+        _jwt = JWT(key_jar=issuer_keyjar, iss=ISSUER_ID, sign_alg=_alg, lifetime=3600)
+    benchmark.group = f"signing policy {artefact}"
+    _jws = benchmark(_jwt.pack, payload=PAYLOADS[artefact])
+    assert factory(_jws).jwt.headers["alg"] == ("RS256" if policy == "library" else "ES256")
+
+
+def test_sign_and_resign(benchmark, issuer_keyjar):
+    """Signed by the library and re-signed by the policy."""
+    _jwt = JWT(key_jar=issuer_keyjar, iss=ISSUER_ID, lifetime=3600)
+
+    def sign():
+        return POLICY.resign(_jwt.pack(payload=PAYLOADS["entity_configuration"]),
+                             "entity_configuration", issuer_keyjar)
+
+    benchmark.group = "signing policy entity_configuration"
+    assert factory(benchmark(sign)).jwt.headers["alg"] == "ES256"
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Compares decoding authorization_details the way the PAR endpoint used to, splitting the
+bracketed form on commas, with parse_authorization_details, and measures the validation
+against credential_configurations_supported.
+
+usage: bench_authorization_details.py [rounds] [number of credential configurations]
+"""
+import json
+import sys
+import timeit
+from urllib.parse import urlencode
+
+from openid4v.message import AuthorizationDetail
+
+from satosa_openid4vci.authorization_details import AuthorizationDetailsValidator
+from satosa_openid4vci.authorization_details import parse_authorization_details
+
+DETAILS = [{"type": "openid_credential", "format": "vc+sd-jwt", "vct": vct}
+           for vct in ["PID", "EHIC", "PDA1"]]
+BRACKETED = "[" + ",".join(f'"{urlencode(d)}"' for d in DETAILS) + "]"
+JSON = json.dumps(DETAILS)
+
+
+def split_on_commas():
+    _list = []
+    for _url_ad in BRACKETED[1:-1].split(","):
+        _list.append(AuthorizationDetail().from_urlencoded(_url_ad[1:-1]).to_dict())
+    return _list
+
+
+def supported(size: int) -> dict:
+    _supported = {f"Credential{i}": {"format": "vc+sd-jwt", "vct": f"VCT{i}"}
+                  for i in range(size)}
+    for _detail in DETAILS:
+        _supported[f"{_detail['vct']}Credential"] = {"format": "vc+sd-jwt",
+                                                     "vct": _detail["vct"]}
+    return _supported
+
+
+def scan(configurations: dict, details: list):
+    """What validation costs without lookup tables."""
+    for _detail in details:
+        for _id, _conf in configurations.items():
+            if _conf["format"] == _detail["format"] and _conf.get("vct") == _detail["vct"]:
+                break
+        else:
+            raise ValueError(_detail)
+
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    assert split_on_commas() == parse_authorization_details(BRACKETED) == DETAILS
+
+    _configurations = supported(size)
+    _validator = AuthorizationDetailsValidator(_configurations)
+    for _name, _func in [
+        ("split on commas", split_on_commas),
+        ("parse bracketed", lambda: parse_authorization_details(BRACKETED)),
+        ("parse JSON", lambda: parse_authorization_details(JSON)),
+        ("validate, scan", lambda: scan(_configurations, DETAILS)),
+        ("validate, tables", lambda: _validator.validate(DETAILS)),
+    ]:
+        _secs = timeit.timeit(_func, number=rounds)
+        print(f"{_name:18} {_secs / rounds * 1e6:8.2f} us/request")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Compares what the log calls of one request cost when DEBUG is off, f-string formatting
+against %-style arguments with Lazy.
+
+usage: bench_logging.py [rounds]
+"""
+import logging
+import sys
+import timeit
+import tracemalloc
+
+from satosa_openid4vci.logging_util import Lazy
+from satosa_openid4vci.logging_util import banner
+
+logger = logging.getLogger("bench")
+logger.setLevel(logging.INFO)
+
+REQUEST = {
+    "client_id": "https://wallet.example.org",
+    "response_type": "code",
+    "redirect_uri": "https://wallet.example.org/cb",
+    "authorization_details": [{"type": "openid_credential", "format": "vc+sd-jwt",
+                               "vct": "PersonIdentificationData"}],
+}
+PAR_DB = {f"urn:ietf:params:oauth:request_uri:{i}": REQUEST for i in range(1000)}
+HTTP_INFO = {"headers": {"content-type": "application/x-www-form-urlencoded"},
+             "method": "POST", "url": "https://issuer.example.org/token"}
+
+
+def eager():
+    logger.debug(20 * "=" + "At the Token Endpoint" + 20 * "=")
+    logger.debug(f"Request: {REQUEST}")
+    logger.debug(f"http_info: {HTTP_INFO}")
+    logger.debug(f"PAR_db: {list(PAR_DB.keys())}")
+    logger.debug(f"Parsed request: {REQUEST} {type(REQUEST)}")
+    logger.debug(f"Process result: {REQUEST}")
+
+
+def lazy():
+    logger.debug(banner("At the Token Endpoint"))
+    logger.debug("Request: %s", REQUEST)
+    logger.debug("http_info: %s", HTTP_INFO)
+    logger.debug("PAR_db: %s", Lazy(lambda: list(PAR_DB.keys())))
+    logger.debug("Parsed request: %s %s", REQUEST, Lazy(type, REQUEST))
+    logger.debug("Process result: %s", REQUEST)
+
+
+def allocated(func, rounds):
+    """The largest amount of memory allocated during one call."""
+    tracemalloc.start()
+    _peak = 0
+    for _ in range(rounds):
+        _before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func()
+        _peak = max(_peak, tracemalloc.get_traced_memory()[1] - _before)
+    tracemalloc.stop()
+    return _peak
+
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    for _name, _func in [("f-string", eager), ("lazy", lazy)]:
+        _peak = allocated(_func, 100)
+        _secs = timeit.timeit(_func, number=rounds)
+        print(f"{_name:10} {_secs / rounds * 1e6:8.2f} us/request"
+              f" {_peak:10d} bytes peak allocation/request")
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Removes expired records from a one-file-per-key storage directory.
+
+usage: expire_stored_dir.py [-n] [-l LIMIT] [-d DEFAULT_TTL] directory [pattern=ttl ...]
+
+The patterns are matched against the decoded file names, e.g. 'par*=600'. What the names
+look like depends on the persistence layer that wrote them, run with -n first to see what
+would be removed.
+"""
+import argparse
+
+from idpyoidc.util import Base64
+
+from satosa_openid4vci.storage.expiry import ExpiryPolicy
+from satosa_openid4vci.storage.expiry import purge_directory
+
+
+def expire(directory, ttl, default_ttl=None, limit=500, dry_run=False):
+    policy = ExpiryPolicy(ttl, default_ttl)
+    removed = purge_directory(directory, policy, key_conv=Base64(), limit=limit,
+                              dry_run=dry_run)
+    for name in removed:
+        print(f"{'would remove' if dry_run else 'removed'}: {name}")
+    return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", dest="dry_run", action="store_true")
+    parser.add_argument("-l", dest="limit", type=int, default=500)
+    parser.add_argument("-d", dest="default_ttl", type=int, default=None)
+    parser.add_argument("directory")
+    parser.add_argument("ttl", nargs="*")
+    args = parser.parse_args()
+
+    _ttl = {}
+    for spec in args.ttl:
+        pattern, seconds = spec.rsplit("=", 1)
+        _ttl[pattern] = int(seconds)
+    expire(args.directory, _ttl, args.default_ttl, args.limit, args.dry_run)
@@ -0,0 +1,772 @@
+#!/usr/bin/env python3
+"""
+Load test of the complete issuance flow, run in-process against OpenID4VCIFrontend.
+
+The federation, the wallet provider and the wallets are the test entities, built with
+tests/build_federation.py. Every wallet is registered with the wallet provider and gets a
+wallet instance attestation before the clock starts. Then the wallets, ``concurrency`` at a
+time, go through
+
+    PAR -> authorization -> (stub backend) -> authn response -> token -> credential
+
+calling the frontend the way SATOSA does, with a Context per request. The backend is a stub
+that authenticates every user as a user from tests/users.json, the credential constructors
+talk to :py:class:`satosa_openid4vci.tools.stub_authentic_source.StubAuthenticSource`.
+
+Reported, and written as JSON so that runs can be compared:
+
+* per endpoint: count, errors, p50/p95/p99/mean/max latency (ms) and requests/s
+* completed flows per second
+* storage operations (store/fetch/delete on the storages of the persistence layers) per flow
+
+usage: python -m script.load_test [--wallets N] [--concurrency C] [--rounds R]
+                                  [--delay SECONDS] [--config satosa_conf.yaml]
+                                  [--output results.json|directory] [--compare previous.json]
+
+Run from the root of the repository, the test entities are imported from the tests package.
+"""
+import argparse
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any
+from typing import Callable
+from typing import Optional
+from urllib.parse import parse_qsl
+from urllib.parse import urlparse
+
+from satosa_openid4vci.http_client import CLIENT_LEVEL_PARAMS
+from satosa_openid4vci.tools.stub_authentic_source import StubAuthenticSource
+
+logger = logging.getLogger("load_test")
+
+BASEDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "tests"))
+
+TA_ID = "https://ta.example.com"
+WP_ID = "https://wp.example.org"
+CI_ID = "https://ci.example.com"
+WALLET_ID = "I_am_wallet_{}"
+FRONTEND_NAME = "openid4vci_frontend"
+
+INTERNAL_ATTRIBUTES = {
+    "attributes": {
+        "mail": {"openid": ["email"]},
+        "givenname": {"openid": ["given_name"]},
+        "surname": {"openid": ["family_name"]},
+    }
+}
+
+AUTHORIZATION_DETAILS = [
+    {"type": "openid_credential", "format": "vc+sd-jwt", "vct": "Geant_CID_example"}
+]
+
+ENDPOINTS = ["pushed_authorization", "authorization", "authn_response", "token", "credential"]
+STORAGE_OPERATIONS = ["store", "fetch", "fetch_many", "delete"]
+
+
+def full_path(local_file):
+    return os.path.join(BASEDIR, local_file)
+
+
+def federation_config(wallets: int) -> dict:
+    """
+    The federation of tests/test_05_ci_flow.py with ``wallets`` wallets.
+    """
+    config = {
+        TA_ID: {
+            "entity_type": "trust_anchor",
+            "subordinates": [WP_ID],
+            "kwargs": {
+                "preference": {
+                    "organization_name": "The example federation operator",
+                    "homepage_uri": "https://ta.example.org",
+                    "contacts": "operations@ta.example.org"
+                },
+                "endpoints": ["entity_configuration", "list", "fetch", "resolve"],
+            }
+        },
+        WP_ID: {
+            "entity_type": "wallet_provider",
+            "trust_anchors": [TA_ID],
+            "kwargs": {
+                "authority_hints": [TA_ID],
+                "preference": {
+                    "organization_name": "The Wallet Provider",
+                    "homepage_uri": "https://wp.example.com",
+                    "contacts": "operations@wp.example.com"
+                }
+            }
+        },
+    }
+    for n in range(wallets):
+        config[WALLET_ID.format(n)] = {"entity_type": "wallet", "trust_anchors": [TA_ID],
+                                       "kwargs": {}}
+    return config
+
+
+# ---- measuring ----
+
+def percentile(values: list, q: float) -> float:
+    """
+    Nearest-rank percentile of values, which must be sorted.
+    """
+    if not values:
+        return 0.0
+    _rank = max(1, int(-(-q * len(values) // 100)))
+    return values[min(_rank, len(values)) - 1]
+
+
+class LatencyRecorder(object):
+    """
+    Collects the latency of every request, per endpoint.
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float, ok: Optional[bool] = True):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def summary(self, wall_time: float) -> dict:
+        _summary = {}
+        for _endpoint, _values in self.latencies.items():
+            _values = sorted(_values)
+            _summary[_endpoint] = {
+                "count": len(_values),
+                "errors": self.errors[_endpoint],
+                "p50_ms": round(percentile(_values, 50) * 1000, 3),
+                "p95_ms": round(percentile(_values, 95) * 1000, 3),
+                "p99_ms": round(percentile(_values, 99) * 1000, 3),
+                "mean_ms": round(sum(_values) / len(_values) * 1000, 3),
+                "max_ms": round(_values[-1] * 1000, 3),
+                "requests_per_second": round(len(_values) / wall_time, 2) if wall_time else 0,
+            }
+        return _summary
+
+
+class StorageOpCounter(object):
+    """
+    Counts the operations done on storage instances. Installed on the storage at the bottom
+    of a persistence layer, below any change tracking, which is what reaches the database.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._installed = set()
+
+    @staticmethod
+    def innermost(storage: Any) -> Any:
+        while getattr(storage, "storage", None) is not None and storage.storage is not storage:
+            storage = storage.storage
+        return storage
+
+    def install(self, storage: Any):
+        storage = self.innermost(storage)
+        if storage is None or id(storage) in self._installed:
+            return
+        self._installed.add(id(storage))
+        for _operation in STORAGE_OPERATIONS:
+            _method = getattr(storage, _operation, None)
+            if _method is not None:
+                setattr(storage, _operation, self._counting(_operation, _method))
+
+    def _counting(self, operation: str, method: Callable) -> Callable:
+        def counting(*args, **kwargs):
+            with self._lock:
+                self.counts[operation] += 1
+            return method(*args, **kwargs)
+
+        return counting
+
+    def snapshot(self) -> Counter:
+        with self._lock:
+            return Counter(self.counts)
+
+
+class AuthenticSourceClient(object):
+    """
+    Called like ``requests.request``, sends every request to a StubAuthenticSource running on
+    an event loop in a thread of its own. Given to the credential constructors as their httpc.
+    """
+
+    def __init__(self, stub: StubAuthenticSource):
+        import httpx
+
+        self.stub = stub
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=stub),
+                                         base_url="http://authentic-source")
+
+    def request(self, method: str, url: str, **kwargs):
+        for _param in CLIENT_LEVEL_PARAMS:
+            kwargs.pop(_param, None)
+        kwargs.pop("allow_redirects", None)
+        if isinstance(kwargs.get("data"), (str, bytes)):
+            kwargs["content"] = kwargs.pop("data")
+        _path = urlparse(url).path or "/"
+        _call = self._client.request(method, _path, **kwargs)
+        return asyncio.run_coroutine_threadsafe(_call, self._loop).result()
+
+    __call__ = request
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+# ---- the SATOSA side ----
+
+def frontend_config(path: str, trust_anchor_keys: dict) -> dict:
+    """
+    The test configuration, with a pushed authorization endpoint. OpenID4VCIFrontend only
+    accepts authorization requests that have been pushed.
+    """
+    from idpyoidc.util import load_yaml_config
+
+    config = load_yaml_config(path)
+    _server_info = config["op"]["server_info"]
+    _server_info["trust_anchors"] = {TA_ID: {"keys": trust_anchor_keys["keys"]}}
+    _oas = _server_info["entity_type"]["oauth_authorization_server"]["kwargs"]["config"]
+    _userinfo = _oas.get("userinfo", {}).get("kwargs", {})
+    if _userinfo.get("db_file"):
+        _userinfo["db_file"] = full_path(os.path.basename(_userinfo["db_file"]))
+
+    _oas["client_authn_methods"].setdefault("pushed_authz",
+                                            "idpyoidc.server.client_authn.PushedAuthorization")
+    _endpoint = _oas["endpoint"]
+    if "pushed_authorization" not in _endpoint:
+        _endpoint["pushed_authorization"] = {
+            "path": "par",
+            "class": "idpyoidc.server.oauth2.pushed_authorization.PushedAuthorization",
+            "kwargs": {"client_authn_method": _endpoint["authorization"]["kwargs"][
+                "client_authn_method"]}
+        }
+        _endpoint["authorization"]["kwargs"]["client_authn_method"] = ["pushed_authz"]
+    return config
+
+
+class StubBackend(object):
+    """
+    Stands in for the SATOSA backend. Is the frontend's auth_req_callback_func, which in
+    SATOSA sends the user to the backend, and later produces the backend's response.
+    """
+
+    def __init__(self, users: dict, acr: Optional[str] = "https://refeds.org/profile/sfa"):
+        self.users = users
+        self.acr = acr
+        self._names = sorted(users.keys())
+
+    def __call__(self, context, internal_request):
+        from satosa.response import SeeOther
+
+        context.state["stub_backend"] = {"requester": internal_request.requester}
+        return SeeOther("https://backend.example.com/login")
+
+    def authenticate(self, frontend, n: int):
+        from satosa.internal import AuthenticationInformation
+        from satosa.internal import InternalData
+
+        _name = self._names[n % len(self._names)]
+        _user = {k: [v] for k, v in self.users[_name].items() if isinstance(v, str)}
+        _auth_info = AuthenticationInformation(
+            auth_class_ref=self.acr, issuer="https://backend.example.com",
+            timestamp=datetime.datetime.now(datetime.timezone.utc).isoformat())
+        return InternalData(auth_info=_auth_info, subject_id=_name,
+                            attributes=frontend.converter.to_internal("openid", _user))
+
+
+def make_context(path: str, request: Any, headers: Optional[dict] = None,
+                 method: Optional[str] = "POST", state: Optional[Any] = None):
+    """
+    A context as SATOSA's proxy server makes one from the WSGI environment.
+    """
+    from satosa.state import State
+    from satosa_idpyop.core import ExtendedContext
+
+    context = ExtendedContext()
+    context.path = path
+    context.request = request
+    context.request_method = method
+    context.http_headers = {f"HTTP_{k.upper().replace('-', '_')}": v
+                            for k, v in (headers or {}).items()}
+    context.request_authorization = context.http_headers.get("HTTP_AUTHORIZATION", "")
+    context.state = state if state is not None else State()
+    return context
+
+
+def response_info(response: Any) -> dict:
+    _message = getattr(response, "message", None)
+    if isinstance(_message, list):
+        _message = "".join(_message)
+    try:
+        _info = json.loads(_message) if _message else {}
+    except (TypeError, ValueError):
+        return {}
+    return _info if isinstance(_info, dict) else {}
+
+
+def is_ok(response: Any) -> bool:
+    _status = str(getattr(response, "status", "200")).split(" ", 1)[0]
+    return _status[:1] in ("2", "3") and "error" not in response_info(response)
+
+
+# ---- the wallet side ----
+
+def register_wallet(wallet: Any, wallet_provider: Any):
+    """
+    Wallet initialization and registration with the wallet provider, as in
+    tests/test_05_ci_flow.py.
+    """
+    from cryptojwt import KeyJar
+    from cryptojwt import as_unicode
+    from cryptojwt.jwk.ec import new_ec_key
+    from idpyoidc.key_import import store_under_other_id
+
+    _dis = wallet_provider["device_integrity_service"]
+    _wallet = wallet["wallet"]
+    _wallet.oem_key_jar = KeyJar()
+    _wallet.oem_key_jar = store_under_other_id(_dis.oem_keyjar, "", WP_ID)
+
+    _wallet_provider = wallet_provider["wallet_provider"]
+    _challenge_endpoint = _wallet_provider.get_endpoint("challenge")
+    _req = _wallet.get_service("challenge").construct()
+    challenge = _challenge_endpoint.process_request(
+        _challenge_endpoint.parse_request(_req))["response_args"]["nonce"]
+
+    _wallet.context.crypto_hardware_key = new_ec_key("P-256")
+    _hardware_key_tag = _wallet.context.crypto_hardware_key.thumbprint("SHA-256")
+
+    _req = _wallet.get_service("key_attestation").construct(request_args={
+        "challenge": challenge,
+        "crypto_hardware_key": json.dumps(_wallet.context.crypto_hardware_key.serialize())
+    })
+    _endpoint = _dis.get_endpoint("key_attestation")
+    key_attestation = _endpoint.process_request(
+        _endpoint.parse_request(_req))["response_args"]["key_attestation"]
+
+    _req = _wallet.get_service("registration").construct({
+        "challenge": challenge,
+        "key_attestation": as_unicode(key_attestation),
+        "hardware_key_tag": as_unicode(_hardware_key_tag)
+    })
+    _endpoint = _wallet_provider.get_endpoint("registration")
+    _endpoint.process_request(_endpoint.parse_request(_req))
+
+
+def wallet_instance_attestation(wallet: Any, wallet_provider: Any) -> tuple:
+    """
+    :return: A wallet instance attestation and the thumbprint of its ephemeral key, which is
+        the client_id at the credential issuer
+    """
+    import base64
+    import hashlib
+
+    from cryptojwt import JWT
+    from cryptojwt import as_unicode
+    from cryptojwt.jws.dsa import ECDSASigner
+    from cryptojwt.utils import as_bytes
+    from idpyoidc.key_import import import_jwks
+
+    _dis = wallet_provider["device_integrity_service"]
+    _wallet_provider = wallet_provider["wallet_provider"]
+    _wallet = wallet["wallet"]
+
+    _ephemeral_key = _wallet.mint_new_key()
+    _ephemeral_key.use = "sig"
+    _ephemeral_key_tag = _ephemeral_key.kid
+    _wallet.context.keyjar = import_jwks(
+        _wallet.context.keyjar, {"keys": [_ephemeral_key.serialize(private=True)]},
+        _wallet.entity_id)
+    _wallet.context.ephemeral_key = {_ephemeral_key_tag: _ephemeral_key}
+
+    _challenge_endpoint = _wallet_provider.get_endpoint("challenge")
+    _req = _wallet.get_service("challenge").construct()
+    challenge = _challenge_endpoint.process_request(
+        _challenge_endpoint.parse_request(_req))["response_args"]["nonce"]
+
+    client_data_hash = hashlib.sha256(as_bytes(json.dumps(
+        {"challenge": challenge, "jwk_thumbprint": _ephemeral_key_tag}))).digest()
+    hardware_signature = ECDSASigner().sign(
+        msg=client_data_hash, key=_wallet.context.crypto_hardware_key.private_key())
+
+    _req = _wallet.get_service("integrity").construct(request_args={
+        "hardware_signature": as_unicode(base64.b64encode(hardware_signature))
+    })
+    _endpoint = _dis.get_endpoint("integrity")
+    integrity_assertion = _endpoint.process_request(
+        _endpoint.parse_request(_req))["response_args"]["integrity_assertion"]
+
+    _wallet_provider.context.crypto_hardware_key = {
+        _wallet.context.crypto_hardware_key.kid: _wallet.context.crypto_hardware_key
+    }
+    _payload = {
+        "challenge": challenge,
+        "hardware_signature": as_unicode(base64.b64encode(hardware_signature)),
+        "integrity_assertion": as_unicode(integrity_assertion),
+        "hardware_key_tag": as_unicode(_wallet.context.crypto_hardware_key.kid),
+        "cnf": {"jwk": _ephemeral_key.serialize()},
+        "vp_formats_supported": {
+            "jwt_vc_json": {"alg_values_supported": ["ES256K", "ES384"]},
+            "jwt_vp_json": {"alg_values_supported": ["ES256K", "EdDSA"]},
+        }
+    }
+    _assertion = JWT(_wallet.context.keyjar, sign_alg="ES256")
+    _assertion.iss = _wallet.entity_id
+    _token_request = {
+        "assertion": _assertion.pack(payload=_payload, kid=_ephemeral_key_tag),
+        "grant_type": "urn:ietf:params:oauth:grant-type:jwt-bearer"
+    }
+    _endpoint = _wallet_provider.get_endpoint("wallet_provider_token")
+    _response = _endpoint.process_request(_endpoint.parse_request(_token_request))
+    return _response["response_args"]["assertion"], _ephemeral_key_tag
+
+
+class WalletFlow(object):
+    """
+    One wallet going through the issuance flow.
+
+    :param n: The number of the wallet
+    :param wallet: The wallet entity
+    :param attestation: The wallet instance attestation
+    :param key_tag: Thumbprint of the ephemeral key, the client_id
+    """
+
+    def __init__(self, n: int, wallet: Any, attestation: str, key_tag: str):
+        self.n = n
+        self.wallet = wallet
+        self.attestation = attestation
+        self.key_tag = key_tag
+        self.redirect_uri = f"https://127.0.0.1:5005/authz_cb/{n}"
+
+    def _call(self, frontend, recorder: LatencyRecorder, endpoint: str, context) -> Any:
+        _handler = frontend.dispatch(context.path)
+        _start = time.perf_counter()
+        try:
+            response = _handler(context)
+        except Exception:
+            recorder.record(endpoint, time.perf_counter() - _start, ok=False)
+            raise
+        recorder.record(endpoint, time.perf_counter() - _start, ok=is_ok(response))
+        return response
+
+    def run(self, frontend, backend: StubBackend, recorder: LatencyRecorder,
+            paths: dict) -> bool:
+        """
+        :return: Whether a credential was issued
+        """
+        from idpyoidc.util import rndstr
+
+        _signing_key = self.wallet["wallet"].context.ephemeral_key[self.key_tag]
+        actor = self.wallet["pid_eaa_consumer"].new_consumer(CI_ID)
+
+        # Pushed authorization request
+        _service = actor.get_service("authorization")
+        _service.certificate_issuer_id = CI_ID
+        _request_args = {
+            "authorization_details": AUTHORIZATION_DETAILS,
+            "response_type": "code",
+            "client_id": self.key_tag,
+            "redirect_uri": self.redirect_uri,
+        }
+        _req_info = _service.get_request_parameters(
+            request_args=_request_args, state=rndstr(24),
+            wallet_instance_attestation=self.attestation, signing_key=_signing_key)
+        _request = dict(parse_qsl(urlparse(_req_info["url"]).query))
+        response = self._call(frontend, recorder, "pushed_authorization", make_context(
+            paths["pushed_authorization"], _request, _req_info.get("headers")))
+        request_uri = response_info(response).get("request_uri")
+        if not request_uri:
+            return False
+
+        # Authorization, the frontend hands over to the backend
+        context = make_context(paths["authorization"],
+                               {"request_uri": request_uri, "client_id": self.key_tag},
+                               method="GET")
+        self._call(frontend, recorder, "authorization", context)
+        if "stub_backend" not in context.state:
+            return False
+
+        # The backend's response, on a new request carrying the same state
+        _internal_resp = backend.authenticate(frontend, self.n)
+        _context = make_context(f"{FRONTEND_NAME}/authn_response", None, method="GET",
+                                state=context.state)
+        _start = time.perf_counter()
+        response = frontend.handle_authn_response(_context, _internal_resp)
+        recorder.record("authn_response", time.perf_counter() - _start, ok=is_ok(response))
+        _location = dict(getattr(response, "headers", [])).get("Location", "")
+        _authz_response = dict(parse_qsl(urlparse(_location).query))
+        if "code" not in _authz_response:
+            return False
+
+        # Token
+        _token_service = actor.get_service("accesstoken")
+        _req_info = _token_service.get_request_parameters(
+            {"code": _authz_response["code"], "grant_type": "authorization_code",
+             "redirect_uri": self.redirect_uri, "state": _authz_response["state"]},
+            audience=CI_ID, thumbprint=self.key_tag, signing_key=_signing_key,
+            wallet_instance_attestation=self.attestation,
+            endpoint=f"{CI_ID}/{paths['token']}")
+        response = self._call(frontend, recorder, "token", make_context(
+            paths["token"], dict(parse_qsl(_req_info["body"])), _req_info["headers"]))
+        _token_response = response_info(response)
+        if "access_token" not in _token_response:
+            return False
+        _token_service.upstream_get("context").cstate.update(_authz_response["state"],
+                                                              _token_response)
+
+        # Credential
+        _req_info = actor.get_service("credential").get_request_parameters(
+            request_args={"format": "vc+sd-jwt"}, access_token=_token_response["access_token"],
+            state=_authz_response["state"])
+        _body = _req_info["body"]
+        response = self._call(frontend, recorder, "credential", make_context(
+            paths["credential"], json.loads(_body) if isinstance(_body, str) else _body,
+            _req_info["headers"]))
+        return is_ok(response)
+
+
+# ---- putting it together ----
+
+class LoadTest(object):
+    """
+    :param wallets: Number of wallets
+    :param config: Path to the frontend configuration
+    :param delay: Seconds the stub authentic source takes to answer
+    """
+
+    def __init__(self, wallets: Optional[int] = 10, config: Optional[str] = None,
+                 delay: Optional[float] = 0):
+        import responses
+        from idpyoidc.key_import import store_under_other_id
+
+        from satosa_openid4vci.openid4vci import OpenID4VCIFrontend
+        from tests import create_trust_chain_messages
+        from tests.build_federation import build_federation
+
+        with open(full_path("users.json")) as fp:
+            self.backend = StubBackend(json.load(fp))
+
+        self.federation = build_federation(federation_config(wallets))
+        self.ta = self.federation[TA_ID]
+        self.wp = self.federation[WP_ID]
+        store_under_other_id(self.wp["device_integrity_service"].oem_keyjar, "", WP_ID, True)
+
+        # the frontend writes its storage and keys relative to the working directory
+        self.workdir = tempfile.mkdtemp(prefix="load_test_")
+        os.chdir(self.workdir)
+        _ta_keys = self.ta.keyjar.export_jwks()
+        self.frontend = OpenID4VCIFrontend(
+            self.backend, INTERNAL_ATTRIBUTES,
+            frontend_config(config or full_path("satosa_conf.yaml"), _ta_keys),
+            CI_ID, FRONTEND_NAME)
+        self.frontend.register_endpoints([])
+
+        _server = self.frontend.app.server
+        _fed_entity = _server["federation_entity"]
+        _fed_entity.trust_anchor = {TA_ID: _ta_keys}
+        _fed_entity.context.authority_hints = [TA_ID]
+        self.ta.server.subordinate[CI_ID] = {
+            "jwks": _fed_entity.keyjar.export_jwks(),
+            "entity_types": _server.keys(),
+            "authority_hints": _fed_entity.context.authority_hints}
+
+        self.paths = {}
+        for _guise in ["oauth_authorization_server", "openid_credential_issuer"]:
+            for _name, _endpoint in _server[_guise].endpoint.items():
+                self.paths[_name] = _endpoint.endpoint_path
+
+        # The authentic source
+        self.authentic_source = StubAuthenticSource(delay=delay)
+        self.authentic_source_client = AuthenticSourceClient(self.authentic_source)
+        _credential = _server["openid_credential_issuer"].get_endpoint("credential")
+        for _constructor in (getattr(_credential, "credential_constructor", None) or {}).values():
+            _constructor.httpc = self.authentic_source_client
+
+        self.storage_ops = StorageOpCounter()
+        for _guise in _server.values():
+            _storage = getattr(getattr(_guise, "persistence", None), "storage", None)
+            if _storage is not None:
+                self.storage_ops.install(_storage)
+
+        # Everything fetched over HTTP from the federation is answered from memory
+        self.federation_responses = responses.RequestsMock(assert_all_requests_are_fired=False)
+        self.federation_responses.start()
+        for _where_and_what in [create_trust_chain_messages(_server, self.ta),
+                                create_trust_chain_messages(self.wp, self.ta)]:
+            for _url, _body in _where_and_what.items():
+                self.federation_responses.add(
+                    "GET", _url, body=_body, status=200,
+                    adding_headers={"Content-Type": "application/json"})
+
+        self.flows = []
+        for n in range(wallets):
+            _wallet = self.federation[WALLET_ID.format(n)]
+            register_wallet(_wallet, self.wp)
+            _wallet["federation_entity"].get_verified_metadata(CI_ID)
+            _attestation, _key_tag = wallet_instance_attestation(_wallet, self.wp)
+            self.flows.append(WalletFlow(n, _wallet, _attestation, _key_tag))
+
+    def close(self):
+        self.federation_responses.stop()
+        self.federation_responses.reset()
+        self.authentic_source_client.close()
+
+    def _flow(self, flow: WalletFlow, recorder: LatencyRecorder) -> bool:
+        try:
+            return flow.run(self.frontend, self.backend, recorder, self.paths)
+        except Exception as err:
+            logger.warning("Wallet %d failed: %s", flow.n, err)
+            return False
+
+    def run(self, concurrency: Optional[int] = 4, rounds: Optional[int] = 1) -> dict:
+        recorder = LatencyRecorder()
+        _storage_before = self.storage_ops.snapshot()
+        _flows = [f for _ in range(rounds) for f in self.flows]
+        _start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            _results = list(executor.map(lambda f: self._flow(f, recorder), _flows))
+        wall_time = time.perf_counter() - _start
+
+        _completed = sum(1 for r in _results if r)
+        _storage = self.storage_ops.snapshot() - _storage_before
+        return {
+            "endpoints": {e: s for e, s in sorted(recorder.summary(wall_time).items(),
+                                                  key=lambda i: _endpoint_order(i[0]))},
+            "flows": {
+                "started": len(_flows),
+                "completed": _completed,
+                "wall_time_s": round(wall_time, 3),
+                "per_second": round(_completed / wall_time, 2) if wall_time else 0,
+            },
+            "storage": {
+                "total": {op: _storage[op] for op in STORAGE_OPERATIONS},
+                "per_flow": {op: round(_storage[op] / _completed, 2) if _completed else 0
+                             for op in STORAGE_OPERATIONS},
+            },
+            "authentic_source": {
+                "requests": len(self.authentic_source.requests),
+                "max_in_flight": self.authentic_source.max_in_flight,
+            },
+        }
+
+
+def _endpoint_order(endpoint: str) -> int:
+    return ENDPOINTS.index(endpoint) if endpoint in ENDPOINTS else len(ENDPOINTS)
+
+
+def _revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=BASEDIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(current: dict, previous: dict) -> list:
+    """
+    Lines showing how the latencies and throughput changed since a previous run.
+    """
+    lines = []
+    for _endpoint, _now in current["endpoints"].items():
+        _then = previous.get("endpoints", {}).get(_endpoint)
+        if not _then:
+            continue
+        _changes = []
+        for _key in ["p50_ms", "p95_ms", "p99_ms", "requests_per_second"]:
+            if _then.get(_key):
+                _changes.append(f"{_key} {(_now[_key] / _then[_key] - 1) * 100:+.1f}%")
+        lines.append(f"{_endpoint:22} " + ", ".join(_changes))
+    _then = previous.get("flows", {}).get("per_second")
+    if _then:
+        _now = current["flows"]["per_second"]
+        lines.append(f"{'flows/s':22} {(_now / _then - 1) * 100:+.1f}%")
+    return lines
+
+
+def report(result: dict) -> list:
+    lines = [f"{'endpoint':22} {'count':>6} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} "
+             f"{'p99 ms':>9} {'req/s':>8}"]
+    for _endpoint, _s in result["endpoints"].items():
+        lines.append(f"{_endpoint:22} {_s['count']:6} {_s['errors']:4} {_s['p50_ms']:9.2f} "
+                     f"{_s['p95_ms']:9.2f} {_s['p99_ms']:9.2f} "
+                     f"{_s['requests_per_second']:8.1f}")
+    _flows = result["flows"]
+    lines.append(f"flows: {_flows['completed']}/{_flows['started']} completed in "
+                 f"{_flows['wall_time_s']} s, {_flows['per_second']} flows/s")
+    lines.append("storage operations per flow: " + ", ".join(
+        f"{k} {v}" for k, v in result["storage"]["per_flow"].items()))
+    return lines
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--wallets", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=1,
+                        help="Number of times every wallet goes through the flow")
+    parser.add_argument("--delay", type=float, default=0,
+                        help="Seconds the authentic source takes to answer")
+    parser.add_argument("--config", help="Frontend configuration, tests/satosa_conf.yaml "
+                                         "by default")
+    parser.add_argument("--output", help="File or directory the JSON result is written to")
+    parser.add_argument("--compare", help="JSON result of a previous run")
+    args = parser.parse_args(argv)
+
+    _cwd = os.getcwd()
+    _config = os.path.abspath(args.config) if args.config else None
+    load_test = LoadTest(args.wallets, _config, args.delay)
+    try:
+        _result = load_test.run(args.concurrency, args.rounds)
+    finally:
+        load_test.close()
+        os.chdir(_cwd)
+
+    _now = datetime.datetime.now(datetime.timezone.utc)
+    result = {
+        "timestamp": _now.isoformat(timespec="seconds"),
+        "revision": _revision(),
+        "python": platform.python_version(),
+        "parameters": {"wallets": args.wallets, "concurrency": args.concurrency,
+                       "rounds": args.rounds, "delay": args.delay,
+                       "config": args.config or "tests/satosa_conf.yaml"},
+        **_result,
+    }
+    print("\n".join(report(result)))
+
+    if args.compare:
+        with open(args.compare) as fp:
+            print(f"\ncompared with {args.compare}:")
+            print("\n".join(compare(result, json.load(fp))))
+
+    if args.output:
+        _path = args.output
+        if os.path.isdir(_path):
+            _name = _now.strftime("%Y%m%dT%H%M%SZ")
+            _path = os.path.join(_path, f"{_name}-{result['revision'] or 'local'}.json")
+        with open(_path, "w") as fp:
+            json.dump(result, fp, indent=2, sort_keys=False)
+        print(f"\nwritten to {_path}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main(sys.argv[1:])
@@ -0,0 +1,270 @@
+"""
+An asynchronous credential endpoint.
+
+The credential constructors of the credential endpoint fetch the credential from an authentic
+source with a blocking HTTP request, which holds a WSGI worker for the whole round trip. Here
+the credential request is handled in three steps:
+
+1. The request is parsed and processed, within a unit of work, as usual except that the
+   credential constructors are not called. Their calls are recorded and a placeholder is
+   returned instead.
+2. The recorded calls are made concurrently, each as it was recorded.
+3. The placeholders in the response are replaced by the credentials.
+
+Everything that blocks, the storage I/O of the first step and the constructor calls, is done
+in a bounded thread pool so the event loop is never blocked. A thread handles one step of one
+request at a time, and the unit of work is kept per thread, so concurrent requests do not see
+each other's state. Configured by::
+
+    async_credential:
+      path: credential
+      max_workers: 32
+      timeout: 10
+
+and served by the ASGI application returned by :py:meth:`AsyncCredentialIssuance.asgi_app`.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import contextvars
+import functools
+import json
+import logging
+from typing import Any
+from typing import Callable
+from typing import Optional
+from urllib.parse import parse_qs
+import uuid
+
+from satosa.context import Context
+from satosa_idpyop.core.response import JsonResponse
+
+from satosa_openid4vci.metrics import ERRORS
+from satosa_openid4vci.tracing import TracedConstructor
+from satosa_openid4vci.tracing import span
+from satosa_openid4vci.unit_of_work import unit_of_work
+
+logger = logging.getLogger(__name__)
+
+PENDING_PREFIX = "urn:satosa-openid4vci:pending-credential:"
+
+_collecting = contextvars.ContextVar("collecting_credential_calls", default=None)
+
+
+class CollectingConstructor(object):
+    """
+    Stands in for a credential constructor. While calls are being collected, in this context,
+    a call is recorded and a placeholder returned, otherwise the constructor is called.
+
+    :param constructor: The credential constructor
+    :param name: The credential type it constructs
+    """
+
+    def __init__(self, constructor: Any, name: str):
+        self.constructor = constructor
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        _calls = _collecting.get()
+        if _calls is None:
+            return self.constructor(*args, **kwargs)
+        _placeholder = f"{PENDING_PREFIX}{uuid.uuid4().hex}"
+        _calls.append((self, _placeholder, args, kwargs))
+        return _placeholder
+
+    def __getattr__(self, item):
+        return getattr(self.constructor, item)
+
+    def __setattr__(self, key, value):
+        # Configuring the wrapper configures the constructor
+        if key in ("constructor", "name"):
+            object.__setattr__(self, key, value)
+        else:
+            setattr(self.constructor, key, value)
+
+
+def _layers(constructor: Any):
+    """The constructor and the wrappers around it, outermost first."""
+    while True:
+        yield constructor
+        if not isinstance(constructor, (CollectingConstructor, TracedConstructor)):
+            return
+        constructor = constructor.constructor
+
+
+def install_collectors(endpoint) -> dict:
+    """
+    Puts a CollectingConstructor in front of each credential constructor of the endpoint.
+
+    :return: The credential constructors, by credential type
+    """
+    _constructors = getattr(endpoint, "credential_constructor", None) or {}
+    for _name, _constructor in _constructors.items():
+        if not any(isinstance(_layer, CollectingConstructor) for _layer in _layers(_constructor)):
+            _constructors[_name] = CollectingConstructor(_constructor, _name)
+    return _constructors
+
+
+@contextmanager
+def collecting():
+    """
+    Within the block credential constructor calls are recorded, not made.
+    Gives the list the calls are recorded in, as (constructor, placeholder, args, kwargs).
+    """
+    _calls = []
+    _token = _collecting.set(_calls)
+    try:
+        yield _calls
+    finally:
+        _collecting.reset(_token)
+
+
+def replace_placeholders(item: Any, values: dict) -> Any:
+    """
+    Returns a copy of item, a structure of dicts and lists, where the placeholders are replaced.
+    """
+    if isinstance(item, str):
+        return values.get(item, item)
+    if isinstance(item, list):
+        return [replace_placeholders(i, values) for i in item]
+    if isinstance(item, dict):
+        return {k: replace_placeholders(v, values) for k, v in item.items()}
+    if hasattr(item, "to_dict"):
+        return replace_placeholders(item.to_dict(), values)
+    return item
+
+
+def _request_from_body(body: bytes, content_type: str) -> dict:
+    if not body:
+        return {}
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    return {k: v[0] if len(v) == 1 else v for k, v in parse_qs(body.decode()).items()}
+
+
+class AsyncCredentialIssuance(object):
+    """
+    :param frontend: The OpenID4VCIFrontend instance
+    :param path: Path of the credential endpoint
+    :param max_workers: Size of the thread pool the blocking work is done in
+    :param timeout: Seconds to wait for a credential constructor
+    """
+
+    def __init__(self, frontend, path: Optional[str] = "credential",
+                 max_workers: Optional[int] = 32, timeout: Optional[float] = 10, **kwargs):
+        self.frontend = frontend
+        self.path = path.strip("/")
+        self.timeout = timeout
+        self.wrapper = frontend.endpoint_wrapper["credential"]
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix="async-credential")
+
+        _endpoint = frontend.app.server["openid_credential_issuer"].get_endpoint("credential")
+        install_collectors(_endpoint)
+
+    async def _in_pool(self, func: Callable, *args, **kwargs) -> Any:
+        # In the pool with this context, so spans started there have the right parent
+        _call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, _call)
+
+    async def aclose(self):
+        self.executor.shutdown(wait=False)
+
+    def _process(self, context: Context) -> tuple:
+        with collecting() as _calls:
+            with unit_of_work(self.frontend.app.server) as _uow:
+                proc_req, _, _ = self.wrapper.handle_request(context)
+                _uow.flush_session_manager(self.frontend.get_entity_type())
+        return proc_req, _calls
+
+    async def construct(self, constructor: CollectingConstructor, args: tuple, kwargs: dict):
+        """
+        Makes a recorded credential constructor call, in the thread pool.
+        """
+        _call = self._in_pool(constructor.constructor, *args, **kwargs)
+        if self.timeout:
+            return await asyncio.wait_for(_call, self.timeout)
+        return await _call  # pragma: no cover
+
+    async def credential_endpoint(self, context: Context):
+        with span("async_credential_endpoint"):
+            proc_req, _calls = await self._in_pool(self._process, context)
+            if isinstance(proc_req, JsonResponse) or not _calls:
+                return await self._in_pool(self.wrapper.build_response, proc_req)
+
+            _results = await asyncio.gather(
+                *[self.construct(_constructor, _args, _kwargs)
+                  for _constructor, _, _args, _kwargs in _calls],
+                return_exceptions=True)
+
+            _values = {}
+            for (_constructor, _placeholder, _, _), _result in zip(_calls, _results):
+                if isinstance(_result, Exception):
+                    logger.warning("Credential constructor for %s failed: %r",
+                                   _constructor.name, _result)
+                    ERRORS.inc("authentic_source")
+                    return JsonResponse({"error": "server_error",
+                                         "error_description": "credential could not be issued"},
+                                        status="500")
+                _values[_placeholder] = _result
+
+            if "response_args" in proc_req:
+                proc_req["response_args"] = replace_placeholders(proc_req["response_args"],
+                                                                 _values)
+            return await self._in_pool(self.wrapper.build_response, proc_req)
+
+    def asgi_app(self):
+        """
+        An ASGI application serving the credential endpoint.
+        """
+
+        async def app(scope, receive, send):
+            if scope["type"] == "lifespan":
+                while True:
+                    _message = await receive()
+                    if _message["type"] == "lifespan.startup":
+                        await send({"type": "lifespan.startup.complete"})
+                    elif _message["type"] == "lifespan.shutdown":
+                        await self.aclose()
+                        await send({"type": "lifespan.shutdown.complete"})
+                        return
+
+            if scope["path"].strip("/") != self.path or scope["method"] != "POST":
+                await _send(send, 404, [], b"")
+                return
+
+            _body = b""
+            while True:
+                _message = await receive()
+                _body += _message.get("body", b"")
+                if not _message.get("more_body"):
+                    break
+
+            _headers = {k.decode("latin-1").lower(): v.decode("latin-1")
+                        for k, v in scope.get("headers", [])}
+            context = Context()
+            context.path = self.path
+            context.request_method = "POST"
+            context.http_headers = {f"HTTP_{k.upper().replace('-', '_')}": v
+                                    for k, v in _headers.items()}
+            context.request_authorization = _headers.get("authorization", "")
+            try:
+                context.request = _request_from_body(_body, _headers.get("content-type", ""))
+            except ValueError:
+                await _send(send, 400, [], b"")
+                return
+
+            response = await self.credential_endpoint(context)
+            _message = response.message
+            if isinstance(_message, str):
+                _message = _message.encode("utf-8")
+            await _send(send, int(str(response.status).split(" ", 1)[0]), response.headers,
+                        _message or b"")
+
+        return app
+
+
+async def _send(send, status: int, headers: list, body: bytes):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers]})
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,219 @@
+"""
+Decoding and validation of the authorization_details request parameter (RFC 9396).
+
+Wallets send authorization_details in more than one way:
+
+* as JSON, a list of objects or a single object,
+* as one urlencoded authorization detail,
+* as a bracketed list of quoted, urlencoded authorization details,
+  ``["type=openid_credential&format=vc%2Bsd-jwt&vct=PID", "type=..."]``,
+* already decoded, a list of dicts or urlencoded strings.
+
+All of them are decoded into a list of dicts. The authorization details are checked against the
+credential issuer's credential_configurations_supported by an
+:py:class:`AuthorizationDetailsValidator` that uses the credential issuer's index of them.
+Authorization details of other types, or asking for credentials that are not supported, are
+let through unless the validation is strict. With limit_claims the authorization endpoint asks
+the backend only for the claims of the credentials the authorization details ask for, instead
+of all of claims_supported::
+
+    authorization_details:
+      strict: true
+      limit_claims: true
+"""
+import json
+import logging
+from typing import Any
+from typing import Optional
+from typing import Union
+
+from openid4v.message import AuthorizationDetail
+
+from satosa_openid4vci.credential_index import CredentialConfigurationIndex
+
+logger = logging.getLogger(__name__)
+
+OPENID_CREDENTIAL = "openid_credential"
+
+
+class AuthorizationDetailsError(ValueError):
+    pass
+
+
+def _split_bracketed(value: str) -> list:
+    """
+    Splits ``[a, "b", 'c,d']`` into its items in one pass. Commas within quotes do not split.
+    """
+    items = []
+    _start = 1
+    _quote = None
+    for _pos in range(1, len(value) - 1):
+        _char = value[_pos]
+        if _quote:
+            if _char == _quote:
+                _quote = None
+        elif _char in "\"'":
+            _quote = _char
+        elif _char == ",":
+            items.append(value[_start:_pos])
+            _start = _pos + 1
+    if _quote:
+        raise AuthorizationDetailsError("Unterminated quote in authorization_details")
+    items.append(value[_start:-1])
+
+    _items = []
+    for _item in items:
+        _item = _item.strip()
+        if len(_item) >= 2 and _item[0] == _item[-1] and _item[0] in "\"'":
+            _item = _item[1:-1]
+        if _item:
+            _items.append(_item)
+    return _items
+
+
+def _from_urlencoded(value: str) -> dict:
+    if not value or "=" not in value:
+        raise AuthorizationDetailsError(f"Not an authorization detail: {value!r}")
+    try:
+        return AuthorizationDetail().from_urlencoded(value).to_dict()
+    except Exception as err:
+        raise AuthorizationDetailsError(f"Not an authorization detail: {err}") from err
+
+
+def _item(item: Any) -> dict:
+    if isinstance(item, dict):
+        return item
+    if isinstance(item, str):
+        _value = item.strip()
+        if _value.startswith("{"):
+            try:
+                return _item(json.loads(_value))
+            except ValueError as err:
+                raise AuthorizationDetailsError("Invalid JSON in authorization_details") from err
+        return _from_urlencoded(_value)
+    if hasattr(item, "to_dict"):
+        return item.to_dict()
+    raise AuthorizationDetailsError(f"Not an authorization detail: {type(item).__name__}")
+
+
+def parse_authorization_details(value: Any) -> list:
+    """
+    Decodes authorization_details, whichever of the supported forms it comes in.
+
+    :return: A list of dicts
+    """
+    if isinstance(value, (list, tuple)):
+        return [_item(_i) for _i in value]
+    if not isinstance(value, str):
+        return [_item(value)]
+
+    _value = value.strip()
+    if _value.startswith("["):
+        if not _value.endswith("]"):
+            raise AuthorizationDetailsError("Unterminated list in authorization_details")
+        try:
+            _decoded = json.loads(_value)
+        except ValueError:
+            return [_from_urlencoded(_i) for _i in _split_bracketed(_value)]
+        return parse_authorization_details(_decoded)
+    if _value.startswith("{"):
+        return [_item(_value)]
+    if not _value:
+        return []
+    return [_from_urlencoded(_value)]
+
+
+def decode_authorization_details(request: dict) -> dict:
+    """
+    Replaces authorization_details in the request with the decoded list.
+    """
+    if "authorization_details" in request:
+        request["authorization_details"] = parse_authorization_details(
+            request["authorization_details"])
+    return request
+
+
+class AuthorizationDetailsValidator(object):
+    """
+    Checks authorization details against credential_configurations_supported. The lookup
+    tables are those of a
+    :py:class:`satosa_openid4vci.credential_index.CredentialConfigurationIndex`, each
+    authorization detail is checked with a dict lookup.
+
+    :param credential_configurations_supported: From the credential issuer metadata, or an
+        index built from it
+    :param strict: Whether authorization details of other types, or asking for credentials
+        that are not supported, are refused
+    """
+
+    def __init__(self, credential_configurations_supported: Optional[
+            Union[dict, CredentialConfigurationIndex]] = None,
+                 strict: Optional[bool] = False):
+        self.strict = strict
+        if isinstance(credential_configurations_supported, CredentialConfigurationIndex):
+            self.index = credential_configurations_supported
+        else:
+            self.index = CredentialConfigurationIndex(credential_configurations_supported)
+
+    def __bool__(self):
+        return bool(self.index)
+
+    def match(self, detail: dict) -> Optional[str]:
+        """
+        :return: The id of the credential configuration the authorization detail asks for,
+            None if it does not point out one
+        """
+        try:
+            return self._match(detail)
+        except TypeError as err:  # unhashable values
+            raise AuthorizationDetailsError(f"Malformed authorization detail: {err}") from err
+
+    def _match(self, detail: dict) -> Optional[str]:
+        _id = detail.get("credential_configuration_id")
+        if _id:
+            if _id not in self.index:
+                raise AuthorizationDetailsError(f"Unknown credential configuration: {_id}")
+            return _id
+
+        _format = detail.get("format")
+        if not _format:
+            raise AuthorizationDetailsError("Neither credential_configuration_id nor format")
+        if _format not in self.index.formats:
+            raise AuthorizationDetailsError(f"Unsupported format: {_format}")
+
+        if detail.get("vct"):
+            _id = self.index.by_vct.get((_format, detail["vct"]))
+            _what = detail["vct"]
+        elif detail.get("doctype"):
+            _id = self.index.by_doctype.get((_format, detail["doctype"]))
+            _what = detail["doctype"]
+        elif (detail.get("credential_definition") or {}).get("type"):
+            _types = detail["credential_definition"]["type"]
+            _id = self.index.by_type.get((_format, frozenset(_types)))
+            _what = _types
+        else:
+            return None
+        if _id is None:
+            raise AuthorizationDetailsError(f"Unsupported credential: {_what}")
+        return _id
+
+    def validate(self, details: list) -> list:
+        """
+        :return: The ids of the credential configurations asked for, None for an authorization
+            detail that does not point out a supported one
+        :raises AuthorizationDetailsError: If the validation is strict and any of the
+            authorization details is not supported
+        """
+        _ids = []
+        for _detail in details:
+            try:
+                if _detail.get("type") != OPENID_CREDENTIAL:
+                    raise AuthorizationDetailsError(
+                        f"Unsupported authorization details type: {_detail.get('type')}")
+                _ids.append(self.match(_detail))
+            except AuthorizationDetailsError as err:
+                if self.strict:
+                    raise
+                logger.debug("Authorization detail let through: %s", err)
+                _ids.append(None)
+        return _ids
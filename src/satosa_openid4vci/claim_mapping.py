@@ -0,0 +1,121 @@
+"""
+Mapping between SATOSA's internal attributes and the claims of an attribute profile.
+
+SATOSA's AttributeMapper works out the mapping of every attribute anew on each call. The
+frontend compiles it once per attribute profile and set of supported claims, into a
+:py:class:`ClaimMappingPlan`. The plan knows which internal attributes to ask the backend for
+and turns the attributes the backend returns into claims, leaving out empty values and
+combining multiple values, in one pass.
+"""
+import logging
+import threading
+from typing import Callable
+from typing import Iterable
+from typing import Optional
+
+from satosa.attribute_mapping import AttributeMapper
+from satosa_idpyop.core.claims import combine_claim_values
+
+logger = logging.getLogger(__name__)
+
+try:
+    from satosa_idpyop.core.claims import combine_values_by_claim
+except ImportError:  # pragma: no cover
+    combine_values_by_claim = None
+
+
+def _combiner(claim: str) -> Callable:
+    if combine_values_by_claim is not None:
+        return combine_values_by_claim[claim]
+
+    def combine(values):  # pragma: no cover
+        return dict(combine_claim_values([(claim, values)]))[claim]
+
+    return combine
+
+
+def _is_nested(converter: AttributeMapper, name: str) -> bool:
+    _is_nested_attribute_name = getattr(converter, "_is_nested_attribute_name", None)
+    if _is_nested_attribute_name:
+        return _is_nested_attribute_name(name)
+    return converter.separator in name  # pragma: no cover
+
+
+def _nest(path: tuple, value):
+    for _name in reversed(path):
+        value = {_name: value}
+    return value
+
+
+class ClaimMappingPlan(object):
+    """
+    :param converter: The frontend's attribute mapper
+    :param profile: The attribute profile, like "openid"
+    :param claims_supported: The claims that may be asked for
+    """
+
+    def __init__(self, converter: AttributeMapper, profile: str,
+                 claims_supported: Optional[Iterable[str]] = None):
+        self.profile = profile
+        # The internal attributes to ask the backend for
+        self.attributes = converter.to_internal_filter(profile, claims_supported or [])
+
+        # internal attribute name -> (claim, path within the claim)
+        self.targets = {}
+        self.combiners = {}
+        for _internal, _mapping in converter.from_internal_attributes.items():
+            if profile not in _mapping:
+                continue
+            _external = _mapping[profile][0]
+            if _is_nested(converter, _external):
+                _names = _external.split(converter.separator)
+                self.targets[_internal] = (_names[0], tuple(_names[1:]))
+            else:
+                self.targets[_internal] = (_external, ())
+            _claim = self.targets[_internal][0]
+            self.combiners[_claim] = _combiner(_claim)
+
+    def claims(self, attributes: dict) -> dict:
+        """
+        The same as ``converter.from_internal(profile, attributes)`` with the empty values
+        removed and the values combined by ``combine_claim_values``.
+        """
+        _claims = {}
+        for _name, _value in attributes.items():
+            _target = self.targets.get(_name)
+            if _target is None:
+                continue
+            _claim, _path = _target
+            _claims[_claim] = _nest(_path, _value) if _path else _value
+        return {_claim: self.combiners[_claim](_value) for _claim, _value in _claims.items()
+                if _value}
+
+
+class ClaimMappingPlans(object):
+    """
+    The compiled plans, one per attribute profile and set of supported claims.
+
+    :param converter: The frontend's attribute mapper
+    """
+
+    def __init__(self, converter: AttributeMapper):
+        self.converter = converter
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def get(self, profile: str,
+            claims_supported: Optional[Iterable[str]] = None) -> ClaimMappingPlan:
+        _key = (profile, frozenset(claims_supported or []))
+        _plan = self._plans.get(_key)
+        if _plan is None:
+            with self._lock:
+                _plan = self._plans.get(_key)
+                if _plan is None:
+                    logger.debug("Compiling the %s claim mapping for %s", profile, _key[1])
+                    _plan = self._plans[_key] = ClaimMappingPlan(self.converter, profile,
+                                                                 claims_supported)
+        return _plan
+
+    def invalidate(self):
+        with self._lock:
+            self._plans = {}
@@ -0,0 +1,158 @@
+"""
+In-process cache of client information.
+
+Every request that needs to know the client looks it up in the persistence layer, by client id
+or by the Basic or Bearer authorization header. The cache remembers what was found, and what
+was not found, for a while. Concurrent lookups of the same client wait for the one lookup
+that is under way instead of all going to the storage. Configured in the frontend
+configuration::
+
+    client_cache:
+      ttl: 300
+      negative_ttl: 10
+      max_size: 10000
+
+The cache is emptied of a client when its information is written by a persistence layer in
+this process, see satosa_openid4vci.client_lookup. Writes made by other processes are only
+seen when the entry expires, which is why entries, and above all negative entries, are short
+lived.
+"""
+from collections import OrderedDict
+import copy
+import hashlib
+import logging
+import threading
+import time
+from typing import Any
+from typing import Callable
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+BY_CLIENT_ID = "client_id"
+BY_BASIC_AUTH = "basic"
+BY_BEARER_TOKEN = "bearer"
+
+# Stands for "no such client" in the cache
+_MISSING = object()
+
+
+class _Flight(object):
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ClientInfoCache(object):
+    """
+    :param ttl: Seconds client information is kept
+    :param negative_ttl: Seconds it is remembered that a client was not found
+    :param max_size: Max number of entries, the least recently used are dropped
+    """
+
+    def __init__(self, ttl: Optional[int] = 300, negative_ttl: Optional[int] = 10,
+                 max_size: Optional[int] = 10000, **kwargs):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._by_client = {}
+        self._flights = {}
+        self._lock = threading.Lock()
+        # Bumped by invalidate, a lookup that was under way meanwhile is not cached
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(kind: str, value: str) -> tuple:
+        if kind == BY_CLIENT_ID:
+            return kind, value
+        # authorization headers are secrets, only digests are kept
+        return kind, hashlib.sha256(value.encode()).hexdigest()
+
+    def _get(self, key: tuple) -> Any:
+        _entry = self._entries.get(key)
+        if _entry is None:
+            return None
+        _expires, _value = _entry
+        if _expires <= time.time():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return _value
+
+    def _put(self, key: tuple, value: Any):
+        if value is _MISSING:
+            _expires = time.time() + self.negative_ttl
+        else:
+            _expires = time.time() + self.ttl
+            self._by_client.setdefault(value.get("client_id", ""), set()).add(key)
+        self._entries[key] = (_expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: tuple):
+        _entry = self._entries.pop(key, None)
+        if _entry and _entry[1] is not _MISSING:
+            _keys = self._by_client.get(_entry[1].get("client_id", ""))
+            if _keys:
+                _keys.discard(key)
+
+    def lookup(self, kind: str, value: str, load: Callable) -> Optional[dict]:
+        """
+        :param kind: What value is, a client id or an authorization header
+        :param value: The client id or authorization header
+        :param load: Finds the client information in the persistence layer
+        :return: A copy of the client information, None if there is no such client
+        """
+        key = self._key(kind, value)
+        with self._lock:
+            _value = self._get(key)
+            if _value is not None:
+                self.hits += 1
+                return None if _value is _MISSING else copy.deepcopy(_value)
+            self.misses += 1
+            _flight = self._flights.get(key)
+            _leader = _flight is None
+            if _leader:
+                _flight = self._flights[key] = _Flight()
+            _generation = self._generation
+
+        if not _leader:
+            _flight.event.wait()
+            if _flight.error is not None:
+                raise _flight.error
+            return copy.deepcopy(_flight.value)
+
+        try:
+            _flight.value = load() or None
+        except Exception as err:
+            _flight.error = err
+            raise
+        finally:
+            with self._lock:
+                if _flight.error is None and _generation == self._generation:
+                    self._put(key, copy.deepcopy(_flight.value) if _flight.value else _MISSING)
+                del self._flights[key]
+            _flight.event.set()
+        return copy.deepcopy(_flight.value)
+
+    def invalidate(self, client_id: str):
+        """
+        Forgets everything about the client, and that it was not found.
+        """
+        with self._lock:
+            self._generation += 1
+            for _key in list(self._by_client.pop(client_id, ())):
+                self._entries.pop(_key, None)
+            self._entries.pop((BY_CLIENT_ID, client_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_client.clear()
@@ -0,0 +1,161 @@
+"""
+Secondary indexes from credentials to clients.
+
+Finding the client from a Bearer or Basic authorization header means, without an index, going
+through the sessions or the clients until a match is found. The token index maps a digest of
+the access token to the client id. The client index maps the client id to an HMAC of the
+client secret, made with a key that never leaves the server, so a copy of the storage does
+not give away the secrets. The indexes are kept in the storage of the persistence layer, so
+they are shared by everyone using the storage, and updated when tokens are issued and client
+information is written::
+
+    client_index:
+      token_ttl: 3600
+      client_ttl: 3600
+      key: a long random string
+
+Workers sharing the storage must share the key. Without one a key is made up by each process,
+and a worker then does not recognise the records written by another worker and writes them
+again.
+
+The indexes are used, and kept up to date, by satosa_openid4vci.client_lookup. An entry
+missing from the index is looked up the old way and added to the index. Access tokens
+are indexed for as long as they are valid, client secrets for client_ttl seconds. The entry of
+a client is replaced when its secret is changed and removed when the client is. If the storage
+can not store a time to live with a record, the expiry is stored in the record and an expired
+record is removed when looked up. Records never looked up again are removed by the gc sweeper,
+or in a one-file-per-key storage by script/expire_stored_dir.py with the patterns
+``client_by_token*`` and ``client_by_basic*``.
+"""
+import base64
+import hashlib
+import hmac
+import inspect
+import json
+import logging
+import os
+import time
+from typing import Any
+from typing import Optional
+from urllib.parse import unquote_plus
+
+logger = logging.getLogger(__name__)
+
+TOKEN_INDEX = "client_by_token"
+BASIC_INDEX = "client_by_basic"
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def basic_credentials(authorization: str) -> Optional[tuple]:
+    """
+    :return: (client_id, client_secret) from a Basic authorization header
+    """
+    _, _, _value = authorization.partition("Basic ")
+    try:
+        _decoded = base64.b64decode(_value.strip()).decode()
+    except (ValueError, UnicodeDecodeError):
+        return None
+    _client_id, _sep, _secret = _decoded.partition(":")
+    if not _sep:
+        return None
+    return unquote_plus(_client_id), unquote_plus(_secret)
+
+
+class ClientIndex(object):
+    """
+    :param storage: The storage the indexes are kept in
+    :param token_ttl: Seconds an access token is indexed, if the token response has no
+        expires_in
+    :param client_ttl: Seconds a client secret is indexed
+    :param key: Key of the HMAC of client secrets, the same in all workers
+    """
+
+    def __init__(self, storage: Any, token_ttl: Optional[int] = 3600,
+                 client_ttl: Optional[int] = 3600, key: Optional[str] = None, **kwargs):
+        self.storage = storage
+        self.token_ttl = token_ttl
+        self.client_ttl = client_ttl
+        self._key = key.encode() if key else os.urandom(32)
+        try:
+            self._native_ttl = "ttl" in inspect.signature(storage.store).parameters
+        except (TypeError, ValueError):  # pragma: no cover
+            self._native_ttl = False
+
+    def _mac(self, client_secret: str) -> str:
+        return hmac.new(self._key, client_secret.encode(), hashlib.sha256).hexdigest()
+
+    def _store(self, information_type: str, key: str, value: dict, ttl: Optional[int] = None):
+        _kwargs = {}
+        if ttl and self._native_ttl:
+            _kwargs["ttl"] = ttl
+        elif ttl:
+            value = dict(value, expires_at=time.time() + ttl)
+        self.storage.store(information_type=information_type, value=value, key=key, **_kwargs)
+
+    def _fetch(self, information_type: str, key: str) -> Optional[dict]:
+        try:
+            _value = self.storage.fetch(information_type=information_type, key=key) or None
+        except KeyError:
+            return None
+        if isinstance(_value, str):
+            # written by an older version
+            return {"client_id": _value}
+        if isinstance(_value, dict) and "expires_at" in _value:
+            if _value["expires_at"] <= time.time():
+                self.storage.delete(information_type=information_type, key=key)
+                return None
+        return _value
+
+    # ---- writing ----
+
+    def add_token(self, access_token: str, client_id: str, expires_in: Optional[int] = None):
+        self._store(TOKEN_INDEX, _digest(access_token), {"client_id": client_id},
+                    expires_in or self.token_ttl)
+
+    def add_client(self, client_id: str, client_secret: str):
+        """
+        Indexes the client secret, replacing what was indexed for the client.
+        """
+        self._store(BASIC_INDEX, client_id,
+                    {"client_id": client_id, "secret": self._mac(client_secret)},
+                    self.client_ttl)
+
+    def remove_client(self, client_id: str):
+        try:
+            self.storage.delete(information_type=BASIC_INDEX, key=client_id)
+        except KeyError:  # pragma: no cover
+            pass
+
+    def add_token_response(self, response: Any, client_id: str):
+        """
+        Indexes the access token in a token endpoint response.
+        """
+        if not client_id:
+            return
+        _message = getattr(response, "message", None)
+        try:
+            _info = json.loads(_message) if _message else {}
+        except (TypeError, ValueError):
+            return
+        if isinstance(_info, dict) and isinstance(_info.get("access_token"), str):
+            self.add_token(_info["access_token"], client_id, _info.get("expires_in"))
+
+    # ---- lookups ----
+
+    def client_by_bearer_token(self, authorization: str) -> Optional[str]:
+        _token = authorization.partition("Bearer ")[2].strip()
+        _record = self._fetch(TOKEN_INDEX, _digest(_token)) if _token else None
+        return _record.get("client_id") if _record else None
+
+    def client_by_basic_auth(self, authorization: str) -> Optional[str]:
+        _credentials = basic_credentials(authorization)
+        if _credentials is None:
+            return None
+        _client_id, _secret = _credentials
+        _record = self._fetch(BASIC_INDEX, _client_id)
+        if _record and hmac.compare_digest(_record.get("secret", ""), self._mac(_secret)):
+            return _client_id
+        return None
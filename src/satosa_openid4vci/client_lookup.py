@@ -0,0 +1,114 @@
+"""
+Where load_cdb finds client information.
+
+The client is found by its client id or by the Basic or Bearer authorization header. In front
+of the persistence layer there may be the client index, mapping credentials to clients in the
+storage shared by all workers, and the client information cache of this process. The lookup
+goes through them in that order::
+
+    cache -> index -> persistence layer
+
+and what the persistence layer finds is added to the index. When client information is written
+by a persistence layer the index is updated first and then the cache is emptied of the client,
+so a lookup under way meanwhile can not put stale information back in the cache.
+"""
+import logging
+from typing import Any
+from typing import Callable
+from typing import Optional
+
+from satosa_openid4vci.client_cache import BY_BASIC_AUTH
+from satosa_openid4vci.client_cache import BY_BEARER_TOKEN
+from satosa_openid4vci.client_cache import BY_CLIENT_ID
+from satosa_openid4vci.client_index import basic_credentials
+
+logger = logging.getLogger(__name__)
+
+
+class ClientLookup(object):
+    """
+    :param index: A ClientIndex, if credentials are indexed
+    :param cache: A ClientInfoCache, if client information is cached
+    """
+
+    def __init__(self, index: Optional[Any] = None, cache: Optional[Any] = None):
+        self.index = index
+        self.cache = cache
+
+    def _cached(self, kind: str, value: str, load: Callable) -> Optional[dict]:
+        if self.cache is not None:
+            return self.cache.lookup(kind, value, load)
+        return load() or None
+
+    def by_client_id(self, client_id: str, load: Callable) -> Optional[dict]:
+        """
+        :param load: Restores the client information from the persistence layer
+        """
+        return self._cached(BY_CLIENT_ID, client_id, load)
+
+    def by_basic_auth(self, persistence: Any, authorization: str) -> Optional[dict]:
+        def _load():
+            if self.index is not None:
+                _client_id = self.index.client_by_basic_auth(authorization)
+                if _client_id:
+                    return persistence.restore_client_info(_client_id)
+            client_info = persistence.restore_client_info_by_basic_auth(authorization)
+            _credentials = basic_credentials(authorization)
+            if (self.index is not None and client_info and _credentials
+                    and client_info.get("client_id") == _credentials[0]):
+                self.index.add_client(*_credentials)
+            return client_info
+
+        return self._cached(BY_BASIC_AUTH, authorization, _load)
+
+    def by_bearer_token(self, persistence: Any, authorization: str) -> Optional[dict]:
+        def _load():
+            if self.index is not None:
+                _client_id = self.index.client_by_bearer_token(authorization)
+                if _client_id:
+                    return persistence.restore_client_info(_client_id)
+            client_info = persistence.restore_client_info_by_bearer_token(authorization)
+            if self.index is not None and client_info and client_info.get("client_id"):
+                self.index.add_token(authorization.partition("Bearer ")[2].strip(),
+                                     client_info["client_id"])
+            return client_info
+
+        return self._cached(BY_BEARER_TOKEN, authorization, _load)
+
+    def client_info_stored(self, client_id: str, context: Optional[Any] = None):
+        """
+        Brings the index up to date after the client information was written.
+
+        :param context: Context of the guise the client information was written by, has the
+            client database. Without it the index is left as it is.
+        """
+        if self.index is None or context is None:
+            return
+        _cdb = getattr(context, "cdb", None) or {}
+        _secret = (_cdb.get(client_id) or {}).get("client_secret")
+        if _secret:
+            self.index.add_client(client_id, _secret)
+        else:
+            # the client is gone, or authenticates some other way now
+            self.index.remove_client(client_id)
+
+    def install(self, persistence: Any, context: Optional[Any] = None):
+        """
+        Makes a persistence layer report the client information it writes.
+
+        :param context: Context of the guise the persistence layer belongs to
+        """
+        _store_client_info = getattr(persistence, "store_client_info", None)
+        if _store_client_info is None:  # pragma: no cover
+            return
+
+        def store_client_info(client_id: str, *args, **kwargs):
+            try:
+                _result = _store_client_info(client_id, *args, **kwargs)
+                self.client_info_stored(client_id, context)
+                return _result
+            finally:
+                if self.cache is not None:
+                    self.cache.invalidate(client_id)
+
+        persistence.store_client_info = store_client_info
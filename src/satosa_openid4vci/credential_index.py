@@ -0,0 +1,153 @@
+"""
+An index over the credential issuer's credential_configurations_supported.
+
+The index is built once, when the credential issuer is set up, and is not changed after that.
+If the configuration changes a new index is built. Finding the credential configuration an
+authorization detail or credential request points to is a dict lookup, and the claims that
+may, or must, go into a credential are sets.
+"""
+from collections import namedtuple
+import logging
+from types import MappingProxyType
+from typing import Iterable
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+CredentialConfiguration = namedtuple(
+    "CredentialConfiguration",
+    ["id", "format", "vct", "doctype", "types", "claims", "mandatory", "binding_methods",
+     "signing_algs", "proof_types", "proof_signing_algs", "constructor"])
+
+MSO_MDOC = "mso_mdoc"
+
+
+def _claim_names(conf: dict) -> tuple:
+    """
+    The names of the claims a credential configuration lists and those of them that are
+    mandatory. Claims are listed in one of these ways:
+
+    * ``claims: {given_name: {mandatory: true}, ...}``
+    * ``claims: {namespace: {given_name: {...}, ...}}`` for mso_mdoc
+    * ``claims: [{path: [given_name], mandatory: true}, ...]``
+    * ``credential_definition: {credentialSubject: {given_name: {...}, ...}}``
+
+    :return: Tuple of two frozensets, all the claims and the mandatory ones. All the claims
+        is None if the configuration does not list any.
+    """
+    _claims = conf.get("claims")
+    if not _claims:
+        _claims = (conf.get("credential_definition") or {}).get("credentialSubject")
+    if not _claims:
+        return None, frozenset()
+
+    _items = []
+    if isinstance(_claims, list):
+        for _claim in _claims:
+            _path = _claim.get("path") or []
+            if _path:
+                _items.append((_path[-1], _claim))
+    elif conf.get("format") == MSO_MDOC:
+        for _namespace in _claims.values():
+            _items.extend((_namespace or {}).items())
+    else:
+        _items = list(_claims.items())
+
+    _all = frozenset(_name for _name, _ in _items)
+    _mandatory = frozenset(_name for _name, _spec in _items
+                           if isinstance(_spec, dict) and _spec.get("mandatory"))
+    return _all, _mandatory
+
+
+def compile_configuration(configuration_id: str, conf: dict,
+                          constructor: Optional[object] = None) -> CredentialConfiguration:
+    _claims, _mandatory = _claim_names(conf)
+    _proof_types = conf.get("proof_types_supported") or {}
+    _proof_signing_algs = set()
+    for _proof in _proof_types.values():
+        _proof_signing_algs.update((_proof or {}).get("proof_signing_alg_values_supported", []))
+    return CredentialConfiguration(
+        id=configuration_id,
+        format=conf.get("format", ""),
+        vct=conf.get("vct"),
+        doctype=conf.get("doctype"),
+        types=frozenset((conf.get("credential_definition") or {}).get("type") or []),
+        claims=_claims,
+        mandatory=_mandatory,
+        binding_methods=frozenset(conf.get("cryptographic_binding_methods_supported") or []),
+        signing_algs=tuple(conf.get("credential_signing_alg_values_supported") or []),
+        proof_types=frozenset(_proof_types),
+        proof_signing_algs=frozenset(_proof_signing_algs),
+        constructor=constructor)
+
+
+class CredentialConfigurationIndex(object):
+    """
+    :param credential_configurations_supported: From the credential issuer metadata
+    :param constructors: The credential constructors, by credential configuration id
+    """
+
+    def __init__(self, credential_configurations_supported: Optional[dict] = None,
+                 constructors: Optional[dict] = None):
+        constructors = constructors or {}
+        _configurations = {}
+        _formats = set()
+        _by_vct = {}
+        _by_doctype = {}
+        _by_type = {}
+        for _id, _conf in (credential_configurations_supported or {}).items():
+            _entry = compile_configuration(_id, _conf, constructors.get(_id))
+            _configurations[_id] = _entry
+            _formats.add(_entry.format)
+            if _entry.vct:
+                _by_vct.setdefault((_entry.format, _entry.vct), _id)
+            if _entry.doctype:
+                _by_doctype.setdefault((_entry.format, _entry.doctype), _id)
+            if _entry.types:
+                _by_type.setdefault((_entry.format, _entry.types), _id)
+
+        self.configurations = MappingProxyType(_configurations)
+        self.formats = frozenset(_formats)
+        self.by_vct = MappingProxyType(_by_vct)
+        self.by_doctype = MappingProxyType(_by_doctype)
+        self.by_type = MappingProxyType(_by_type)
+
+    def __bool__(self):
+        return bool(self.configurations)
+
+    def __contains__(self, configuration_id: str):
+        return configuration_id in self.configurations
+
+    def __getitem__(self, configuration_id: str) -> CredentialConfiguration:
+        return self.configurations[configuration_id]
+
+    def get(self, configuration_id: str) -> Optional[CredentialConfiguration]:
+        return self.configurations.get(configuration_id)
+
+    def claims(self, configuration_ids: Iterable[str]) -> Optional[frozenset]:
+        """
+        :return: The claims that may go into any of the credentials, None if one of them does
+            not list its claims, which means there is no limit
+        """
+        _claims = frozenset()
+        for _id in configuration_ids:
+            _entry = self.configurations.get(_id)
+            if _entry is None or _entry.claims is None:
+                return None
+            _claims |= _entry.claims
+        return _claims
+
+    def filter_claims(self, configuration_id: str, claims: dict) -> dict:
+        """
+        :return: The claims that may go into a credential of the configuration
+        """
+        _allowed = self.configurations[configuration_id].claims
+        if _allowed is None:
+            return dict(claims)
+        return {_name: _value for _name, _value in claims.items() if _name in _allowed}
+
+    def missing_claims(self, configuration_id: str, claims: Iterable[str]) -> frozenset:
+        """
+        :return: The mandatory claims of the configuration that are not among claims
+        """
+        return self.configurations[configuration_id].mandatory.difference(claims)
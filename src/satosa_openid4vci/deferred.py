@@ -0,0 +1,172 @@
+"""
+Deferred credential issuance.
+
+In deferred mode the credential endpoint does not wait for the credential constructors. The
+request is processed as usual but the constructor calls are put on a job queue and the client
+gets a transaction id back at once. A pool of workers makes the calls and stores the result,
+which the client then fetches from the deferred credential endpoint::
+
+    deferred_credential:
+      path: deferred_credential
+      max_workers: 8
+      max_pending: 1000
+      interval: 5
+      ttl: 3600
+      storage:
+        class: satosa_openid4vci.storage.redis_db.RedisDB
+        kwargs:
+          url: redis://localhost:6379/0
+          prefix: "deferred:"
+
+The deferred credential request may reach another process than the credential request, the
+storage must be shared by all of them. Without a storage configuration the credential
+issuer's persistence storage is used.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import inspect
+import logging
+import secrets
+import threading
+import time
+from typing import Any
+from typing import Optional
+
+from idpyoidc.server.util import execute
+
+from satosa_openid4vci.async_credential import replace_placeholders
+from satosa_openid4vci.metrics import ERRORS
+from satosa_openid4vci.storage.tracking import ChangeTrackingStorage
+
+logger = logging.getLogger(__name__)
+
+INFORMATION_TYPE = "deferred_credential"
+
+STATUS_PENDING = "pending"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+
+class LocalJobQueue(object):
+    """
+    A bounded job queue worked off by a pool of threads in this process.
+
+    :param max_workers: Number of worker threads
+    :param max_pending: Max number of jobs queued or running
+    """
+
+    def __init__(self, max_workers: Optional[int] = 8, max_pending: Optional[int] = 1000):
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix="deferred-issuance")
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args) -> bool:
+        """
+        :return: False if the queue is full and the job was not accepted
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return False
+            self._pending += 1
+        _future = self.executor.submit(func, *args)
+        _future.add_done_callback(self._done)
+        return True
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def __len__(self):
+        return self._pending
+
+    def shutdown(self, wait: Optional[bool] = True):
+        self.executor.shutdown(wait=wait)
+
+
+class DeferredIssuance(object):
+    """
+    Keeps track of the deferred issuance transactions.
+
+    :param storage: Where transactions are kept, a storage instance or a configuration of one.
+        Shared by all the processes serving the frontend.
+    :param queue: The job queue, by default a LocalJobQueue
+    :param max_workers: Worker threads of the default queue
+    :param max_pending: Max number of transactions being worked on
+    :param interval: Seconds a client is asked to wait between polls
+    :param ttl: Seconds a transaction is kept
+    """
+
+    def __init__(self, storage: Any, queue: Optional[Any] = None,
+                 max_workers: Optional[int] = 8, max_pending: Optional[int] = 1000,
+                 interval: Optional[int] = 5, ttl: Optional[int] = 3600, **kwargs):
+        if storage is None:
+            raise ValueError("Deferred issuance needs a storage shared by all processes")
+        if isinstance(storage, dict) and "class" in storage:
+            storage = execute(storage)
+        if isinstance(storage, ChangeTrackingStorage):
+            # Transactions are written when they change, not when a unit of work ends
+            storage = storage.storage
+        self.storage = storage
+        if queue is None:
+            queue = LocalJobQueue(max_workers=max_workers, max_pending=max_pending)
+        self.queue = queue
+        self.interval = interval
+        self.ttl = ttl
+        try:
+            self._native_ttl = "ttl" in inspect.signature(storage.store).parameters
+        except (TypeError, ValueError):  # pragma: no cover
+            self._native_ttl = False
+
+    def _store(self, transaction_id: str, info: dict):
+        _kwargs = {"ttl": self.ttl} if self._native_ttl else {}
+        self.storage.store(information_type=INFORMATION_TYPE, value=info, key=transaction_id,
+                           **_kwargs)
+
+    def submit(self, response_args: dict, calls: list, client_id: str) -> Optional[str]:
+        """
+        Queues the credential constructor calls of a processed credential request.
+
+        :param response_args: The response with placeholders where the credentials go
+        :param calls: The recorded constructor calls
+        :param client_id: The client that may fetch the result
+        :return: The transaction id, None if the queue is full
+        """
+        transaction_id = secrets.token_urlsafe(32)
+        self._store(transaction_id, {"status": STATUS_PENDING, "client_id": client_id,
+                                     "created": time.time()})
+        if not self.queue.submit(self._run, transaction_id, response_args, calls, client_id):
+            self.storage.delete(information_type=INFORMATION_TYPE, key=transaction_id)
+            return None
+        return transaction_id
+
+    def _run(self, transaction_id: str, response_args: dict, calls: list, client_id: str):
+        _info = {"client_id": client_id, "created": time.time()}
+        try:
+            _values = {_placeholder: _constructor.constructor(*_args, **_kwargs)
+                       for _constructor, _placeholder, _args, _kwargs in calls}
+            _info["response"] = replace_placeholders(response_args, _values)
+            _info["status"] = STATUS_READY
+        except Exception as err:
+            logger.warning("Deferred issuance %s failed: %s", transaction_id, err)
+            ERRORS.inc("credential_constructor")
+            _info["status"] = STATUS_FAILED
+        self._store(transaction_id, _info)
+
+    def fetch(self, transaction_id: str, client_id: str) -> Optional[dict]:
+        """
+        Looks up a transaction. A transaction that is done is removed.
+
+        :return: The transaction, None if there is no such transaction for this client
+        """
+        _info = self.storage.fetch(information_type=INFORMATION_TYPE, key=transaction_id)
+        if not _info:
+            return None
+        if not self._native_ttl and time.time() - _info.get("created", 0) > self.ttl:
+            self.storage.delete(information_type=INFORMATION_TYPE, key=transaction_id)
+            return None
+        if _info.get("client_id") != client_id:
+            return None
+        if _info["status"] != STATUS_PENDING:
+            self.storage.delete(information_type=INFORMATION_TYPE, key=transaction_id)
+        return _info
@@ -15,12 +15,17 @@ from idpyoidc.server.authn_event import create_authn_event
 from openid4v.message import AuthorizationRequest
 import satosa
 from satosa_idpyop.core import ExtendedContext
-from satosa_idpyop.core.claims import combine_claim_values
 from satosa_idpyop.core.response import JsonResponse
 from satosa_idpyop.endpoint_wrapper import EndPointWrapper
-from satosa_idpyop.endpoint_wrapper.authorization import handle_authorization_details_decoding
 from satosa_idpyop.utils import get_http_info
 
+from satosa_openid4vci.authorization_details import AuthorizationDetailsError
+from satosa_openid4vci.authorization_details import decode_authorization_details
+from satosa_openid4vci.authorization_details import parse_authorization_details
+from satosa_openid4vci.metrics import ERRORS
+from satosa_openid4vci.tracing import traced
+from satosa_openid4vci.unit_of_work import current_unit_of_work
+
 logger = logging.getLogger(__name__)
 
 try:
@@ -42,6 +47,13 @@ class AuthorizationEndpointWrapper(EndPointWrapper):
     response_cls = AuthorizationResponse
     error_msg = AuthorizationErrorResponse
     wraps = ['authorization']
+    # An AuthorizationDetailsValidator, set by the frontend
+    authorization_details_validator = None
+    # The frontend's ClaimMappingPlans
+    claim_mapping = None
+    # Whether only the claims of the requested credentials are asked from the backend, set by
+    # the frontend
+    limit_claims = False
 
     def __init__(self, upstream_get, endpoint, **kwargs):  # pragma: no cover
         EndPointWrapper.__init__(self, upstream_get, endpoint, **kwargs)
@@ -49,15 +61,14 @@ class AuthorizationEndpointWrapper(EndPointWrapper):
         self.converter = kwargs.get("converter", None)
         # self.entity_type = app.server["openid_credential_issuer"]
 
+    @traced("authorization_wrapper")
     def __call__(self, context: ExtendedContext):
         """
         OAuth2 / OIDC Authorization endpoint
         Checks client_id and handles the authorization request
         """
         self.log_request(context, "Authorization endpoint request")
-        self.load_cdb(context)
-
-        get_http_info(context)
+        # The client DB is loaded by handle_authn_request
         internal_req = self.handle_authn_request(context, self.endpoint)
         if not isinstance(internal_req, InternalData):  # pragma: no cover
             return self.send_response(internal_req)
@@ -69,7 +80,12 @@ class AuthorizationEndpointWrapper(EndPointWrapper):
 
     def send_response(self, response):
         _entity_type = self.get_entity_type()
-        _entity_type.persistence.flush_session_manager()
+        _uow = current_unit_of_work()
+        if _uow:
+            # done once when the unit of work ends
+            _uow.flush_session_manager(_entity_type)
+        else:
+            _entity_type.persistence.flush_session_manager()
         return response
 
     def _handle_authn_request(self, context: ExtendedContext, endpoint):
@@ -82,22 +98,37 @@ class AuthorizationEndpointWrapper(EndPointWrapper):
         :return: the internal request
         """
         self.log_request(context, "OAuth2 Authorization request from client")
-        logger.debug(f"{endpoint}")
-        logger.debug(f"request at frontend: {context.request}")
+        logger.debug("%s", endpoint)
+        logger.debug("request at frontend: %s", context.request)
 
         if "authorization_details" in context.request:
-            handle_authorization_details_decoding(context.request)
+            try:
+                decode_authorization_details(context.request)
+                if self.authorization_details_validator:
+                    self.authorization_details_validator.validate(
+                        context.request["authorization_details"])
+            except AuthorizationDetailsError as err:
+                logger.info("Bad authorization_details: %s", err)
+                ERRORS.inc("parse_request")
+                return self.send_response(JsonResponse(
+                    {"error": "invalid_authorization_details", "error_description": str(err)},
+                    status="400"))
 
         http_info = get_http_info(context)
-        logger.debug(f"http_info: {http_info}")
+        logger.debug("http_info: %s", http_info)
         self.load_cdb(context)
         parse_req = self.parse_request(context.request, http_info)
         if isinstance(parse_req, AuthorizationErrorResponse):
-            logger.debug(f"{context.request}, {parse_req._dict}")
+            logger.debug("%s, %s", context.request, parse_req._dict)
+            ERRORS.inc("parse_request")
             return self.send_response(JsonResponse(parse_req._dict))
 
         _entity_type = self.upstream_get("unit")
-        _entity_type.persistence.restore_state(parse_req, http_info)
+        _uow = current_unit_of_work()
+        if _uow:
+            _uow.restore_state(_entity_type, parse_req, http_info)
+        else:
+            _entity_type.persistence.restore_state(parse_req, http_info)
 
         _unit = topmost_unit(self)
         context.state[_unit.frontend_name] = {"oidc_request": context.request}
@@ -119,14 +150,39 @@ class AuthorizationEndpointWrapper(EndPointWrapper):
 
         _claims_supported = endpoint.upstream_get("context").get_preference("claims_supported")
 
-        logger.debug(f"Claims supported: {_claims_supported}")
+        logger.debug("Claims supported: %s", _claims_supported)
 
         if _claims_supported:
-            internal_req.attributes = self.converter.to_internal_filter("openid", _claims_supported)
+            if self.limit_claims:
+                _claims_supported = self.requested_claims(parse_req, _claims_supported)
+            internal_req.attributes = list(
+                self.claim_mapping.get("openid", _claims_supported).attributes)
 
         context.internal_data = internal_req
         return internal_req
 
+    def requested_claims(self, request: dict, claims_supported: list) -> list:
+        """
+        The supported claims that can go into the credentials the request asks for. If the
+        request doesn't say or the credential configurations don't list their claims, all
+        of claims_supported.
+        """
+        _details = request.get("authorization_details")
+        if not _details or not self.authorization_details_validator:
+            return claims_supported
+        try:
+            _ids = self.authorization_details_validator.validate(
+                parse_authorization_details(_details))
+        except AuthorizationDetailsError as err:  # pragma: no cover
+            logger.debug("Claims not limited by authorization_details: %s", err)
+            return claims_supported
+        if None in _ids:
+            return claims_supported
+        _claims = self.authorization_details_validator.index.claims(_ids)
+        if not _claims:
+            return claims_supported
+        return [_claim for _claim in claims_supported if _claim in _claims] or claims_supported
+
     def handle_authn_request(self, context: ExtendedContext, endpoint: Endpoint):
         """
         Handle an authentication request and pass it on to the backend.
@@ -139,8 +195,8 @@ class AuthorizationEndpointWrapper(EndPointWrapper):
         internal_req = self._handle_authn_request(context, endpoint)
         if not isinstance(internal_req, InternalData):
             return self.send_response(internal_req)
-        logger.debug(f"InternalData: {internal_req}")
-        logger.debug(f"Context: {context}")
+        logger.debug("InternalData: %s", internal_req)
+        logger.debug("Context: %s", context)
         return self.auth_req_callback_func(context, internal_req)
 
     def _handle_backend_response(self, context: ExtendedContext, internal_resp):
@@ -214,9 +270,11 @@ class AuthorizationEndpointWrapper(EndPointWrapper):
         except ValueError as excp:  # pragma: no cover
             # TODO - cover with unit test and add some satosa logging ...
             logger.exception('ValueError')
+            ERRORS.inc("handle_error")
             return self.handle_error(excp=excp)
         except Exception as excp:  # pragma: no cover
             logger.exception('Unknown error')
+            ERRORS.inc("handle_error")
             return self.handle_error(excp=excp)
 
         if isinstance(_args, ResponseMessage) and "error" in _args:  # pragma: no cover
@@ -241,7 +299,7 @@ class AuthorizationEndpointWrapper(EndPointWrapper):
             merged_params = {**original_params, **data}
             updated_query = urlencode(merged_params, doseq=True)
             redirect_url = url_components._replace(query=updated_query).geturl()
-            logger.debug(f"Redirect to: {redirect_url}")
+            logger.debug("Redirect to: %s", redirect_url)
             resp = SeeOther(redirect_url)
         else:  # pragma: no cover
             _entity_type = self.upstream_get("unit")
@@ -258,9 +316,7 @@ class AuthorizationEndpointWrapper(EndPointWrapper):
         :type internal_resp: satosa.internal.InternalData
         :rtype satosa.response.SeeOther
         """
-        _claims = self.converter.from_internal("openid", internal_resp.attributes)
-        claims = {k: v for k, v in _claims.items() if v}
-        combined_claims = dict([i for i in combine_claim_values(claims.items())])
+        combined_claims = self.claim_mapping.get("openid").claims(internal_resp.attributes)
 
         response = self._handle_backend_response(context, internal_resp)
         # TODO - why should we have to delete it?
@@ -0,0 +1,148 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+from typing import Optional
+
+from satosa_idpyop.core.response import JsonResponse
+from satosa_idpyop.utils import get_http_info
+
+from satosa_openid4vci.async_credential import collecting
+from satosa_openid4vci.async_credential import install_collectors
+from satosa_openid4vci.async_credential import replace_placeholders
+from satosa_openid4vci.endpoint_wrapper.credential import CredentialEndpointWrapper
+from satosa_openid4vci.metrics import ERRORS
+from satosa_openid4vci.tracing import traced
+
+logger = logging.getLogger(__name__)
+
+NONCE_PARAMS = ["c_nonce", "c_nonce_expires_in"]
+
+
+def _error(error: str, description: str, status: Optional[str] = "400") -> JsonResponse:
+    return JsonResponse({"error": error, "error_description": description}, status=status)
+
+
+class BatchCredentialEndpointWrapper(CredentialEndpointWrapper):
+    """
+    Issues several credentials from one request::
+
+        {"credential_requests": [{"format": ..., "proof": ...}, ...]}
+
+    Each credential request is parsed, the client authenticated included, and processed by the
+    credential endpoint. The state and the claims are loaded once for the whole batch. The
+    credential constructors are then called in parallel.
+
+    :param max_batch_size: Max number of credential requests in one batch
+    :param max_workers: Max number of credential constructors called at the same time
+    """
+    wraps = ["credential"]
+
+    def __init__(self, upstream_get, endpoint, max_batch_size: Optional[int] = 10,
+                 max_workers: Optional[int] = 8, **kwargs):  # pragma: no cover
+        CredentialEndpointWrapper.__init__(self, upstream_get, endpoint, **kwargs)
+        self.max_batch_size = max_batch_size
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix="credential-constructor")
+        install_collectors(endpoint)
+
+    def _credential_requests(self, request: dict):
+        _items = request.get("credential_requests")
+        if isinstance(_items, str):
+            try:
+                _items = json.loads(_items)
+            except ValueError:
+                _items = None
+        if not _items or not isinstance(_items, list):
+            return _error("invalid_request", "credential_requests missing")
+        if len(_items) > self.max_batch_size:
+            return _error("invalid_request",
+                          f"at most {self.max_batch_size} credential requests in a batch")
+        return _items
+
+    def _parse(self, items: list, http_info: dict):
+        """
+        Parses each credential request as the credential endpoint does, client
+        authentication included.
+        """
+        parsed = []
+        for _item in items:
+            _parse_req = self.parse_request(_item, http_info=http_info)
+            if isinstance(_parse_req, JsonResponse):
+                return _parse_req
+            parsed.append(_parse_req)
+        if len({_parse_req.get("client_id") for _parse_req in parsed}) > 1:  # pragma: no cover
+            ERRORS.inc("parse_request")
+            return _error("invalid_request", "credential requests from more than one client")
+        return parsed
+
+    def _construct(self, calls: list) -> dict:
+        """Calls the credential constructors in parallel."""
+        _futures = [
+            (_placeholder, self.executor.submit(_constructor.constructor, *_args, **_kwargs))
+            for _constructor, _placeholder, _args, _kwargs in calls]
+        return {_placeholder: _future.result() for _placeholder, _future in _futures}
+
+    def handle_request(self, context) -> tuple:
+        """
+        :return: Tuple of the list of process results, or an error response, the claims
+            collected about the user and the client id
+        """
+        _items = self._credential_requests(context.request or {})
+        if isinstance(_items, JsonResponse):
+            ERRORS.inc("parse_request")
+            return _items, {}, ""
+
+        _http_info = get_http_info(context)
+        self._restore_state(context.request, _http_info)
+        parsed = self._parse(_items, _http_info)
+        if isinstance(parsed, JsonResponse):
+            return parsed, {}, ""
+        _client_id = parsed[0]["client_id"]
+        _claims = self._load_claims(_client_id)
+
+        results = []
+        with collecting() as _calls:
+            for _item, _parse_req in zip(_items, parsed):
+                proc_req = self.process_request(_item, _parse_req, _http_info,
+                                                extra_claims=_claims)
+                if isinstance(proc_req, JsonResponse) or "error" in proc_req:
+                    ERRORS.inc("process_request")
+                    self.clean_up()
+                    return proc_req, _claims, _client_id
+                results.append(proc_req)
+
+        try:
+            _values = self._construct(_calls)
+        except Exception as err:
+            logger.warning("Credential construction failed: %s", err)
+            ERRORS.inc("credential_constructor")
+            self.clean_up()
+            return (_error("server_error", "credential could not be issued", status="500"),
+                    _claims, _client_id)
+
+        for proc_req in results:
+            proc_req["response_args"] = replace_placeholders(proc_req["response_args"], _values)
+        return results, _claims, _client_id
+
+    def build_response(self, results):
+        if isinstance(results, JsonResponse):
+            return results
+        if isinstance(results, dict):  # pragma: no cover
+            return CredentialEndpointWrapper.build_response(self, results)
+
+        _responses = []
+        _nonce = {}
+        for proc_req in results:
+            _args = dict(proc_req["response_args"])
+            for _param in NONCE_PARAMS:
+                if _param in _args:
+                    _nonce[_param] = _args.pop(_param)
+            _responses.append(_args)
+
+        self.clean_up()
+        return JsonResponse({"credential_responses": _responses, **_nonce})
+
+    @traced("batch_credential_wrapper")
+    def __call__(self, context, *args, **kwargs):
+        results, _, _ = self.handle_request(context)
+        return self.build_response(results)
@@ -6,40 +6,106 @@ from satosa_idpyop.core.response import JsonResponse
 from satosa_idpyop.endpoint_wrapper import EndPointWrapper
 from satosa_idpyop.utils import get_http_info
 
+from satosa_openid4vci.async_credential import collecting
+from satosa_openid4vci.metrics import ERRORS
+from satosa_openid4vci.tracing import traced
+from satosa_openid4vci.unit_of_work import current_unit_of_work
+
 logger = logging.getLogger(__name__)
 
 
 class CredentialEndpointWrapper(EndPointWrapper):
     wraps = ["credential"]
+    # A DeferredIssuance instance when credentials are issued in deferred mode
+    deferred = None
 
+    @traced("credential_wrapper")
     def __call__(self, context, *args, **kwargs):
-        _http_info = get_http_info(context)
-        _entity = self.upstream_get("unit")
-        _entity.persistence.restore_state(context.request, _http_info)
+        if self.deferred is None:
+            proc_req, _, _ = self.handle_request(context)
+            return self.build_response(proc_req)
 
-        logger.debug(f"request: {context.request}")
-        logger.debug(f"https_info: {_http_info}")
-        parse_req = self.parse_request(context.request, http_info=_http_info)
+        with collecting() as _calls:
+            proc_req, _, _client_id = self.handle_request(context)
+        if isinstance(proc_req, JsonResponse) or "response_args" not in proc_req or not _calls:
+            return self.build_response(proc_req)
+        return self.defer(proc_req, _calls, _client_id)
 
+    def defer(self, proc_req: dict, calls: list, client_id: str) -> JsonResponse:
+        """
+        Leaves the credential construction to the deferred issuance workers.
+        """
+        _args = proc_req["response_args"]
+        if isinstance(_args, Message):
+            _args = _args.to_dict()
+        transaction_id = self.deferred.submit(_args, calls, client_id)
+        self.clean_up()
+        if transaction_id is None:
+            ERRORS.inc("deferred_queue_full")
+            return JsonResponse({"error": "server_error",
+                                 "error_description": "too many pending issuances"},
+                                status="503")
+
+        _response = {"transaction_id": transaction_id}
+        for _param in ["c_nonce", "c_nonce_expires_in"]:
+            if _param in _args:
+                _response[_param] = _args[_param]
+        return JsonResponse(_response, status="202")
+
+    def _restore_state(self, request: dict, http_info: dict):
+        _entity = self.upstream_get("unit")
+        _uow = current_unit_of_work()
+        if _uow:
+            _uow.restore_state(_entity, request, http_info)
+        else:
+            _entity.persistence.restore_state(request, http_info)
+
+    def _load_claims(self, client_id: str) -> dict:
         # Have to read from the oauth servers persistence layer
         root = topmost_unit(self)
         _guise = root['oauth_authorization_server']
-        _claims = _guise.persistence.load_claims(parse_req["client_id"])
+        _uow = current_unit_of_work()
+        if _uow:
+            return _uow.load_claims(_guise, client_id)
+        return _guise.persistence.load_claims(client_id)
+
+    def handle_request(self, context) -> tuple:
+        """
+        Parses and processes a credential request.
+
+        :return: Tuple of the process result, or an error response, the claims collected
+            about the user and the client id
+        """
+        _http_info = get_http_info(context)
+        self._restore_state(context.request, _http_info)
 
-        logger.debug(f"parse_req: {parse_req}")
+        logger.debug("request: %s", context.request)
+        logger.debug("https_info: %s", _http_info)
+        parse_req = self.parse_request(context.request, http_info=_http_info)
+        _claims = self._load_claims(parse_req["client_id"])
+
+        logger.debug("parse_req: %s", parse_req)
         proc_req = self.process_request(context.request, parse_req, _http_info,
                                         extra_claims=_claims)
         if isinstance(proc_req, JsonResponse):
+            ERRORS.inc("process_request")
             self.clean_up()  # pragma: no cover
+            return proc_req, _claims, parse_req["client_id"]
+
+        logger.debug("Process result: %s", proc_req)
+        return proc_req, _claims, parse_req["client_id"]
+
+    def build_response(self, proc_req):
+        if isinstance(proc_req, JsonResponse):  # pragma: no cover
             return proc_req
 
-        logger.debug(f"Process result: {proc_req}")
         if "response_args" in proc_req:
             if isinstance(proc_req["response_args"], Message):
                 response = JsonResponse(proc_req["response_args"].to_dict())
             else:
                 response = JsonResponse(proc_req["response_args"])
         elif "error" in proc_req:
+            ERRORS.inc("process_request")
             response = JsonResponse(proc_req["error"])
         else:
             response = proc_req
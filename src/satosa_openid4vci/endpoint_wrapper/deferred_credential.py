@@ -0,0 +1,70 @@
+import logging
+from typing import Optional
+
+from idpyoidc.server.exception import ClientAuthenticationError
+from idpyoidc.server.exception import InvalidClient
+from idpyoidc.server.exception import UnAuthorizedClient
+from idpyoidc.server.exception import UnknownClient
+from satosa_idpyop.core.response import JsonResponse
+from satosa_idpyop.utils import get_http_info
+
+from satosa_openid4vci.deferred import STATUS_PENDING
+from satosa_openid4vci.deferred import STATUS_READY
+from satosa_openid4vci.endpoint_wrapper.credential import CredentialEndpointWrapper
+from satosa_openid4vci.metrics import ERRORS
+from satosa_openid4vci.tracing import traced
+
+logger = logging.getLogger(__name__)
+
+
+def _error(error: str, description: str, status: Optional[str] = "400") -> JsonResponse:
+    return JsonResponse({"error": error, "error_description": description}, status=status)
+
+
+class DeferredCredentialEndpointWrapper(CredentialEndpointWrapper):
+    """
+    Hands out credentials issued in deferred mode::
+
+        {"transaction_id": "..."}
+
+    The client is authenticated the same way as at the credential endpoint and only gets the
+    result of its own transactions.
+    """
+    wraps = ["credential"]
+
+    def _client_id(self, context):
+        _endpoint = self.endpoint
+        _http_info = get_http_info(context)
+        self._restore_state(context.request, _http_info)
+        try:
+            auth_info = _endpoint.client_authentication(
+                _endpoint.request_cls(**context.request), _http_info, endpoint=_endpoint)
+        except (InvalidClient, UnknownClient, UnAuthorizedClient,
+                ClientAuthenticationError) as err:
+            logger.error(err)
+            ERRORS.inc("parse_request")
+            return None
+        return auth_info.get("client_id")
+
+    @traced("deferred_credential_wrapper")
+    def __call__(self, context, *args, **kwargs):
+        _request = context.request or {}
+        transaction_id = _request.get("transaction_id")
+        if not transaction_id or not isinstance(transaction_id, str):
+            ERRORS.inc("parse_request")
+            return _error("invalid_request", "transaction_id missing")
+
+        _client_id = self._client_id(context)
+        self.clean_up()
+        if not _client_id:
+            return _error("invalid_token", "client could not be authenticated", status="401")
+
+        _info = self.deferred.fetch(transaction_id, _client_id)
+        if _info is None:
+            return _error("invalid_transaction_id", "unknown transaction")
+        if _info["status"] == STATUS_PENDING:
+            return JsonResponse({"error": "issuance_pending",
+                                 "interval": self.deferred.interval}, status="400")
+        if _info["status"] == STATUS_READY:
+            return JsonResponse(_info["response"])
+        return _error("server_error", "credential could not be issued", status="500")
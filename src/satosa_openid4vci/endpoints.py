@@ -1,8 +1,11 @@
+import hashlib
+import json
 import logging
+from typing import Optional
+from typing import Union
 
 from cryptojwt import JWT
 from cryptojwt.jws.jws import factory
-from openid4v.message import AuthorizationDetail
 from openid4v.message import AuthorizationRequest
 from satosa.context import Context
 from satosa_idpyop.core import ExtendedContext
@@ -10,8 +13,32 @@ from satosa_idpyop.core.response import JWSResponse
 from satosa_idpyop.core.response import JsonResponse
 from satosa_idpyop.endpoint_wrapper.token import TokenEndpointWrapper
 from satosa_idpyop.utils import get_http_info
+from satosa_openid4vci.async_credential import install_collectors
+from satosa_openid4vci.authorization_details import AuthorizationDetailsError
+from satosa_openid4vci.authorization_details import AuthorizationDetailsValidator
+from satosa_openid4vci.authorization_details import decode_authorization_details
+from satosa_openid4vci.claim_mapping import ClaimMappingPlans
+from satosa_openid4vci.client_index import basic_credentials
+from satosa_openid4vci.credential_index import CredentialConfigurationIndex
+from satosa_openid4vci.deferred import DeferredIssuance
 from satosa_openid4vci.endpoint_wrapper.authorization import AuthorizationEndpointWrapper
+from satosa_openid4vci.endpoint_wrapper.batch_credential import BatchCredentialEndpointWrapper
 from satosa_openid4vci.endpoint_wrapper.credential import CredentialEndpointWrapper
+from satosa_openid4vci.endpoint_wrapper.deferred_credential import \
+    DeferredCredentialEndpointWrapper
+from satosa_openid4vci.logging_util import banner
+from satosa_openid4vci.logging_util import debug_enabled
+from satosa_openid4vci.metrics import ERRORS
+from satosa_openid4vci.response_cache import JWKSResponseCache
+from satosa_openid4vci.response_cache import SignedStatementCache
+from satosa_openid4vci.response_cache import keyjar_generation
+from satosa_openid4vci.signing_policy import signing_policy
+from satosa_openid4vci.tracing import correlate
+from satosa_openid4vci.tracing import correlate_response
+from satosa_openid4vci.tracing import span
+from satosa_openid4vci.tracing import traced
+from satosa_openid4vci.unit_of_work import current_unit_of_work
+from satosa_openid4vci.unit_of_work import request_scoped
 from satosa_openid4vci.utils import Openid4VCIUtils
 
 logger = logging.getLogger(__name__)
@@ -19,10 +46,33 @@ logger = logging.getLogger(__name__)
 
 class Openid4VCIEndpoints(Openid4VCIUtils):
     """Handles all the Entity endpoints"""
-
-    def __init__(self, app, auth_req_callback_func, converter):  # pragma: no cover
+    # A ClientIndex, if access tokens are indexed
+    client_index = None
+
+    def __init__(self, app, auth_req_callback_func, converter,
+                 cache_conf: Optional[dict] = None,
+                 batch_conf: Optional[dict] = None,
+                 deferred_conf: Optional[dict] = None,
+                 signing_conf: Optional[Union[dict, bool]] = None,
+                 authorization_details_conf: Optional[dict] = None):  # pragma: no cover
         Openid4VCIUtils.__init__(app)
         self.endpoint_wrapper = {}
+        cache_conf = cache_conf or {}
+
+        # Which algorithms the artefacts are signed with. Without a signing configuration it
+        # is left to the libraries, signing: true is the policy's defaults
+        self.signing_policy = signing_policy(signing_conf)
+        if self.signing_policy:
+            self.signing_policy.install(self.app.server)
+
+        _jwks_conf = dict(cache_conf.get("jwks", {}))
+        if self.signing_policy:
+            _jwks_conf.setdefault("key_order", self.signing_policy.jwks_order)
+        self.jwks_cache = JWKSResponseCache(**_jwks_conf)
+        self.entity_configuration_cache = SignedStatementCache(
+            sign=self._sign_entity_configuration,
+            fingerprint=self._entity_configuration_fingerprint,
+            **cache_conf.get("entity_configuration", {}))
 
         setup = {
             "openid_credential_issuer": {"credential": CredentialEndpointWrapper},
@@ -42,6 +92,55 @@ class Openid4VCIEndpoints(Openid4VCIUtils):
                     auth_req_callback_func=_auth_req_callback_func,
                     converter=converter)
 
+        # What authorization_details may ask for
+        authorization_details_conf = authorization_details_conf or {}
+        self.authorization_details_validator = AuthorizationDetailsValidator(
+            self._credential_index(), strict=authorization_details_conf.get("strict", False))
+        self.endpoint_wrapper["authorization"].authorization_details_validator = \
+            self.authorization_details_validator
+        self.endpoint_wrapper["authorization"].limit_claims = \
+            authorization_details_conf.get("limit_claims", False)
+
+        # How attributes are mapped to claims and back, compiled once
+        self.claim_mapping = ClaimMappingPlans(converter)
+        self.endpoint_wrapper["authorization"].claim_mapping = self.claim_mapping
+
+        # Batch credential endpoint, uses the credential endpoint for the individual requests
+        self.batch_conf = batch_conf
+        if batch_conf:
+            _guise = self.app.server["openid_credential_issuer"]
+            self.endpoint_wrapper["batch_credential"] = BatchCredentialEndpointWrapper(
+                upstream_get=_guise.unit_get, endpoint=_guise.get_endpoint("credential"),
+                converter=converter, max_batch_size=batch_conf.get("max_batch_size", 10),
+                max_workers=batch_conf.get("max_workers", 8))
+            _provider_info = getattr(_guise.context, "provider_info", None)
+            if isinstance(_provider_info, dict):
+                _path = batch_conf.get("path", "batch_credential")
+                _provider_info["batch_credential_endpoint"] = f"{_guise.context.issuer}/{_path}"
+
+        # Deferred issuance, the credential endpoint answers with a transaction id and the
+        # credential is picked up at the deferred credential endpoint
+        self.deferred_conf = deferred_conf
+        self.deferred_issuance = None
+        if deferred_conf:
+            _guise = self.app.server["openid_credential_issuer"]
+            _endpoint = _guise.get_endpoint("credential")
+            install_collectors(_endpoint)
+            _deferred_kwargs = {k: v for k, v in deferred_conf.items() if k != "path"}
+            if _deferred_kwargs.get("storage") is None:
+                _deferred_kwargs["storage"] = _guise.persistence.storage
+            self.deferred_issuance = DeferredIssuance(**_deferred_kwargs)
+            self.endpoint_wrapper["credential"].deferred = self.deferred_issuance
+            self.endpoint_wrapper["deferred_credential"] = DeferredCredentialEndpointWrapper(
+                upstream_get=_guise.unit_get, endpoint=_endpoint, converter=converter)
+            self.endpoint_wrapper["deferred_credential"].deferred = self.deferred_issuance
+            _provider_info = getattr(_guise.context, "provider_info", None)
+            if isinstance(_provider_info, dict):
+                _path = deferred_conf.get("path", "deferred_credential")
+                _provider_info["deferred_credential_endpoint"] = \
+                    f"{_guise.context.issuer}/{_path}"
+
+    @traced("jwks_endpoint")
     def jwks_endpoint(self, context: Context):
         """
         Construct the JWKS document (served at /jwks).
@@ -51,22 +150,31 @@ class Openid4VCIEndpoints(Openid4VCIUtils):
         :param context: the current context
         :return: HTTP response to the client
         """
-        logger.debug(10 * "=" + "At the JWKS endpoint" + 10 * "=")
-        jwks = self.app.server["oauth_authorization_server"].context.keyjar.export_jwks("")
-        return JsonResponse(jwks)
+        logger.debug(banner("At the JWKS endpoint", width=10))
+        _keyjar = self.app.server["oauth_authorization_server"].context.keyjar
+        return self.jwks_cache.response(context, "oauth_authorization_server", _keyjar)
+
+    def _credential_index(self) -> CredentialConfigurationIndex:
+        _guise = self.app.server["openid_credential_issuer"]
+        if hasattr(_guise, "build_credential_index"):
+            # credential_configurations_supported may have been changed by the signing policy
+            return _guise.build_credential_index()
+        _provider_info = getattr(_guise.context, "provider_info", None) or {}
+        return CredentialConfigurationIndex(  # pragma: no cover
+            _provider_info.get("credential_configurations_supported"))
 
     def _request_setup(self, context: ExtendedContext, entity_type: str, endpoint: str):
         _guise = self.app.server[entity_type]
         endpoint = _guise.get_endpoint(endpoint)
-        msg = 20 * "=" + f'Request.setup() at the "{endpoint.name}" endpoint' + 20 * "="
-        logger.debug(msg)
+        if debug_enabled(logger):
+            logger.debug(banner(f'Request.setup() at the "{endpoint.name}" endpoint'))
         try:
             http_info = get_http_info(context)
         except ValueError as err:
-            logger.warning(f"In get_http_info: {err}")
+            logger.warning("In get_http_info: %s", err)
             http_info = {}
 
-        logger.debug(f"http_info: {http_info}")
+        logger.debug("http_info: %s", http_info)
 
         return {
             "http_info": http_info,
@@ -74,36 +182,58 @@ class Openid4VCIEndpoints(Openid4VCIUtils):
             "entity_type": _guise
         }
 
+    def _sign_entity_configuration(self) -> str:
+        _endpoint = self.app.server["federation_entity"].get_endpoint("entity_configuration")
+        parsed_req = _endpoint.parse_request({}, http_info={})
+        proc_req = _endpoint.process_request(parsed_req, http_info={})
+        info = _endpoint.do_response(request=parsed_req, **proc_req)
+        if self.signing_policy is None:
+            return info["response"]
+        _keyjar = self.app.server["federation_entity"].context.keyjar
+        return self.signing_policy.resign(info["response"], "entity_configuration", _keyjar)
+
+    def _entity_configuration_fingerprint(self) -> str:
+        """
+        A digest over what goes into the Entity Configuration: the metadata of all the guises,
+        the federation keys, trust marks and authority hints.
+        """
+        _fed_entity = self.app.server["federation_entity"]
+        _context = _fed_entity.context
+        _info = {
+            "keys": keyjar_generation(_context.keyjar),
+            "authority_hints": getattr(_context, "authority_hints", None),
+            "trust_marks": getattr(_context, "trust_marks", None),
+            "metadata": {guise: getattr(item.context, "provider_info", None)
+                         for guise, item in self.app.server.items()}
+        }
+        _txt = json.dumps(_info, sort_keys=True, default=str)
+        return hashlib.sha256(_txt.encode("utf-8")).hexdigest()
+
+    @traced("entity_configuration_endpoint")
     def entity_configuration_endpoint(self, context: ExtendedContext):
         """
         Construct the Entity Configuration
         served at /.well-known/openid-federation.
+        The signed statement is cached and re-signed in the background, see
+        :py:class:`satosa_openid4vci.response_cache.SignedStatementCache`.
 
         :param context: the current context
         :type context: satosa.context.Context
         :return: HTTP response to the client
         :rtype: satosa.response.Response
         """
-        logger.debug(
-            f"OAuth servers provider_info: "
-            f"{self.app.server['oauth_authorization_server'].context.provider_info}")
-
-        _env = self._request_setup(context, entity_type="federation_entity",
-                                   endpoint="entity_configuration")
-
-        parsed_req = self.parse_request(_env["endpoint"], context.request,
-                                        http_info=_env["http_info"])
-        proc_req = _env["endpoint"].process_request(parsed_req, http_info=_env["http_info"])
-
-        info = _env["endpoint"].do_response(request=parsed_req, **proc_req)
-        return JWSResponse(info["response"], content="application/entity-statement+jwt")
+        logger.debug(banner("At the Entity Configuration endpoint", width=10))
+        _jws = self.entity_configuration_cache.get()
+        return JWSResponse(_jws, content="application/entity-statement+jwt")
 
+    @traced("authorization_endpoint")
+    @request_scoped
     def authorization_endpoint(self, context: ExtendedContext):
         """
         OAuth2 / OIDC Authorization endpoint
         Checks client_id and handles the authorization request
         """
-        logger.debug(20 * "=" + 'Request at the "Authorization" endpoint' + 20 * "=")
+        logger.debug(banner('Request at the "Authorization" endpoint'))
         _guise = self.app.server['oauth_authorization_server']
         _request_uri = context.request.get("request_uri", None)
         if not _request_uri:
@@ -115,18 +245,22 @@ class Openid4VCIEndpoints(Openid4VCIUtils):
                 status="403",
             )
             return self.send_response(response)
-        _guise.persistence.restore_pushed_authorization(_request_uri)
+        correlate(_request_uri)
+        _uow = current_unit_of_work()
+        _uow.restore_pushed_authorization(_guise, _request_uri)
         _fed_entity = self.app.server["federation_entity"]
-        _fed_entity.persistence.restore_state()
+        _uow.restore_state(_fed_entity)
 
-        logger.debug(f"Default target backend: {self.app.default_target_backend}")
+        logger.debug("Default target backend: %s", self.app.default_target_backend)
         context.target_backend = self.app.default_target_backend
 
         resp = self.endpoint_wrapper["authorization"](context)
 
-        _fed_entity.persistence.store_state()
+        _uow.store_state(_fed_entity)
         return resp
 
+    @traced("token_endpoint")
+    @request_scoped
     def token_endpoint(self, context: ExtendedContext):
         """
         Handle token requests (served at /token).
@@ -136,29 +270,64 @@ class Openid4VCIEndpoints(Openid4VCIUtils):
         :param context: the current context
         :return: HTTP response to the client
         """
-        logger.debug(20 * "*" + "At the Token Endpoint" + 20 * "*")
-        logger.debug(f"Request: {context.request}")
-        response = self.endpoint_wrapper["token"](context)
+        logger.debug(banner("At the Token Endpoint", "*"))
+        logger.debug("Request: %s", context.request)
+        correlate(context.request.get("code"))
+        with span("token_wrapper"):
+            response = self.endpoint_wrapper["token"](context)
+        correlate_response(response, "access_token")
+        if self.client_index is not None:
+            _client_id = context.request.get("client_id")
+            if not _client_id:
+                _credentials = basic_credentials(getattr(context, "request_authorization", ""))
+                _client_id = _credentials[0] if _credentials else None
+            self.client_index.add_token_response(response, _client_id)
 
         return self.send_response(response)
 
+    @traced("credential_endpoint")
+    @request_scoped
     def credential_endpoint(self, context: ExtendedContext):
-        logger.debug(20 * "=" + "At the Credential Endpoint" + 20 * "=")
+        logger.debug(banner("At the Credential Endpoint"))
+        correlate(getattr(context, "request_authorization", "").partition(" ")[2])
 
         response = self.endpoint_wrapper["credential"](context)
 
         return self.send_response(response)
 
+    @traced("batch_credential_endpoint")
+    @request_scoped
+    def batch_credential_endpoint(self, context: ExtendedContext):
+        logger.debug(banner("At the Batch Credential Endpoint"))
+        correlate(getattr(context, "request_authorization", "").partition(" ")[2])
+
+        response = self.endpoint_wrapper["batch_credential"](context)
+
+        return self.send_response(response)
+
+    @traced("deferred_credential_endpoint")
+    @request_scoped
+    def deferred_credential_endpoint(self, context: ExtendedContext):
+        logger.debug(banner("At the Deferred Credential Endpoint"))
+        correlate(getattr(context, "request_authorization", "").partition(" ")[2])
+
+        response = self.endpoint_wrapper["deferred_credential"](context)
+
+        return self.send_response(response)
+
+    @traced("pushed_authorization_endpoint")
+    @request_scoped
     def pushed_authorization_endpoint(self, context: ExtendedContext):
         _env = self._request_setup(context, "oauth_authorization_server",
                                    "pushed_authorization")
-        logger.debug(f"Entity type: {_env['entity_type'].entity_type}")
-        _env["entity_type"].persistence.restore_state(context.request, _env["http_info"])
+        logger.debug("Entity type: %s", _env["entity_type"].entity_type)
+        _uow = current_unit_of_work()
+        _uow.restore_state(_env["entity_type"], context.request, _env["http_info"])
 
         _env["endpoint"].request_format = "dict"
         _env["endpoint"].request_cls = AuthorizationRequest
 
-        logger.debug(f"Request: {context.request}")
+        logger.debug("Request: %s", context.request)
         if "request" in context.request:
             _keyjar = _env["endpoint"].upstream_get("attribute", "keyjar")
             _jws = factory(context.request["request"])
@@ -176,7 +345,7 @@ class Openid4VCIEndpoints(Openid4VCIUtils):
             else:
                 _iss = _jws.jwt.payload()["iss"]
                 if _iss not in _keyjar:
-                    logger.debug(f"Unregistered client '{_iss}'")
+                    logger.debug("Unregistered client '%s'", _iss)
                     # do automatic/semi-automatic registration
                 else:
                     _jwt = JWT(key_jar=_keyjar)
@@ -184,36 +353,39 @@ class Openid4VCIEndpoints(Openid4VCIUtils):
                     del context.request["request"]
                     context.request.update(_request)
 
-        logger.debug(f"request: {context.request}")
+        logger.debug("request: %s", context.request)
 
-        # This is not how it should be done, but it has to be done.
         if "authorization_details" in context.request:
-            logger.debug("Need to deal with 'authorization_details'")
-            if context.request["authorization_details"].startswith("[") and context.request[
-                "authorization_details"].endswith("]"):
-                _ads = context.request["authorization_details"][1:-1].split(",")
-                _list = []
-                for _url_ad in _ads:
-                    _url_ad = _url_ad[1:-1]
-                    _item = AuthorizationDetail().from_urlencoded(_url_ad)
-                    _list.append(_item.to_dict())
-                context.request["authorization_details"] = _list
-
-        logger.debug(f"Incoming request: {context.request}")
+            try:
+                decode_authorization_details(context.request)
+                if self.authorization_details_validator:
+                    self.authorization_details_validator.validate(
+                        context.request["authorization_details"])
+            except AuthorizationDetailsError as err:
+                logger.info("Bad authorization_details: %s", err)
+                ERRORS.inc("parse_request")
+                response = JsonResponse(
+                    {"error": "invalid_authorization_details", "error_description": str(err)},
+                    status="400")
+                return self.send_response(response)
+
+        logger.debug("Incoming request: %s", context.request)
         parse_req = self.parse_request(_env["endpoint"], context.request,
                                        http_info=_env["http_info"])
-        logger.debug(f"Parsed request: {parse_req} {type(parse_req)}")
+        if debug_enabled(logger):
+            logger.debug("Parsed request: %s %s", parse_req, type(parse_req).__name__)
         proc_req = self.process_request(_env["endpoint"], context, parse_req, _env["http_info"])
         if isinstance(proc_req, JsonResponse):  # pragma: no cover
             return self.send_response(proc_req)
 
         # The only thing that should have changed on the application side
-        _env["entity_type"].persistence.store_client_info(parse_req["client_id"])
-        _env["entity_type"].persistence.store_pushed_authorization(proc_req["response_args"]["request_uri"])
+        _uow.store_client_info(_env["entity_type"], parse_req["client_id"])
+        _uow.store_pushed_authorization(_env["entity_type"],
+                                        proc_req["response_args"]["request_uri"])
         # Also on the federation side
-        _fed_entity = self.app.server["federation_entity"]
-        _fed_entity.persistence.store_state()
+        _uow.store_state(self.app.server["federation_entity"])
 
-        logger.debug(f"PAR response: {proc_req}")
+        logger.debug("PAR response: %s", proc_req)
+        correlate(proc_req["response_args"]["request_uri"])
         response = JsonResponse(proc_req["response_args"])
         return self.send_response(response)
@@ -0,0 +1,159 @@
+"""
+A pooled HTTP client shared by everything the credential issuer talks to.
+
+The credential constructors all call the same authentic source. With a client of their own,
+or a plain ``requests.request``, each call opens a new connection and does a TLS handshake.
+The client here keeps connections open and reuses them, it is used as the ``httpc`` of the
+credential issuer and handed to the credential constructors. Configured in the credential
+issuer configuration::
+
+    http_client:
+      pool_size: 20
+      keep_alive: true
+      keep_alive_expiry: 30
+      http2: false
+      max_per_host: 10
+      timeout: 10
+
+HTTP/2 is opt-in and needs the httpx package with the http2 extra, without it HTTP/1.1 is
+used. An httpx client takes verify, cert and proxies when it is created, a request that
+comes with other values than the client's is sent over HTTP/1.1 instead.
+"""
+import logging
+import threading
+from typing import Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+try:
+    import h2  # noqa: F401
+except ImportError:
+    h2 = None
+
+logger = logging.getLogger(__name__)
+
+# requests arguments httpx only takes when the client is created
+CLIENT_LEVEL_PARAMS = ["verify", "cert", "proxies", "stream"]
+
+
+def httpx_arguments(kwargs: dict) -> tuple:
+    """
+    Splits ``requests.request`` arguments into the arguments httpx takes when the client is
+    created and those it takes per request.
+
+    :return: Tuple of client arguments and request arguments
+    """
+    _kwargs = dict(kwargs)
+    _client_params = {_param: _kwargs.pop(_param) for _param in CLIENT_LEVEL_PARAMS
+                      if _param in _kwargs}
+    if "allow_redirects" in _kwargs:
+        _kwargs["follow_redirects"] = _kwargs.pop("allow_redirects")
+    if isinstance(_kwargs.get("data"), (str, bytes)):
+        _kwargs["content"] = _kwargs.pop("data")
+    return _client_params, _kwargs
+
+
+class PooledHTTPClient(object):
+    """
+    Called like ``requests.request``, ``client(method, url, **kwargs)``.
+
+    :param pool_size: Max number of connections kept open, per host for HTTP/1.1
+    :param keep_alive: Whether connections are reused
+    :param keep_alive_expiry: Seconds an idle connection is kept open (httpx only)
+    :param http2: Use HTTP/2, if the httpx and h2 packages are installed
+    :param max_per_host: Max number of requests to one host at the same time, 0 for no limit
+    :param timeout: Default timeout in seconds
+    :param verify: Whether TLS certificates are verified, or a CA bundle
+    """
+
+    def __init__(self, pool_size: Optional[int] = 20, keep_alive: Optional[bool] = True,
+                 keep_alive_expiry: Optional[float] = 30, http2: Optional[bool] = False,
+                 max_per_host: Optional[int] = 10, timeout: Optional[float] = 10,
+                 verify: Optional[bool] = True, **kwargs):
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.verify = verify
+        self.http2 = bool(http2 and httpx is not None and h2 is not None)
+        if http2 and not self.http2:
+            logger.info("HTTP/2 needs httpx[http2], using HTTP/1.1")
+
+        # For requests HTTP/2 can not be used for, created when needed
+        self._http1_session = None
+        if self.http2:
+            self.session = httpx.Client(
+                http2=True, verify=verify, timeout=timeout,
+                limits=httpx.Limits(max_connections=pool_size,
+                                    max_keepalive_connections=pool_size if keep_alive else 0,
+                                    keepalive_expiry=keep_alive_expiry))
+        else:
+            self.session = self._http1_session = self._requests_session()
+
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _requests_session(self) -> requests.Session:
+        _session = requests.Session()
+        _session.verify = self.verify
+        _adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        _session.mount("https://", _adapter)
+        _session.mount("http://", _adapter)
+        if not self.keep_alive:
+            _session.headers["Connection"] = "close"
+        return _session
+
+    @property
+    def http1_session(self) -> requests.Session:
+        if self._http1_session is None:
+            with self._lock:
+                if self._http1_session is None:
+                    self._http1_session = self._requests_session()
+        return self._http1_session
+
+    def _host_limit(self, url: str) -> Optional[threading.BoundedSemaphore]:
+        if not self.max_per_host:
+            return None
+        _host = urlsplit(url).netloc
+        with self._lock:
+            _semaphore = self._hosts.get(_host)
+            if _semaphore is None:
+                _semaphore = self._hosts[_host] = threading.BoundedSemaphore(self.max_per_host)
+        return _semaphore
+
+    def _session_for(self, kwargs: dict) -> tuple:
+        """
+        The session to send a request with, and the arguments to send it with.
+        """
+        if not self.http2:
+            return self.session, kwargs
+        _client_params, _kwargs = httpx_arguments(kwargs)
+        if _client_params.get("verify", self.verify) != self.verify or any(
+                _client_params.get(_param) for _param in ["cert", "proxies", "stream"]):
+            # Not what the httpx client was created with
+            return self.http1_session, kwargs
+        return self.session, _kwargs
+
+    def request(self, method: str, url: str, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        _session, kwargs = self._session_for(kwargs)
+
+        _semaphore = self._host_limit(url)
+        if _semaphore is None:
+            return _session.request(method, url, **kwargs)
+        with _semaphore:
+            return _session.request(method, url, **kwargs)
+
+    __call__ = request
+
+    def close(self):
+        self.session.close()
+        if self._http1_session not in (None, self.session):
+            self._http1_session.close()
@@ -0,0 +1,307 @@
+"""
+Cache of the authentic sources' public keys.
+
+Each credential constructor has a jwks_url where the keys that sign what the authentic source
+returns are published. The cache fetches each distinct URL once, whatever the number of
+constructors pointing at it, and keeps the keys in the credential issuer's keyjar. The keys are
+refreshed in the background before they expire, how long they are good for is taken from the
+Cache-Control header of the response. A signature by a key the keyjar does not know, under
+an issuer the cache keeps keys for, makes the cache fetch the keys again. Configured in the
+credential issuer configuration::
+
+    jwks_cache:
+      default_ttl: 3600
+      min_ttl: 60
+      max_ttl: 86400
+      refresh_ahead: 0.2
+      kid_miss_interval: 30
+      refresh_interval: 10
+      issuers:
+        https://as.example.com/.well-known/jwks: https://as.example.com
+
+A document published at jwks_url is either a JWKS or ``{"issuer": ..., "jwks": {...}}``. The
+keys are put in the keyjar under the issuer configured for the URL in issuers, or under the
+URL. A document naming another issuer is rejected.
+
+Nothing is fetched when the cache is created, the keys are fetched by the background thread
+started by :py:meth:`JWKSCache.start` or when first asked for.
+"""
+import functools
+import logging
+import re
+import threading
+import time
+from typing import Any
+from typing import Callable
+from typing import Optional
+
+from cryptojwt.key_bundle import KeyBundle
+from cryptojwt.key_jar import KeyJar
+import requests
+
+logger = logging.getLogger(__name__)
+
+MAX_AGE = re.compile(r"max-age\s*=\s*(\d+)")
+
+
+def cache_ttl(cache_control: str, default: int) -> int:
+    """
+    :return: Seconds the response may be cached according to the Cache-Control header value
+    """
+    if not cache_control:
+        return default
+    _value = cache_control.lower()
+    if "no-store" in _value or "no-cache" in _value:
+        return 0
+    _match = MAX_AGE.search(_value)
+    if _match:
+        return int(_match.group(1))
+    return default
+
+
+class JWKSKeyJar(KeyJar):
+    """
+    A keyjar that asks the JWKS cache for a key it is missing, when the cache keeps the keys
+    of the issuer of the JWT being verified.
+    """
+    # The JWKSCache the keys are asked for
+    jwks_cache = None
+
+    def get_jwt_verify_keys(self, jwt, **kwargs):
+        _keys = KeyJar.get_jwt_verify_keys(self, jwt, **kwargs)
+        _kid = jwt.headers.get("kid")
+        if self.jwks_cache is None or not _kid or any(_key.kid == _kid for _key in _keys):
+            return _keys
+        _iss = jwt.payload().get("iss") or kwargs.get("iss") or kwargs.get("issuer")
+        _url = self.jwks_cache.url_of(_iss) if _iss else None
+        if _url is None:
+            return _keys
+        try:
+            _key = self.jwks_cache.get_key(_url, _kid)
+        except Exception as err:
+            logger.warning("Fetching %s for key id %s failed: %s", _url, _kid, err)
+            return _keys
+        if _key is None:
+            return _keys
+        return KeyJar.get_jwt_verify_keys(self, jwt, **kwargs)
+
+
+class _Entry(object):
+    __slots__ = ("url", "issuer", "bundle", "fetched", "expires", "last_fetch", "refreshing",
+                 "lock")
+
+    def __init__(self, url: str, issuer: str):
+        self.url = url
+        self.issuer = issuer
+        self.bundle = None
+        self.fetched = 0
+        self.expires = 0
+        self.last_fetch = 0
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+
+class JWKSCache(object):
+    """
+    :param httpc: Makes the HTTP requests, called like requests.request
+    :param httpc_params: Extra arguments to httpc
+    :param keyjar: Where the keys are put, bound to the issuer configured for the URL, or the
+        URL
+    :param default_ttl: Seconds the keys are kept if the response has no Cache-Control max-age
+    :param min_ttl: Never fetch the keys more often than this
+    :param max_ttl: Never keep the keys longer than this
+    :param refresh_ahead: Fraction of the time to live before expiry the keys are refreshed
+    :param kid_miss_interval: Min seconds between fetches caused by an unknown key id
+    :param refresh_interval: Seconds between the background thread's looks for keys to refresh
+    :param issuers: jwks_url to the issuer the keys published there belong to
+    """
+
+    def __init__(self, httpc: Optional[Any] = None, httpc_params: Optional[dict] = None,
+                 keyjar: Optional[Any] = None, default_ttl: Optional[int] = 3600,
+                 min_ttl: Optional[int] = 60, max_ttl: Optional[int] = 86400,
+                 refresh_ahead: Optional[float] = 0.2, kid_miss_interval: Optional[int] = 30,
+                 refresh_interval: Optional[float] = 10, issuers: Optional[dict] = None,
+                 **kwargs):
+        self.httpc = httpc or requests.request
+        self.httpc_params = httpc_params or {}
+        self.keyjar = keyjar
+        self.default_ttl = default_ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.refresh_ahead = refresh_ahead
+        self.kid_miss_interval = kid_miss_interval
+        self.refresh_interval = refresh_interval
+        self.issuers = dict(issuers or {})
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if keyjar is not None:
+            self._adopt(keyjar)
+
+    def _entry(self, url: str) -> _Entry:
+        with self._lock:
+            _entry = self._entries.get(url)
+            if _entry is None:
+                _entry = self._entries[url] = _Entry(url, self.issuers.get(url) or url)
+        return _entry
+
+    def register(self, url: str):
+        """
+        Makes the cache keep the keys at url, without fetching them.
+        """
+        self._entry(url)
+
+    def url_of(self, issuer: str) -> Optional[str]:
+        """The URL of the keys bound to issuer, None if the cache keeps none."""
+        with self._lock:
+            for _entry in self._entries.values():
+                if _entry.issuer == issuer:
+                    return _entry.url
+        return None
+
+    def _fetch(self, entry: _Entry):
+        entry.last_fetch = time.time()
+        _resp = self.httpc("GET", entry.url, **self.httpc_params)
+        if _resp.status_code != 200:
+            raise ValueError(f"Fetching {entry.url} gave {_resp.status_code}")
+        _info = _resp.json()
+        _jwks = _info.get("jwks", _info)
+        if _info.get("issuer", entry.issuer) != entry.issuer:
+            raise ValueError(
+                f"{entry.url} names {_info['issuer']} as issuer, expected {entry.issuer}")
+        _issuer = entry.issuer
+        _bundle = KeyBundle(keys=_jwks["keys"])
+
+        _ttl = cache_ttl(_resp.headers.get("Cache-Control", ""), self.default_ttl)
+        _ttl = min(max(_ttl, self.min_ttl), self.max_ttl)
+        if self.keyjar is not None:
+            _key_issuer = self.keyjar.return_issuer(_issuer)
+            _bundles = [b for b in _key_issuer.get_bundles() if b is not entry.bundle]
+            _key_issuer.set(_bundles + [_bundle])
+            self.keyjar[_issuer] = _key_issuer
+
+        entry.bundle = _bundle
+        entry.fetched = entry.last_fetch
+        entry.expires = entry.fetched + _ttl
+        logger.debug("Fetched %s, %d keys, good for %d seconds", entry.url, len(_bundle), _ttl)
+
+    def _refresh(self, entry: _Entry):
+        try:
+            with entry.lock:
+                self._fetch(entry)
+        except Exception as err:
+            # The keys we have are still used until they expire
+            logger.warning("Refreshing %s failed: %s", entry.url, err)
+        finally:
+            entry.refreshing = False
+
+    def _refresh_at(self, entry: _Entry) -> float:
+        return entry.expires - (entry.expires - entry.fetched) * self.refresh_ahead
+
+    def get(self, url: str) -> KeyBundle:
+        """
+        The keys published at url. Only the first request, and requests made after the keys
+        have expired, wait for the keys to be fetched.
+        """
+        _entry = self._entry(url)
+        _now = time.time()
+        if _entry.bundle is None or _now >= _entry.expires:
+            with _entry.lock:
+                if _entry.bundle is None or time.time() >= _entry.expires:
+                    self._fetch(_entry)
+            return _entry.bundle
+
+        _bundle = _entry.bundle
+        if _now >= self._refresh_at(_entry) and not _entry.refreshing:
+            with self._lock:
+                _start = not _entry.refreshing
+                _entry.refreshing = True
+            if _start:
+                threading.Thread(target=self._refresh, args=(_entry,), daemon=True).start()
+        return _bundle
+
+    def issuer(self, url: str) -> str:
+        """The issuer the keys at url are bound to in the keyjar."""
+        return self._entry(url).issuer
+
+    def get_key(self, url: str, kid: str):
+        """
+        The key with the key id kid. If there is no such key the keys are fetched again,
+        the authentic source may have rotated its keys, but not more often than every
+        kid_miss_interval seconds.
+        """
+        _key = self.get(url).get_key_with_kid(kid)
+        if _key is not None:
+            return _key
+
+        _entry = self._entries[url]
+        with _entry.lock:
+            if time.time() - _entry.last_fetch < self.kid_miss_interval:
+                return _entry.bundle.get_key_with_kid(kid)
+            logger.info("Unknown key id %s, fetching %s", kid, url)
+            self._fetch(_entry)
+        return _entry.bundle.get_key_with_kid(kid)
+
+    def memoize(self, url: str, fetch: Callable) -> Callable:
+        """
+        Wraps fetch, a function that fetches the keys at url, so that it is only called again
+        when the cache has fetched new keys. Until then what it last returned is returned.
+        """
+        _last = {}
+
+        @functools.wraps(fetch)
+        def memoized(*args, **kwargs):
+            _entry = self._entry(url)
+            self.get(url)
+            _fetched = _entry.fetched
+            if _last.get("fetched") != _fetched:
+                _last["value"] = fetch(*args, **kwargs)
+                _last["fetched"] = _fetched
+            return _last["value"]
+
+        return memoized
+
+    def _adopt(self, keyjar: Any):
+        """
+        Makes the keyjar a :py:class:`JWKSKeyJar` asking this cache for missing keys. The
+        keyjar is made, and shared, by idpyoidc, so a plain KeyJar becomes one in place.
+        """
+        if type(keyjar) is KeyJar:
+            keyjar.__class__ = JWKSKeyJar
+        if isinstance(keyjar, JWKSKeyJar):
+            keyjar.jwks_cache = self
+        else:  # pragma: no cover
+            logger.warning("Keys are not fetched again on unknown key ids, the keyjar is a %s",
+                           type(keyjar).__name__)
+
+    def refresh_due(self):
+        """Fetches the keys not fetched yet and refreshes those that are about to expire."""
+        _now = time.time()
+        with self._lock:
+            _entries = list(self._entries.values())
+        for _entry in _entries:
+            if _entry.bundle is None or _now >= self._refresh_at(_entry):
+                self._refresh(_entry)
+
+    def start(self):
+        """
+        Fetches and refreshes keys in a background thread, so that keys used only through the
+        keyjar are there and kept up to date.
+        """
+        if self._thread is not None:
+            return
+
+        def _run():
+            self.refresh_due()
+            while not self._stop.wait(self.refresh_interval):
+                self.refresh_due()
+
+        self._thread = threading.Thread(target=_run, name="jwks-cache", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,48 @@
+"""
+Helpers for logging on the request paths without paying for messages that are never emitted.
+
+Log calls use %-style arguments, the standard library only formats the message when a handler
+actually emits the record. Arguments that are expensive to compute are wrapped in
+:py:class:`Lazy` so that they are computed at the same time, if at all::
+
+    logger.debug("PAR_db: %s", Lazy(lambda: list(_ec.par_db.keys())))
+
+Anything more involved is guarded with :py:func:`debug_enabled`.
+"""
+import functools
+import logging
+from typing import Any
+from typing import Callable
+
+
+class Lazy(object):
+    """
+    A log argument that is computed when the message is formatted.
+
+    :param func: Computes the value
+    :param args: Arguments to func
+    """
+
+    __slots__ = ("func", "args")
+
+    def __init__(self, func: Callable, *args: Any):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+    def __repr__(self):
+        return repr(self.func(*self.args))
+
+
+def debug_enabled(logger: logging.Logger) -> bool:
+    return logger.isEnabledFor(logging.DEBUG)
+
+
+@functools.lru_cache(maxsize=64)
+def banner(title: str, char: str = "=", width: int = 20) -> str:
+    """
+    A title framed by a row of characters on each side. Built once per title.
+    """
+    return f"{width * char}{title}{width * char}"
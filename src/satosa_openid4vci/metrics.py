@@ -0,0 +1,362 @@
+"""
+Request and storage metrics, exposed in the Prometheus text format.
+
+Enabled by a ``metrics`` block in the frontend configuration::
+
+    metrics:
+      path: metrics
+
+Endpoint latency and request/response sizes are recorded for every registered endpoint,
+error responses are counted per source and the persistence layer operations done within a
+unit of work are timed.
+
+The metrics are kept per process. When SATOSA runs in several worker processes, each worker
+writes what it has recorded to a file in a directory shared by the workers, at most every
+``interval`` seconds, and the worker that serves the metrics adds up the files of all
+workers::
+
+    metrics:
+      path: metrics
+      multiprocess_dir: /run/satosa/metrics
+      interval: 5
+
+The directory defaults to the PROMETHEUS_MULTIPROC_DIR environment variable. It should be
+emptied when the service is started. Without a directory each worker serves only its own
+metrics, so there must then be one worker only.
+"""
+import bisect
+import functools
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable
+from typing import Optional
+
+from satosa.context import Context
+from satosa.response import Response
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: Optional[str] = "") -> str:
+    _pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        _pairs.append(extra)
+    return "{" + ",".join(_pairs) + "}" if _pairs else ""
+
+
+class Counter(object):
+    """
+    :param name: Metric name
+    :param documentation: The HELP text
+    :param labelnames: Names of the labels, values are given positionally to inc()
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Optional[tuple] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: Optional[float] = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def state(self) -> list:
+        """What has been recorded, in a form that can be written as JSON."""
+        with self._lock:
+            return [[list(k), v] for k, v in self._values.items()]
+
+    def samples(self, states: Optional[list] = ()):
+        """
+        :param states: What other processes have recorded, see :py:meth:`state`
+        """
+        with self._lock:
+            _merged = dict(self._values)
+        for _state in states:
+            for _label_values, _val in _state:
+                _key = tuple(_label_values)
+                _merged[_key] = _merged.get(_key, 0) + _val
+        for _labels_values, _val in sorted(_merged.items()):
+            yield f"{self.name}_total{_labels(self.labelnames, _labels_values)} {_val}"
+
+
+class Histogram(object):
+    """
+    :param name: Metric name
+    :param documentation: The HELP text
+    :param labelnames: Names of the labels, values are given positionally to observe()
+    :param buckets: Upper bounds of the buckets
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Optional[tuple] = (),
+                 buckets: Optional[tuple] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per bucket counts (+Inf last), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        _index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            _entry = self._values.get(labels)
+            if _entry is None:
+                _entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            _entry[0][_index] += 1
+            _entry[1] += value
+            _entry[2] += 1
+
+    def count(self, *labels) -> int:
+        _entry = self._values.get(labels)
+        return _entry[2] if _entry else 0
+
+    def state(self) -> list:
+        """What has been recorded, in a form that can be written as JSON."""
+        with self._lock:
+            return [[list(k), [list(v[0]), v[1], v[2]]] for k, v in self._values.items()]
+
+    def samples(self, states: Optional[list] = ()):
+        """
+        :param states: What other processes have recorded, see :py:meth:`state`
+        """
+        with self._lock:
+            _merged = {k: [list(v[0]), v[1], v[2]] for k, v in self._values.items()}
+        for _state in states:
+            for _label_values, (_counts, _sum, _count) in _state:
+                if len(_counts) != len(self.buckets) + 1:  # pragma: no cover
+                    continue
+                _entry = _merged.setdefault(tuple(_label_values),
+                                            [[0] * (len(self.buckets) + 1), 0.0, 0])
+                _entry[0] = [_a + _b for _a, _b in zip(_entry[0], _counts)]
+                _entry[1] += _sum
+                _entry[2] += _count
+        for _labels_values, (_counts, _sum, _count) in sorted(_merged.items()):
+            _cumulative = 0
+            for _bound, _n in zip(self.buckets + ("+Inf",), _counts):
+                _cumulative += _n
+                _le = _labels(self.labelnames, _labels_values, f'le="{_bound}"')
+                yield f"{self.name}_bucket{_le} {_cumulative}"
+            _plain = _labels(self.labelnames, _labels_values)
+            yield f"{self.name}_sum{_plain} {_sum}"
+            yield f"{self.name}_count{_plain} {_count}"
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> dict:
+        return {_name: _metric.state() for _name, _metric in self.metrics.items()}
+
+    def exposition(self, snapshots: Optional[list] = ()) -> str:
+        """
+        :param snapshots: What other processes have recorded, see :py:meth:`snapshot`
+        """
+        _lines = []
+        for _metric in self.metrics.values():
+            _lines.append(f"# HELP {_metric.name} {_metric.documentation}")
+            _lines.append(f"# TYPE {_metric.name} {_metric.kind}")
+            _lines.extend(_metric.samples([_s.get(_metric.name, []) for _s in snapshots]))
+        return "\n".join(_lines) + "\n"
+
+
+class MultiprocessMetrics(object):
+    """
+    Shares the metrics of the worker processes through files in a directory.
+
+    :param directory: The directory, shared by the workers
+    :param registry: The metrics of this process
+    :param interval: Min seconds between writes of this process's metrics
+    """
+
+    def __init__(self, directory: str, registry: Optional[Registry] = None,
+                 interval: Optional[float] = 5):
+        self.directory = directory
+        self.registry = registry or REGISTRY
+        self.interval = interval
+        self._next_write = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"metrics-{pid}.json")
+
+    def write(self):
+        _path = self._path(os.getpid())
+        _tmp = f"{_path}.tmp"
+        with open(_tmp, "w") as fp:
+            json.dump(self.registry.snapshot(), fp)
+        os.replace(_tmp, _path)
+
+    def maybe_write(self):
+        """Writes this process's metrics if it has not done so for interval seconds."""
+        _now = time.monotonic()
+        if _now < self._next_write or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._next_write = _now + self.interval
+            self.write()
+        except OSError as err:  # pragma: no cover
+            logger.warning("Writing metrics to %s failed: %s", self.directory, err)
+        finally:
+            self._lock.release()
+
+    def others(self) -> list:
+        """The metrics last written by the other processes."""
+        _own = self._path(os.getpid())
+        snapshots = []
+        for _path in glob.glob(os.path.join(self.directory, "metrics-*.json")):
+            if _path == _own:
+                continue
+            try:
+                with open(_path) as fp:
+                    snapshots.append(json.load(fp))
+            except (OSError, ValueError) as err:  # pragma: no cover
+                logger.warning("Reading metrics from %s failed: %s", _path, err)
+        return snapshots
+
+    def exposition(self) -> str:
+        return self.registry.exposition(self.others())
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    "oid4vci_request_duration_seconds", "Time spent handling a request", ("endpoint",)))
+REQUEST_SIZE = REGISTRY.register(Histogram(
+    "oid4vci_request_size_bytes", "Approximate size of the request arguments", ("endpoint",),
+    buckets=SIZE_BUCKETS))
+RESPONSE_SIZE = REGISTRY.register(Histogram(
+    "oid4vci_response_size_bytes", "Size of the response body", ("endpoint",),
+    buckets=SIZE_BUCKETS))
+RESPONSES = REGISTRY.register(Counter(
+    "oid4vci_responses", "Responses per endpoint and status code", ("endpoint", "status")))
+ERRORS = REGISTRY.register(Counter(
+    "oid4vci_errors", "Error responses by where they were produced", ("source",)))
+STORAGE_LATENCY = REGISTRY.register(Histogram(
+    "oid4vci_storage_duration_seconds", "Time spent in persistence layer operations",
+    ("operation",)))
+
+
+def request_size(context: Context) -> int:
+    """
+    The size of the request arguments, approximated from the parsed request.
+    """
+    _request = getattr(context, "request", None)
+    if not _request:
+        return 0
+    if isinstance(_request, dict):
+        return sum(len(str(k)) + len(str(v)) + 2 for k, v in _request.items())
+    return len(str(_request))
+
+
+def _encoded_size(message) -> int:
+    if isinstance(message, str):
+        return len(message.encode("utf-8"))
+    return len(message)
+
+
+def response_size(response) -> int:
+    """
+    The size of the response body in bytes, as encoded when it is sent.
+    """
+    _message = getattr(response, "message", None)
+    if _message is None:
+        return 0
+    if isinstance(_message, list):
+        return sum(_encoded_size(m) for m in _message)
+    return _encoded_size(_message)
+
+
+# A MultiprocessMetrics, if the metrics of several worker processes are added up
+_multiprocess = None
+
+
+def configure(conf: Optional[dict]):
+    """
+    Sets up sharing the metrics between worker processes, if a directory for it is
+    configured or given by PROMETHEUS_MULTIPROC_DIR.
+    """
+    global _multiprocess
+    _conf = conf or {}
+    _directory = _conf.get("multiprocess_dir") or os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if conf is not None and _directory:
+        _multiprocess = MultiprocessMetrics(_directory, interval=_conf.get("interval", 5))
+    else:
+        _multiprocess = None
+    return _multiprocess
+
+
+def instrument(endpoint: str, handler: Callable) -> Callable:
+    """
+    Wraps an endpoint handler so that its latency, sizes and response status are recorded.
+    """
+
+    @functools.wraps(handler)
+    def wrapper(context: Context, *args, **kwargs):
+        _start = time.perf_counter()
+        _status = "500"
+        try:
+            response = handler(context, *args, **kwargs)
+            _status = str(getattr(response, "status", "200")).split(" ", 1)[0]
+            RESPONSE_SIZE.observe(response_size(response), endpoint)
+            return response
+        finally:
+            REQUEST_LATENCY.observe(time.perf_counter() - _start, endpoint)
+            REQUEST_SIZE.observe(request_size(context), endpoint)
+            RESPONSES.inc(endpoint, _status)
+            if _multiprocess is not None:
+                _multiprocess.maybe_write()
+
+    return wrapper
+
+
+class timed(object):
+    """
+    Context manager recording how long a persistence layer operation took.
+    """
+
+    __slots__ = ("operation", "_start")
+
+    def __init__(self, operation: str):
+        self.operation = operation
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        STORAGE_LATENCY.observe(time.perf_counter() - self._start, self.operation)
+
+
+def metrics_response(registry: Optional[Registry] = None) -> Response:
+    if registry is None and _multiprocess is not None:
+        return Response(_multiprocess.exposition(), content=CONTENT_TYPE)
+    return Response((registry or REGISTRY).exposition(), content=CONTENT_TYPE)
@@ -16,12 +16,28 @@ import satosa
 from satosa.context import Context
 from satosa.response import SeeOther
 from satosa_idpyop.core import ExtendedContext
-from satosa_idpyop.core.claims import combine_claim_values
 from satosa_idpyop.core.response import JsonResponse
 from satosa_idpyop.utils import combine_client_subject_id
 from satosa_idpyop.utils import get_http_info
 
+from .async_credential import AsyncCredentialIssuance
+from .client_cache import ClientInfoCache
+from .client_index import ClientIndex
+from .client_lookup import ClientLookup
 from .endpoints import Openid4VCIEndpoints
+from .logging_util import Lazy
+from .metrics import configure as configure_metrics
+from .metrics import instrument
+from .metrics import metrics_response
+from .router import Router
+from .storage.expiry import Sweeper
+from .tracing import TracedConstructor
+from .tracing import configure as configure_tracing
+from .tracing import correlate
+from .tracing import traced
+from .trust_chain_cache import TrustChainCache
+from .unit_of_work import current_unit_of_work
+from .unit_of_work import request_scoped
 
 try:
     from satosa.context import add_prompt_to_context
@@ -53,9 +69,17 @@ class OpenID4VCIFrontend(FrontendModule, Openid4VCIEndpoints):
         FrontendModule.__init__(self, auth_req_callback_func, internal_attributes, base_url, name)
         self.app = idpy_oidc_app(conf)
         self.app.server.frontend_name = name
-        Openid4VCIEndpoints.__init__(self, self.app, auth_req_callback_func, self.converter)
+        Openid4VCIEndpoints.__init__(self, self.app, auth_req_callback_func, self.converter,
+                                     cache_conf=conf.get("cache", {}),
+                                     batch_conf=conf.get("batch_credential"),
+                                     deferred_conf=conf.get("deferred_credential"),
+                                     signing_conf=conf.get("signing"),
+                                     authorization_details_conf=conf.get("authorization_details"))
         # registered endpoints will be filled by self.register_endpoints
         self.endpoints = None
+        self.router = Router()
+        self.metrics_conf = conf.get("metrics")
+        configure_metrics(self.metrics_conf)
         federation_persistence = getattr(self.app.federation_entity, "persistence", None)
         if federation_persistence:
             federation_persistence.store_state()
@@ -66,6 +90,76 @@ class OpenID4VCIFrontend(FrontendModule, Openid4VCIEndpoints):
         if oic_persistence:
             oic_persistence.store_state()
 
+        # Removal of expired records, by one of the workers
+        gc_conf = conf.get("gc")
+        if gc_conf:
+            _storages = [getattr(p, "storage", None) for p in
+                         [federation_persistence, oauth_persistence, oic_persistence]]
+            self.sweeper = Sweeper([s for s in _storages if s is not None],
+                                   interval=gc_conf.get("interval", 300),
+                                   batch_size=gc_conf.get("batch_size", 500),
+                                   lock_file=gc_conf.get("lock_file", "gc.lock"))
+            self.sweeper.start()
+        else:
+            self.sweeper = None
+
+        # Tracing of the issuance flow
+        _tracing_conf = conf.get("tracing")
+        configure_tracing(_tracing_conf)
+        if _tracing_conf:
+            self._trace_credential_constructors()
+
+        # Indexes from access tokens and client credentials to clients, kept in the storage
+        # of the credential issuer's persistence layer
+        _client_index_conf = conf.get("client_index")
+        if _client_index_conf is not None and getattr(oic_persistence, "storage", None):
+            self.client_index = ClientIndex(oic_persistence.storage, **_client_index_conf)
+
+        # Client information cached in this process
+        _client_cache_conf = conf.get("client_cache")
+        _client_cache = None
+        if _client_cache_conf is not None:
+            _client_cache = ClientInfoCache(**_client_cache_conf)
+
+        # Both in front of the persistence layers, where load_cdb looks
+        if self.client_index is not None or _client_cache is not None:
+            self.client_lookup = ClientLookup(self.client_index, _client_cache)
+            if federation_persistence is not None:
+                self.client_lookup.install(federation_persistence)
+            # the client database of these has the client secrets that are indexed
+            for _guise in ["oauth_authorization_server", "openid_credential_issuer"]:
+                _entity = self.app.server[_guise]
+                if getattr(_entity, "persistence", None) is not None:
+                    self.client_lookup.install(_entity.persistence, _entity.context)
+
+        # Verified trust chains shared by all workers, by default in the federation entity's
+        # storage
+        _trust_chain_conf = conf.get("trust_chain_cache")
+        if _trust_chain_conf is not None:
+            _trust_chain_conf = dict(_trust_chain_conf)
+            if _trust_chain_conf.get("storage") is None:
+                _trust_chain_conf["storage"] = getattr(federation_persistence, "storage", None)
+            self.trust_chain_cache = TrustChainCache(**_trust_chain_conf)
+            self.trust_chain_cache.install(self.app.server["federation_entity"])
+        else:
+            self.trust_chain_cache = None
+
+        # Credential endpoint served by an ASGI application
+        _async_conf = conf.get("async_credential")
+        if _async_conf:
+            self.async_issuance = AsyncCredentialIssuance(self, **_async_conf)
+        else:
+            self.async_issuance = None
+
+    def _trace_credential_constructors(self):
+        _endpoint = self.app.server["openid_credential_issuer"].get_endpoint("credential")
+        _constructors = getattr(_endpoint, "credential_constructor", None)
+        if isinstance(_constructors, dict):
+            for _name, _constructor in _constructors.items():
+                if not isinstance(_constructor, TracedConstructor):
+                    _constructors[_name] = TracedConstructor(_constructor, _name)
+
+    @traced("oci_jwks_endpoint")
     def oci_jwks_endpoint(self, context: Context):
         """
         Construct the JWKS document (served at /jwks).
@@ -76,9 +170,10 @@ class OpenID4VCIFrontend(FrontendModule, Openid4VCIEndpoints):
         :return: HTTP response to the client
         """
         logger.debug("At the OCI JWKS endpoint")
-        jwks = self.app.server["openid_credential_issuer"].context.keyjar.export_jwks("")
-        return JsonResponse(jwks)
+        _keyjar = self.app.server["openid_credential_issuer"].context.keyjar
+        return self.jwks_cache.response(context, "openid_credential_issuer", _keyjar)
 
+    @traced("oas_jwks_endpoint")
     def oas_jwks_endpoint(self, context: Context):
         """
         Construct the JWKS document (served at /jwks).
@@ -89,8 +184,18 @@ class OpenID4VCIFrontend(FrontendModule, Openid4VCIEndpoints):
         :return: HTTP response to the client
         """
         logger.debug("At the OAS JWKS endpoint")
-        jwks = self.app.server["oauth_authorization_server"].context.keyjar.export_jwks("")
-        return JsonResponse(jwks)
+        _keyjar = self.app.server["oauth_authorization_server"].context.keyjar
+        return self.jwks_cache.response(context, "oauth_authorization_server", _keyjar)
+
+    def metrics_endpoint(self, context: Context):
+        """
+        The collected metrics in the Prometheus text format. Only served if configured, the
+        endpoint is not authenticated, access to it has to be restricted in front of SATOSA.
+
+        :param context: the current context
+        :return: HTTP response to the client
+        """
+        return metrics_response()
 
     def register_endpoints(self, *kwargs):
         """
@@ -114,10 +219,46 @@ class OpenID4VCIFrontend(FrontendModule, Openid4VCIEndpoints):
         # uri_path = self.app.server["openid_credential_issuer"].config["key_conf"]["uri_path"]
         # url_map.append((f"^{uri_path}", self.oci_jwks_endpoint))
 
-        logger.debug(f"Loaded Credential Issuer endpoints: {url_map}")
+        if self.batch_conf:
+            _path = self.batch_conf.get("path", "batch_credential")
+            url_map.append((f"^{_path}", self.batch_credential_endpoint))
+
+        if self.deferred_conf:
+            _path = self.deferred_conf.get("path", "deferred_credential")
+            url_map.append((f"^{_path}", self.deferred_credential_endpoint))
+
+        if self.metrics_conf:
+            url_map = [(_path, instrument(_handler.__name__.replace("_endpoint", ""), _handler))
+                       for _path, _handler in url_map]
+            _path = self.metrics_conf.get("path", "metrics")
+            url_map.append((f"^{_path}", self.metrics_endpoint))
+
+        logger.debug("Loaded Credential Issuer endpoints: %s", url_map)
         self.endpoints = url_map
+        self.router = Router(url_map)
+
+        # Sign the Entity Configuration now rather than when the first request comes in
+        try:
+            self.entity_configuration_cache.warm()
+        except Exception as err:  # pragma: no cover
+            logger.warning("Could not pre-sign the Entity Configuration: %s", err)
+
+        # Fetch the authentic sources' keys in the background and keep them up to date
+        _jwks_cache = getattr(self.app.server["openid_credential_issuer"], "jwks_cache", None)
+        if _jwks_cache is not None:
+            _jwks_cache.start()
         return url_map
 
+    def dispatch(self, path: str):
+        """
+        Finds the endpoint handler for a request path without going through the regular
+        expressions in the url_map.
+
+        :param path: The request path, context.path
+        :return: The handler or None if no endpoint matches
+        """
+        return self.router.match(path)
+
     def _handle_backend_response(self, context: ExtendedContext, internal_resp):
         """
         Called by handle_authn_response, once a backend done its work
@@ -129,10 +270,10 @@ class OpenID4VCIFrontend(FrontendModule, Openid4VCIEndpoints):
         :type internal_resp: satosa.internal.InternalData
         :return: HTTP response to the client
         """
-        logger.debug(f"Internal_resp: {internal_resp}")
+        logger.debug("Internal_resp: %s", internal_resp)
 
         http_info = get_http_info(context)
-        logger.debug(f"context.state: {context.state.keys()}")
+        logger.debug("context.state: %s", Lazy(context.state.keys))
         orig_req = context.state[self.name]["oidc_request"]
 
         # _entity_type = self.app.server["openid_credential_issuer"]
@@ -141,12 +282,14 @@ class OpenID4VCIFrontend(FrontendModule, Openid4VCIEndpoints):
             # urlencoded
             orig_req = Message().from_urlencoded(orig_req)
 
-        _entity_type.persistence.restore_state(orig_req, http_info)
+        correlate(orig_req.get("request_uri"))
+        _uow = current_unit_of_work()
+        _uow.restore_state(_entity_type, orig_req, http_info)
         endpoint = _entity_type.get_endpoint("authorization")
         # have to look up the original authorization request in the PAR db
         _ec = endpoint.upstream_get("context")
-        _entity_type.persistence.restore_pushed_authorization(orig_req["request_uri"])
-        logger.debug(f"PAR_db: {list(_ec.par_db.keys())}")
+        _uow.restore_pushed_authorization(_entity_type, orig_req["request_uri"])
+        logger.debug("PAR_db: %s", Lazy(lambda: list(_ec.par_db.keys())))
         parse_req = None
         if _ec.par_db:
             _req_uri = orig_req.get("request_uri", "")
@@ -161,7 +304,7 @@ class OpenID4VCIFrontend(FrontendModule, Openid4VCIEndpoints):
         client_id = parse_req["client_id"]
 
         # sub = internal_resp.subject_id
-        logger.info(f"Response attributes = {internal_resp.attributes}")
+        logger.info("Response attributes = %s", internal_resp.attributes)
         # Which attribute/-s to use should be configurable
         sub = internal_resp.subject_id
         # sub = internal_resp.attributes.get("mail")
@@ -179,7 +322,7 @@ class OpenID4VCIFrontend(FrontendModule, Openid4VCIEndpoints):
         )
 
         session_manager = _ec.session_manager
-        client_info = _entity_type.persistence.restore_client_info(client_id)
+        client_info = _uow.restore_client_info(_entity_type, client_id)
         client_subject_type = client_info.get("subject_type", "public")
 
         scopes = parse_req.get("scopes", [])
@@ -212,7 +355,10 @@ class OpenID4VCIFrontend(FrontendModule, Openid4VCIEndpoints):
             logger.exception('Other error')
             return self.handle_error(excp=excp)
 
-        logger.debug(f"authz_part2 args: {_args}")
+        logger.debug("authz_part2 args: %s", _args)
+        _response_args = _args.get("response_args")
+        if _response_args is not None and "code" in _response_args:
+            correlate(_response_args["code"])
 
         if isinstance(_args, ResponseMessage) and "error" in _args:  # pragma: no cover
             return self.send_response(JsonResponse(_args, status="403"))
@@ -230,7 +376,7 @@ class OpenID4VCIFrontend(FrontendModule, Openid4VCIEndpoints):
         info = endpoint.do_response(response_args=_args.get("response_args"), request=parse_req,
                                     **kwargs)
 
-        logger.debug(f"Response from OCI: {info}")
+        logger.debug("Response from OCI: %s", info)
 
         info_response = info["response"]
         _response_placement = info.get(
@@ -243,13 +389,15 @@ class OpenID4VCIFrontend(FrontendModule, Openid4VCIEndpoints):
             merged_params = {**original_params, **data}
             updated_query = urlencode(merged_params, doseq=True)
             redirect_url = url_components._replace(query=updated_query).geturl()
-            logger.debug(f"Redirect to: {redirect_url}")
+            logger.debug("Redirect to: %s", redirect_url)
             resp = SeeOther(redirect_url)
         else:  # pragma: no cover
             raise NotImplementedError()
 
         return resp
 
+    @traced("handle_authn_response")
+    @request_scoped
     def handle_authn_response(self, context: ExtendedContext, internal_resp):
         """
         See super class method satosa.frontends.base.FrontendModule#handle_authn_response
@@ -257,9 +405,7 @@ class OpenID4VCIFrontend(FrontendModule, Openid4VCIEndpoints):
         :type internal_resp: satosa.internal.InternalData
         :rtype satosa.response.SeeOther
         """
-        _claims = self.converter.from_internal("openid", internal_resp.attributes)
-        claims = {k: v for k, v in _claims.items() if v}
-        combined_claims = dict([i for i in combine_claim_values(claims.items())])
+        combined_claims = self.claim_mapping.get("openid").claims(internal_resp.attributes)
 
         response = self._handle_backend_response(context, internal_resp)
 
@@ -273,6 +419,7 @@ class OpenID4VCIFrontend(FrontendModule, Openid4VCIEndpoints):
 
         _entity_type = self.app.server["oauth_authorization_server"]
         client_subject_id = combine_client_subject_id(client_id, internal_resp.subject_id)
-        _entity_type.persistence.store_claims(combined_claims, client_subject_id)
-        _entity_type.persistence.store_state(client_id)
+        _uow = current_unit_of_work()
+        _uow.store_claims(_entity_type, combined_claims, client_subject_id)
+        _uow.store_state(_entity_type, client_id)
         return self.send_response(response)
@@ -1,3 +1,4 @@
+import logging
 from typing import Any
 from typing import Callable
 from typing import Optional
@@ -8,6 +9,12 @@ from cryptojwt import KeyJar
 from idpyoidc.server import ASConfiguration
 from idpyoidc.server.util import execute
 
+from satosa_openid4vci.credential_index import CredentialConfigurationIndex
+from satosa_openid4vci.http_client import PooledHTTPClient
+from satosa_openid4vci.jwks_cache import JWKSCache
+
+logger = logging.getLogger(__name__)
+
 
 class OpenidCredentialIssuer(openid4v.openid_credential_issuer.OpenidCredentialIssuer):
 
@@ -25,6 +32,11 @@ class OpenidCredentialIssuer(openid4v.openid_credential_issuer.OpenidCredentialI
             key_conf: Optional[dict] = None,
             **kwargs
     ):
+        # One pooled HTTP client for the guise and its credential constructors
+        if httpc is None:
+            httpc = PooledHTTPClient(**(config.get("http_client") or {}))
+        self.http_client = httpc
+
         openid4v.openid_credential_issuer.OpenidCredentialIssuer.__init__(
             self,
             config=config,
@@ -48,4 +60,50 @@ class OpenidCredentialIssuer(openid4v.openid_credential_issuer.OpenidCredentialI
         _storage = execute(_storage_conf)
         persistence_conf["kwargs"]["storage"] = _storage
         persistence_conf["kwargs"]["upstream_get"] = self.unit_get
-        self.persistence = execute(persistence_conf)
\ No newline at end of file
+        self.persistence = execute(persistence_conf)
+
+        # The authentic sources' keys, fetched once per jwks_url and kept up to date once
+        # jwks_cache.start() is called
+        self.jwks_cache = JWKSCache(httpc=self.http_client, httpc_params=httpc_params,
+                                    keyjar=getattr(self.context, "keyjar", None),
+                                    **(config.get("jwks_cache") or {}))
+        self._share_with_constructors()
+
+        # What credentials can be asked for, and what goes into them
+        self.build_credential_index()
+
+    def credential_configurations_supported(self) -> dict:
+        _provider_info = getattr(self.context, "provider_info", None) or {}
+        _supported = _provider_info.get("credential_configurations_supported")
+        if _supported is None and hasattr(self.context, "claims"):
+            _supported = self.context.claims.get_preference("credential_configurations_supported")
+        return _supported or {}
+
+    def build_credential_index(self) -> CredentialConfigurationIndex:
+        """
+        (Re)builds the index over credential_configurations_supported. To be called when
+        the configuration has changed.
+        """
+        self.credential_index = CredentialConfigurationIndex(
+            self.credential_configurations_supported(), self._credential_constructors())
+        return self.credential_index
+
+    def _credential_constructors(self) -> dict:
+        try:
+            _endpoint = self.get_endpoint("credential")
+        except (KeyError, AttributeError):  # pragma: no cover
+            return {}
+        return getattr(_endpoint, "credential_constructor", None) or {}
+
+    def _share_with_constructors(self):
+        for _name, _constructor in self._credential_constructors().items():
+            _constructor.httpc = self.http_client
+            _jwks_url = getattr(_constructor, "jwks_url", None)
+            if not _jwks_url:
+                continue
+            _constructor.jwks_cache = self.jwks_cache
+            self.jwks_cache.register(_jwks_url)
+            _fetch_jwks = getattr(_constructor, "fetch_jwks", None)
+            if callable(_fetch_jwks):
+                # Called again only when the cache has seen new keys
+                _constructor.fetch_jwks = self.jwks_cache.memoize(_jwks_url, _fetch_jwks)
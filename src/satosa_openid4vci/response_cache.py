@@ -0,0 +1,210 @@
+"""
+In-process caches for responses that only change when the configuration or the keys change.
+"""
+from collections import namedtuple
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Callable
+from typing import Optional
+
+from cryptojwt import KeyJar
+from cryptojwt.exception import IssuerNotFound
+from cryptojwt.jws.jws import factory
+from satosa.context import Context
+from satosa.response import Response
+from satosa_openid4vci.signing_policy import order_jwks
+
+logger = logging.getLogger(__name__)
+
+JWKSEntry = namedtuple("JWKSEntry", ["generation", "body", "etag"])
+SignedEntry = namedtuple("SignedEntry",
+                         ["fingerprint", "jws", "issued_at", "refresh_at", "expires_at"])
+
+
+def keyjar_generation(keyjar: KeyJar, issuer_id: Optional[str] = "") -> tuple:
+    """
+    Returns a cheap fingerprint of the keys an issuer has in a key jar.
+    Adding, replacing or deactivating a key (which is what key rotation does) changes the
+    fingerprint, so it can be used as a generation counter.
+    """
+    try:
+        _keys = keyjar.get_issuer_keys(issuer_id)
+    except IssuerNotFound:
+        return ()
+    return tuple((id(_key), _key.kid, _key.inactive_since) for _key in _keys)
+
+
+def make_etag(body: bytes) -> str:
+    """Strong entity tag for a response body."""
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    """
+    Implements the weak comparison RFC 9110 prescribes for If-None-Match.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for _tag in if_none_match.split(","):
+        _tag = _tag.strip()
+        if _tag.startswith("W/"):
+            _tag = _tag[2:]
+        if _tag == etag:
+            return True
+    return False
+
+
+def get_request_header(context: Context, name: str) -> str:
+    _headers = getattr(context, "http_headers", None) or {}
+    return _headers.get(f"HTTP_{name.upper().replace('-', '_')}", "")
+
+
+class JWKSResponseCache(object):
+    """
+    Keeps the serialized JWKS of each guise together with an ETag.
+    An entry is rebuilt only when the generation of the key jar it was built from changes.
+
+    :param max_age: Cache-Control max-age of the response
+    :param key_order: Key types in the order the keys should be listed, see
+        :py:func:`satosa_openid4vci.signing_policy.order_jwks`
+    """
+
+    def __init__(self, max_age: Optional[int] = 3600, key_order: Optional[list] = None):
+        self.max_age = max_age
+        self.key_order = key_order
+        self._entry = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, name: str, keyjar: KeyJar, issuer_id: Optional[str] = "") -> JWKSEntry:
+        generation = keyjar_generation(keyjar, issuer_id)
+        _entry = self._entry.get(name)
+        if _entry is not None and _entry.generation == generation:
+            return _entry
+
+        with self._lock:
+            _entry = self._entry.get(name)
+            if _entry is None or _entry.generation != generation:
+                logger.debug("Serializing the JWKS of %s", name)
+                _jwks = keyjar.export_jwks(issuer_id=issuer_id)
+                if self.key_order:
+                    _jwks = order_jwks(_jwks, self.key_order)
+                _body = json.dumps(_jwks).encode("utf-8")
+                _entry = JWKSEntry(generation, _body, make_etag(_body))
+                self._entry[name] = _entry
+        return _entry
+
+    def invalidate(self, name: Optional[str] = ""):
+        with self._lock:
+            if name:
+                self._entry.pop(name, None)
+            else:
+                self._entry = {}
+
+    def response(self, context: Context, name: str, keyjar: KeyJar,
+                 issuer_id: Optional[str] = "") -> Response:
+        """
+        Returns a response carrying the JWKS or, if the client already has the current version,
+        a 304 Not Modified.
+        """
+        _entry = self.lookup(name, keyjar, issuer_id)
+        headers = [("ETag", _entry.etag),
+                   ("Cache-Control", f"public, max-age={self.max_age}")]
+        if etag_matches(_entry.etag, get_request_header(context, "If-None-Match")):
+            return Response("", status="304 Not Modified", headers=headers)
+        return Response(_entry.body, headers=headers, content="application/json")
+
+
+class SignedStatementCache(object):
+    """
+    Keeps a signed statement (like an Entity Configuration) and re-signs it only when the
+    information it is built from changes or when a fraction of its lifetime has passed.
+    Re-signing is done in a background thread while the previous statement is still served.
+    A request only signs if there is no usable statement at all.
+
+    :param sign: Returns a freshly signed statement
+    :param fingerprint: Returns a digest of the information the statement is built from
+    :param refresh_fraction: How much of the lifetime (exp - iat) that may pass before
+        re-signing
+    :param check_interval: The fingerprint is computed at most this often (seconds)
+    """
+
+    def __init__(self,
+                 sign: Callable[[], str],
+                 fingerprint: Callable[[], str],
+                 refresh_fraction: Optional[float] = 0.5,
+                 check_interval: Optional[int] = 5):
+        self.sign = sign
+        self.fingerprint = fingerprint
+        self.refresh_fraction = refresh_fraction
+        self.check_interval = check_interval
+        self._entry = None
+        self._fingerprint = None
+        self._checked_at = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._sign_lock = threading.Lock()
+
+    def _build(self) -> SignedEntry:
+        _now = time.time()
+        _fingerprint = self.fingerprint()
+        _jws = self.sign()
+        _payload = factory(_jws).jwt.payload()
+        _iat = _payload.get("iat", _now)
+        _exp = _payload.get("exp")
+        if _exp:
+            _refresh_at = _iat + (_exp - _iat) * self.refresh_fraction
+        else:
+            _exp = _refresh_at = float("inf")
+
+        self._fingerprint = _fingerprint
+        self._checked_at = _now
+        logger.debug("Signed statement refreshed, next refresh at %s", _refresh_at)
+        return SignedEntry(_fingerprint, _jws, _iat, _refresh_at, _exp)
+
+    def _refresh(self):
+        try:
+            with self._sign_lock:
+                self._entry = self._build()
+        except Exception as err:
+            logger.exception("Could not refresh signed statement: %s", err)
+        finally:
+            self._refreshing = False
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    def warm(self):
+        with self._sign_lock:
+            self._entry = self._build()
+
+    def invalidate(self):
+        self._entry = None
+
+    def _changed(self, entry: SignedEntry, now: float) -> bool:
+        if now - self._checked_at >= self.check_interval:
+            self._fingerprint = self.fingerprint()
+            self._checked_at = now
+        return self._fingerprint != entry.fingerprint
+
+    def get(self) -> str:
+        _now = time.time()
+        _entry = self._entry
+        if _entry is None or _now >= _entry.expires_at:
+            with self._sign_lock:
+                _entry = self._entry
+                if _entry is None or _now >= _entry.expires_at:
+                    _entry = self._entry = self._build()
+            return _entry.jws
+
+        if _now >= _entry.refresh_at or self._changed(_entry, _now):
+            self.refresh_in_background()
+        return _entry.jws
@@ -0,0 +1,67 @@
+"""
+Maps request paths to endpoint handlers.
+
+SATOSA gets a list of ``(regex, handler)`` tuples from the frontend and tries them one by one.
+The router is built from the same list once, at registration time, and finds the handler with
+one dictionary lookup for exact paths or a walk over the path segments for paths below an
+endpoint, independent of the number of endpoints.
+"""
+import logging
+from typing import Callable
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(path: str) -> str:
+    return path.lstrip("^").strip("/")
+
+
+class Router(object):
+    """
+    :param url_map: List of (path regex, handler) tuples as returned by register_endpoints
+    """
+
+    def __init__(self, url_map: Optional[list] = None):
+        self.exact = {}
+        self.trie = {}
+        for _path, _handler in url_map or []:
+            self.add(_path, _handler)
+
+    def add(self, path: str, handler: Callable):
+        """
+        Adds a route. If the same path is added more than once the first handler is kept,
+        that is the one SATOSA would use.
+        """
+        _path = _normalize(path)
+        if _path in self.exact:
+            logger.warning("Path %s already routed, ignoring later handler", _path)
+            return
+        self.exact[_path] = handler
+
+        _node = self.trie
+        for _segment in _path.split("/"):
+            _node = _node.setdefault(_segment, {})
+        _node[None] = handler
+
+    def match(self, path: str) -> Optional[Callable]:
+        """
+        Returns the handler of the endpoint at the path or of the closest endpoint above it.
+        """
+        _path = path.strip("/")
+        try:
+            return self.exact[_path]
+        except KeyError:
+            pass
+
+        _handler = None
+        _node = self.trie
+        for _segment in _path.split("/"):
+            _node = _node.get(_segment)
+            if _node is None:
+                break
+            _handler = _node.get(None, _handler)
+        return _handler
+
+    def __len__(self):
+        return len(self.exact)
@@ -0,0 +1,223 @@
+"""
+Which algorithm each kind of signed artefact is signed with.
+
+Every guise has an RSA and a P-256 key. Which of them is used is left to defaults spread over
+cryptojwt, fedservice, idpyoidc and openid4v, and a JWT signed without an explicit algorithm
+is RS256 signed, several times slower to sign than ES256. The policy is opt-in, it lists the
+algorithms to use per artefact, in order of preference, in the frontend configuration::
+
+    signing:
+      entity_configuration: [ES256, RS256]
+      trust_mark: [ES256, RS256]
+      access_token: [ES256, RS256]
+      refresh_token: [ES256, RS256]
+      credential: [ES256, RS256]
+      jwks_order: [EC, RSA]
+
+The first algorithm there is a key for, and that the receiving party accepts, is used.
+An artefact left out of the configuration, or ``signing: true``, has EC first. Without a
+signing configuration it is all left to the libraries.
+"""
+import logging
+from typing import Any
+from typing import Optional
+from typing import Union
+
+from cryptojwt import KeyJar
+from cryptojwt.jws.jws import JWS
+from cryptojwt.jws.jws import factory
+from cryptojwt.jws.utils import alg2keytype
+
+logger = logging.getLogger(__name__)
+
+ARTEFACTS = ["entity_configuration", "trust_mark", "access_token", "refresh_token",
+             "credential"]
+DEFAULT_ALGORITHMS = ["ES256", "RS256"]
+DEFAULT_KEY_ORDER = ["EC", "OKP", "RSA"]
+
+# Token handler per artefact, see idpyoidc.server.token.handler.TokenHandler
+TOKEN_HANDLERS = {"access_token": "access_token", "refresh_token": "refresh_token"}
+
+
+def _as_list(value: Union[None, str, list]) -> list:
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return list(value)
+
+
+def signing_keys(keyjar: KeyJar, alg: str, issuer_ids: Optional[list] = None) -> list:
+    """
+    The keys in keyjar that can sign with alg. Keys are looked for under each of issuer_ids,
+    in order, and under "" which is where an entity keeps its own keys.
+    """
+    _key_type = alg2keytype(alg)
+    for _issuer_id in _as_list(issuer_ids) + [""]:
+        _keys = keyjar.get_signing_key(_key_type, issuer_id=_issuer_id)
+        if _keys:
+            return _keys
+    return []
+
+
+def order_jwks(jwks: dict, key_order: list) -> dict:
+    """
+    The JWKS with the keys ordered by key type, in the order of key_order. Keys of other
+    types come last, keys of the same type keep their order.
+    """
+    _rank = {_kty: _n for _n, _kty in enumerate(key_order)}
+    _keys = sorted(jwks.get("keys", []), key=lambda k: _rank.get(k.get("kty"), len(key_order)))
+    return dict(jwks, keys=_keys)
+
+
+class SigningPolicy(object):
+    """
+    :param entity_configuration: Algorithms for the Entity Configuration
+    :param trust_mark: Algorithms for trust marks this entity issues
+    :param access_token: Algorithms for JWT access tokens
+    :param refresh_token: Algorithms for JWT refresh tokens
+    :param credential: Algorithms for credentials, limited by what the credential
+        configuration lists in credential_signing_alg_values_supported
+    :param jwks_order: Key types, the order keys are listed in published JWKSs
+    """
+
+    def __init__(self, entity_configuration: Optional[Union[str, list]] = None,
+                 trust_mark: Optional[Union[str, list]] = None,
+                 access_token: Optional[Union[str, list]] = None,
+                 refresh_token: Optional[Union[str, list]] = None,
+                 credential: Optional[Union[str, list]] = None,
+                 jwks_order: Optional[list] = None, **kwargs):
+        _conf = {"entity_configuration": entity_configuration, "trust_mark": trust_mark,
+                 "access_token": access_token, "refresh_token": refresh_token,
+                 "credential": credential}
+        self.algorithms = {_artefact: _as_list(_value) or list(DEFAULT_ALGORITHMS)
+                           for _artefact, _value in _conf.items()}
+        self.jwks_order = _as_list(jwks_order) or list(DEFAULT_KEY_ORDER)
+
+    def algorithm(self, artefact: str, keyjar: Optional[KeyJar] = None,
+                  issuer_ids: Optional[list] = None,
+                  allowed: Optional[list] = None) -> Optional[str]:
+        """
+        :param artefact: One of ARTEFACTS
+        :param keyjar: If given, only algorithms there is a signing key for are considered
+        :param allowed: If given, the algorithms the receiving party accepts
+        :return: The algorithm to sign with, None if none of the preferred can be used
+        """
+        for _alg in self.algorithms[artefact]:
+            if allowed and _alg not in allowed:
+                continue
+            if keyjar is not None and not signing_keys(keyjar, _alg, issuer_ids):
+                continue
+            return _alg
+        return None
+
+    def preferred_first(self, artefact: str, algorithms: list) -> list:
+        """
+        algorithms with the preferred ones first, the others after in their original order.
+        """
+        _preference = self.algorithms[artefact]
+        _rank = {_alg: _n for _n, _alg in enumerate(_preference)}
+        return sorted(algorithms, key=lambda a: _rank.get(a, len(_preference)))
+
+    def resign(self, jws: str, artefact: str, keyjar: KeyJar,
+               issuer_ids: Optional[list] = None, allowed: Optional[list] = None) -> str:
+        """
+        Signs the payload of jws again if it was not signed with the algorithm the policy
+        picks. The payload and the headers other than alg and kid are kept as they are.
+        The signing key is looked for under issuer_ids, the iss of the payload and "".
+        """
+        _jws = factory(jws)
+        if not _jws:
+            return jws
+        _headers = _jws.jwt.headers
+        _payload = _jws.jwt.part[1]
+        _iss = _jws.jwt.payload().get("iss")
+        _issuer_ids = _as_list(issuer_ids) + ([_iss] if _iss else [])
+
+        _alg = self.algorithm(artefact, keyjar, _issuer_ids, allowed)
+        if _alg is None or _alg == _headers.get("alg"):
+            return jws
+
+        _extra = {k: v for k, v in _headers.items() if k not in ("alg", "kid")}
+        _signer = JWS(_payload.decode("utf-8"), alg=_alg, **_extra)
+        return _signer.sign_compact(signing_keys(keyjar, _alg, _issuer_ids))
+
+    # ---- applying the policy ----
+
+    def install(self, server: Any):
+        """
+        Applies the policy to the token handlers, the credential constructors and a trust
+        mark issuer, if the federation entity has one.
+        """
+        for _guise in ["oauth_authorization_server", "openid_credential_issuer"]:
+            if _guise in server:
+                self._install_tokens(server[_guise])
+        if "openid_credential_issuer" in server:
+            self._install_credentials(server["openid_credential_issuer"])
+        if "federation_entity" in server:
+            self._install_trust_marks(server["federation_entity"])
+
+    def _install_tokens(self, guise: Any):
+        _context = guise.context
+        _handler = getattr(getattr(_context, "session_manager", None), "token_handler", None)
+        _keyjar = getattr(_context, "keyjar", None)
+        if _handler is None or _keyjar is None:
+            return
+
+        for _artefact, _token_class in TOKEN_HANDLERS.items():
+            try:
+                _token = _handler[_token_class]
+            except KeyError:
+                continue
+            if not hasattr(_token, "alg"):  # not a JWT
+                continue
+            _alg = self.algorithm(_artefact, _keyjar, [getattr(_token, "issuer", "")])
+            if _alg and _alg != _token.alg:
+                logger.info("Signing %s with %s instead of %s", _artefact, _alg, _token.alg)
+                _token.alg = _alg
+
+    def _install_credentials(self, guise: Any):
+        _provider_info = getattr(guise.context, "provider_info", None) or {}
+        _supported = _provider_info.get("credential_configurations_supported") or {}
+        for _conf in _supported.values():
+            _algs = _conf.get("credential_signing_alg_values_supported")
+            if _algs:
+                _conf["credential_signing_alg_values_supported"] = self.preferred_first(
+                    "credential", _algs)
+
+        try:
+            _endpoint = guise.get_endpoint("credential")
+        except (KeyError, AttributeError):  # pragma: no cover
+            return
+        _constructors = getattr(_endpoint, "credential_constructor", None) or {}
+        for _name, _constructor in _constructors.items():
+            _allowed = (_supported.get(_name) or {}).get("credential_signing_alg_values_supported")
+            for _attr in ["sign_alg", "signing_alg"]:
+                if isinstance(getattr(_constructor, _attr, None), str):
+                    _alg = self.algorithm("credential", allowed=_allowed)
+                    if _alg:
+                        setattr(_constructor, _attr, _alg)
+
+    def _install_trust_marks(self, federation_entity: Any):
+        try:
+            _issuer = getattr(federation_entity.get_endpoint("status"), "trust_mark_issuer", None)
+        except (KeyError, AttributeError):
+            return
+        _create = getattr(_issuer, "create_trust_mark", None)
+        if _create is None:
+            return
+
+        def create_trust_mark(*args, **kwargs):
+            _trust_mark = _create(*args, **kwargs)
+            return self.resign(_trust_mark, "trust_mark", federation_entity.context.keyjar)
+
+        _issuer.create_trust_mark = create_trust_mark
+
+
+def signing_policy(conf: Union[None, bool, dict]) -> Optional[SigningPolicy]:
+    """
+    The policy given by the frontend's signing configuration, None if there is none.
+    """
+    if not conf:
+        return None
+    return SigningPolicy(**(conf if isinstance(conf, dict) else {}))
@@ -0,0 +1,212 @@
+"""
+Expiry of persisted records.
+
+Which records expire when is given by a policy mapping information types to a time to live.
+Patterns are shell style. Storages that can store a time to live with each record (RedisDB,
+SQLiteDB) get it from ChangeTrackingStorage when the record is written::
+
+    storage:
+      class: satosa_openid4vci.storage.tracking.ChangeTrackingStorage
+      kwargs:
+        ttl:
+          par*: 600
+          session*: 86400
+        storage:
+          class: satosa_openid4vci.storage.sqlite_db.SQLiteDB
+          ...
+
+Expired records are not returned by these storages. They are removed by the sweeper, one
+worker of those sharing the lock file runs it::
+
+    gc:
+      interval: 300
+      batch_size: 500
+      lock_file: gc.lock
+
+One-file-per-key storages have no time to live per record and are not swept. The file names,
+and so what a pattern matches, depend on how the persistence layer names its records, so
+:py:func:`purge_directory` is only run by hand, see script/expire_stored_dir.py, after a dry
+run has shown what would be removed.
+"""
+import fcntl
+from fnmatch import fnmatchcase
+import logging
+import os
+import threading
+import time
+from typing import Any
+from typing import Optional
+
+from cryptojwt.utils import importer
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryPolicy(object):
+    """
+    :param ttl: Pattern to time to live (seconds)
+    :param default: Time to live for what no pattern matches, None means never expires
+    """
+
+    def __init__(self, ttl: Optional[dict] = None, default: Optional[int] = None):
+        self.ttl = ttl or {}
+        self.default = default
+        self._resolved = {}
+
+    def __bool__(self):
+        return bool(self.ttl) or self.default is not None
+
+    def ttl_for(self, name: str) -> Optional[int]:
+        if name in self._resolved:
+            return self._resolved[name]
+
+        _ttl = self.ttl.get(name)
+        if _ttl is None:
+            for _pattern, _val in self.ttl.items():
+                if fnmatchcase(name, _pattern):
+                    _ttl = _val
+                    break
+            else:
+                _ttl = self.default
+        if len(self._resolved) < 1000:
+            self._resolved[name] = _ttl
+        return _ttl
+
+
+def purge_directory(fdir: str,
+                    policy: ExpiryPolicy,
+                    key_conv: Optional[Any] = None,
+                    limit: Optional[int] = 500,
+                    now: Optional[float] = None,
+                    dry_run: Optional[bool] = False,
+                    cache: Optional[dict] = None) -> list:
+    """
+    Removes files, in a one-file-per-key directory, that have not been written to for longer
+    than their time to live. At most limit files are removed per call.
+
+    :param fdir: The directory
+    :param policy: The expiry policy, matched against the decoded file names
+    :param key_conv: How the file names were encoded, a class instance or an import path
+    :param limit: Max number of files to remove
+    :param now: The time to compare with
+    :param dry_run: Only report what would be removed
+    :param cache: A storage's in-memory copy of the directory content, kept in sync
+    :return: The decoded names of the removed files
+    """
+    if isinstance(key_conv, str):
+        key_conv = importer(key_conv)()
+    now = now or time.time()
+    removed = []
+    for _fname in os.listdir(fdir):
+        if len(removed) >= limit:
+            break
+        if _fname.endswith(".lock"):
+            continue
+        _path = os.path.join(fdir, _fname)
+        try:
+            _name = key_conv.deserialize(_fname) if key_conv else _fname
+        except Exception:
+            _name = _fname
+        _ttl = policy.ttl_for(_name)
+        if _ttl is None:
+            continue
+        try:
+            _mtime = os.stat(_path).st_mtime
+        except FileNotFoundError:
+            continue
+        if _mtime + _ttl > now:
+            continue
+
+        removed.append(_name)
+        if dry_run:
+            continue
+        for _file in (_path, f"{_path}.lock"):
+            try:
+                os.unlink(_file)
+            except FileNotFoundError:
+                pass
+        if cache is not None:
+            cache.pop(_fname, None)
+    return removed
+
+
+def purge_storage(storage: Any, limit: Optional[int] = 500) -> int:
+    """
+    Removes expired records from a storage that stores a time to live with each record.
+
+    :return: Number of records removed
+    """
+    # unwrap ChangeTrackingStorage and similar wrappers
+    while hasattr(storage, "storage") and not isinstance(storage.storage, dict):
+        storage = storage.storage
+
+    if hasattr(storage, "purge_expired"):
+        return storage.purge_expired(limit=limit)
+    return 0
+
+
+class Sweeper(object):
+    """
+    Periodically removes expired records from a set of storages, in a daemon thread.
+    Each run removes at most batch_size records per storage.
+
+    Of the processes using the same lock file only the one holding the lock sweeps. The lock
+    is held until the process ends, then another process takes over.
+
+    :param storages: The storages to sweep
+    :param interval: Seconds between runs
+    :param batch_size: Max number of records removed per storage and run
+    :param lock_file: The lock file, None means this process always sweeps
+    """
+
+    def __init__(self, storages: list, interval: Optional[int] = 300,
+                 batch_size: Optional[int] = 500, lock_file: Optional[str] = None):
+        self.storages = storages
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lock_file = lock_file
+        self._lock_fd = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def has_lock(self) -> bool:
+        if self.lock_file is None or self._lock_fd is not None:
+            return True
+        _fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(_fd)
+            return False
+        self._lock_fd = _fd
+        logger.info("Sweeping expired records in process %d", os.getpid())
+        return True
+
+    def sweep(self) -> int:
+        n = 0
+        for _storage in self.storages:
+            try:
+                n += purge_storage(_storage, limit=self.batch_size)
+            except Exception as err:
+                logger.warning("Sweeping %s failed: %s", _storage, err)
+        if n:
+            logger.info("Removed %d expired record(s)", n)
+        return n
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.has_lock():
+                self.sweep()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="storage-sweeper",
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
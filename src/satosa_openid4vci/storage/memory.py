@@ -0,0 +1,149 @@
+"""
+A pure Python, in-memory stand-in for the subset of the Redis client API that
+:py:class:`satosa_openid4vci.storage.redis_db.RedisDB` uses.
+Meant for tests and for running a single process without a Redis server.
+"""
+from fnmatch import fnmatchcase
+import threading
+import time
+from typing import Optional
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_instance(name: Optional[str] = "") -> "InMemoryRedis":
+    """Returns the process wide instance with this name, one is created if needed."""
+    with _instances_lock:
+        if name not in _instances:
+            _instances[name] = InMemoryRedis()
+        return _instances[name]
+
+
+class InMemoryRedis(object):
+    """
+    Values are kept as strings, like a Redis client created with decode_responses=True.
+    Keys with a time to live are expired when they are accessed.
+    """
+
+    def __init__(self):
+        self._db = {}
+        self._expires = {}
+        self._lock = threading.RLock()
+
+    def _alive(self, name: str) -> bool:
+        _exp = self._expires.get(name)
+        if _exp is not None and _exp <= time.time():
+            self._db.pop(name, None)
+            del self._expires[name]
+            return False
+        return name in self._db
+
+    def get(self, name: str) -> Optional[str]:
+        with self._lock:
+            if self._alive(name):
+                return self._db[name]
+            return None
+
+    def mget(self, keys: list) -> list:
+        with self._lock:
+            return [self.get(_key) for _key in keys]
+
+    def set(self, name: str, value, ex: Optional[int] = None, px: Optional[int] = None,
+            nx: Optional[bool] = False) -> bool:
+        with self._lock:
+            if nx and self._alive(name):
+                return False
+            self._db[name] = str(value)
+            self._expires.pop(name, None)
+            if ex:
+                self._expires[name] = time.time() + ex
+            elif px:
+                self._expires[name] = time.time() + px / 1000
+            return True
+
+    def delete(self, *names) -> int:
+        n = 0
+        with self._lock:
+            for _name in names:
+                if self._alive(_name):
+                    n += 1
+                self._db.pop(_name, None)
+                self._expires.pop(_name, None)
+        return n
+
+    def exists(self, *names) -> int:
+        with self._lock:
+            return sum(1 for _name in names if self._alive(_name))
+
+    def expire(self, name: str, time_to_live: int) -> bool:
+        with self._lock:
+            if not self._alive(name):
+                return False
+            self._expires[name] = time.time() + time_to_live
+            return True
+
+    def ttl(self, name: str) -> int:
+        with self._lock:
+            if not self._alive(name):
+                return -2
+            _exp = self._expires.get(name)
+            if _exp is None:
+                return -1
+            return int(_exp - time.time())
+
+    def scan_iter(self, match: Optional[str] = None, count: Optional[int] = None):
+        with self._lock:
+            _keys = [_key for _key in list(self._db.keys()) if self._alive(_key)]
+        for _key in _keys:
+            if match is None or fnmatchcase(_key, match):
+                yield _key
+
+    def keys(self, pattern: Optional[str] = "*") -> list:
+        return list(self.scan_iter(match=pattern))
+
+    def flushdb(self):
+        with self._lock:
+            self._db = {}
+            self._expires = {}
+
+    def pipeline(self, transaction: Optional[bool] = True) -> "Pipeline":
+        return Pipeline(self)
+
+    def ping(self) -> bool:
+        return True
+
+
+class Pipeline(object):
+    """Buffers commands and runs them, under one lock, when executed."""
+
+    def __init__(self, client: InMemoryRedis):
+        self.client = client
+        self._commands = []
+
+    def __getattr__(self, item):
+        _method = getattr(self.client, item)
+
+        def _buffer(*args, **kwargs):
+            self._commands.append((_method, args, kwargs))
+            return self
+
+        return _buffer
+
+    def __len__(self):
+        return len(self._commands)
+
+    def execute(self) -> list:
+        with self.client._lock:
+            _res = [_method(*args, **kwargs) for _method, args, kwargs in self._commands]
+        self._commands = []
+        return _res
+
+    def reset(self):
+        self._commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.reset()
@@ -0,0 +1,225 @@
+"""
+A key-value storage backend speaking the Redis protocol (Redis, Valkey, KeyDB ...).
+Pluggable wherever a persistence layer takes a storage::
+
+    storage:
+      class: satosa_openid4vci.storage.redis_db.RedisDB
+      kwargs:
+        url: redis://localhost:6379/0
+        prefix: "oci:"
+        key_conv: idpyoidc.util.Base64
+        value_conv: idpyoidc.util.JSON
+
+With ``url: memory://`` a process wide in-memory stand-in is used instead of a server.
+"""
+from contextlib import contextmanager
+import logging
+import threading
+from typing import Any
+from typing import Optional
+
+from cryptojwt.utils import importer
+from idpyoidc.util import JSON
+from idpyoidc.util import QPKey
+
+from satosa_openid4vci.storage import memory
+
+try:
+    import redis
+except ImportError:  # pragma: no cover
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+MEMORY_SCHEME = "memory://"
+
+
+class RedisDB(object):
+    """
+    Dictionary like storage on top of a Redis client. All processes using the same server and
+    prefix share the information.
+
+    Keys are stored as ``<prefix><information type>:<converted key>`` so that everything of
+    one information type can be found with a prefix scan.
+
+    :param url: Where the server is
+    :param prefix: Prefix for all keys, lets several storages share one database
+    :param key_conv: Converts keys to something that can be used in a Redis key
+    :param value_conv: Converts values to strings and back
+    :param max_connections: Size of the connection pool
+    :param socket_timeout: Seconds before a command times out
+    :param client: A ready made client, overrides url and the pool settings
+    """
+
+    def __init__(self,
+                 url: Optional[str] = "redis://localhost:6379/0",
+                 prefix: Optional[str] = "",
+                 key_conv: Optional[str] = "",
+                 value_conv: Optional[str] = "",
+                 max_connections: Optional[int] = 50,
+                 socket_timeout: Optional[float] = 5,
+                 client: Optional[Any] = None,
+                 **kwargs):
+        if client is None:
+            if url.startswith(MEMORY_SCHEME):
+                client = memory.get_instance(url[len(MEMORY_SCHEME):])
+            else:
+                if redis is None:  # pragma: no cover
+                    raise ImportError("The redis package is needed for RedisDB")
+                pool = redis.ConnectionPool.from_url(url, max_connections=max_connections,
+                                                     socket_timeout=socket_timeout,
+                                                     decode_responses=True)
+                client = redis.Redis(connection_pool=pool)
+        self.client = client
+        self.prefix = prefix
+
+        if key_conv:
+            self.key_conv = importer(key_conv)()
+        else:
+            self.key_conv = QPKey()
+
+        if value_conv:
+            self.value_conv = importer(value_conv)()
+        else:
+            self.value_conv = JSON()
+
+        self._local = threading.local()
+
+    # ---- keys ----
+
+    def _name(self, item: str, information_type: Optional[str] = "") -> str:
+        return f"{self.prefix}{information_type}:{self.key_conv.serialize(item)}"
+
+    def _item(self, name: str) -> str:
+        _, _, _key = name[len(self.prefix):].partition(":")
+        return self.key_conv.deserialize(_key)
+
+    # ---- batching ----
+
+    @property
+    def _pipeline(self):
+        return getattr(self._local, "pipeline", None)
+
+    def _writer(self):
+        return self._pipeline if self._pipeline is not None else self.client
+
+    @contextmanager
+    def batch(self):
+        """
+        Collects the writes done by this thread in a pipeline that is sent to the server in
+        one round trip when the block is left. Reads within the block do not see these writes.
+        """
+        if self._pipeline is not None:
+            yield
+            return
+
+        self._local.pipeline = self.client.pipeline(transaction=True)
+        try:
+            yield
+            self._local.pipeline.execute()
+        finally:
+            self._local.pipeline = None
+
+    # ---- the basic operations ----
+
+    def _set(self, name: str, value: Any, ttl: Optional[int] = None):
+        self._writer().set(name, self.value_conv.serialize(value), ex=ttl or None)
+
+    def _get(self, name: str) -> Any:
+        _val = self.client.get(name)
+        if _val is None:
+            raise KeyError(name)
+        return self.value_conv.deserialize(_val)
+
+    def _scan(self, information_type: Optional[str] = ""):
+        return self.client.scan_iter(match=f"{self.prefix}{information_type}:*", count=500)
+
+    # ---- information type interface ----
+
+    def store(self, information_type: str, value: Any, key: Optional[str] = "",
+              ttl: Optional[int] = None):
+        self._set(self._name(key, information_type), value, ttl)
+
+    def fetch(self, information_type: str, key: Optional[str] = ""):
+        try:
+            return self._get(self._name(key, information_type))
+        except KeyError:
+            return None
+
+    def fetch_many(self, information_type: str, keys: list) -> dict:
+        """Fetches several keys in one round trip."""
+        _vals = self.client.mget([self._name(_key, information_type) for _key in keys])
+        return {_key: self.value_conv.deserialize(_val) for _key, _val in zip(keys, _vals)
+                if _val is not None}
+
+    def delete(self, information_type: str, key: Optional[str] = ""):
+        self._writer().delete(self._name(key, information_type))
+
+    def keys_by_information_type(self, information_type: str) -> list:
+        return [self._item(_name) for _name in self._scan(information_type)]
+
+    # ---- dictionary interface ----
+
+    def __setitem__(self, item, value):
+        self._set(self._name(item), value)
+
+    def __getitem__(self, item):
+        return self._get(self._name(item))
+
+    def __delitem__(self, item):
+        self._writer().delete(self._name(item))
+
+    def __contains__(self, item):
+        return bool(self.client.exists(self._name(item)))
+
+    def get(self, item, default=None):
+        try:
+            return self[item]
+        except KeyError:
+            return default
+
+    def keys(self):
+        for _name in self._scan():
+            yield self._item(_name)
+
+    def items(self):
+        _names = list(self._scan())
+        for i in range(0, len(_names), 500):
+            _chunk = _names[i:i + 500]
+            for _name, _val in zip(_chunk, self.client.mget(_chunk)):
+                if _val is not None:
+                    yield self._item(_name), self.value_conv.deserialize(_val)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        """
+        Counted with a SCAN over all the keys of the dictionary interface, which takes time
+        in proportion to the number of keys in the database. Not for hot paths.
+        """
+        return sum(1 for _ in self._scan())
+
+    def update(self, ava: dict):
+        with self.batch():
+            for key, val in ava.items():
+                self[key] = val
+
+    def clear(self):
+        """
+        Removes what is stored through the dictionary interface. Information stored by
+        information type is left alone.
+        """
+        _names = list(self._scan())
+        for i in range(0, len(_names), 500):
+            self.client.delete(*_names[i:i + 500])
+
+    def purge_expired(self, limit: Optional[int] = 500) -> int:
+        """The server removes expired keys by itself."""
+        return 0
+
+    def dump(self):
+        return {k: v for k, v in self.items()}
+
+    def load(self, info: dict):
+        self.update(info)
@@ -0,0 +1,277 @@
+"""
+A storage backend keeping everything in one SQLite database in WAL mode.
+Several worker processes on the same host can share it::
+
+    storage:
+      class: satosa_openid4vci.storage.sqlite_db.SQLiteDB
+      kwargs:
+        db_file: op_storage.sqlite
+        key_conv: idpyoidc.util.Base64
+        value_conv: idpyoidc.util.JSON
+"""
+from contextlib import contextmanager
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+from typing import Optional
+
+from cryptojwt.utils import importer
+from idpyoidc.util import JSON
+from idpyoidc.util import QPKey
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS storage ("
+    " information_type TEXT NOT NULL,"
+    " key TEXT NOT NULL,"
+    " value TEXT NOT NULL,"
+    " expires_at REAL,"
+    " PRIMARY KEY (information_type, key)"
+    ") WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS storage_expires_at ON storage (expires_at)"
+    " WHERE expires_at IS NOT NULL",
+]
+
+# The same statement text is used every time so sqlite3's statement cache can reuse the
+# prepared statement.
+SQL_SET = ("INSERT INTO storage (information_type, key, value, expires_at) VALUES (?, ?, ?, ?)"
+           " ON CONFLICT (information_type, key) DO UPDATE SET value = excluded.value,"
+           " expires_at = excluded.expires_at")
+SQL_GET = ("SELECT value FROM storage WHERE information_type = ? AND key = ?"
+           " AND (expires_at IS NULL OR expires_at > ?)")
+SQL_DELETE = "DELETE FROM storage WHERE information_type = ? AND key = ?"
+SQL_KEYS = ("SELECT key FROM storage WHERE information_type = ?"
+            " AND (expires_at IS NULL OR expires_at > ?)")
+SQL_ITEMS = ("SELECT key, value FROM storage WHERE information_type = ?"
+             " AND (expires_at IS NULL OR expires_at > ?)")
+SQL_COUNT = ("SELECT count(*) FROM storage WHERE information_type = ?"
+             " AND (expires_at IS NULL OR expires_at > ?)")
+SQL_CLEAR = "DELETE FROM storage WHERE information_type = ?"
+SQL_PURGE = ("DELETE FROM storage WHERE (information_type, key) IN"
+             " (SELECT information_type, key FROM storage WHERE expires_at <= ? LIMIT ?)")
+
+
+class SQLiteDB(object):
+    """
+    Dictionary like storage in an SQLite database. Every thread gets its own connection.
+
+    Values are stored per (information type, converted key), the primary key makes lookups
+    of single keys as well as of all keys of one information type index scans.
+
+    :param db_file: The database file
+    :param key_conv: Converts keys to strings and back
+    :param value_conv: Converts values to strings and back
+    :param timeout: Seconds to wait for a lock held by another process
+    :param synchronous: The SQLite synchronous setting, NORMAL is safe in WAL mode
+    """
+
+    def __init__(self,
+                 db_file: Optional[str] = "storage.sqlite",
+                 key_conv: Optional[str] = "",
+                 value_conv: Optional[str] = "",
+                 timeout: Optional[float] = 10,
+                 synchronous: Optional[str] = "NORMAL",
+                 **kwargs):
+        self.db_file = db_file
+        self.timeout = timeout
+        self.synchronous = synchronous
+
+        if key_conv:
+            self.key_conv = importer(key_conv)()
+        else:
+            self.key_conv = QPKey()
+
+        if value_conv:
+            self.value_conv = importer(value_conv)()
+        else:
+            self.value_conv = JSON()
+
+        _dir = os.path.dirname(db_file)
+        if _dir and not os.path.isdir(_dir):
+            os.makedirs(_dir, exist_ok=True)
+
+        self._local = threading.local()
+        # The schema is made with a connection of its own, so that no connection is open when
+        # the storage is created before the worker processes are forked
+        _con = self._connect()
+        try:
+            _con.execute("BEGIN IMMEDIATE")
+            for _statement in SCHEMA:
+                _con.execute(_statement)
+            _con.execute("COMMIT")
+        finally:
+            _con.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None -> transactions are handled explicitly by batch()
+        _con = sqlite3.connect(self.db_file, timeout=self.timeout, isolation_level=None,
+                               cached_statements=64)
+        _con.execute("PRAGMA journal_mode=WAL")
+        _con.execute(f"PRAGMA synchronous={self.synchronous}")
+        return _con
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        _con = getattr(self._local, "connection", None)
+        # A connection must not be used in a process forked after it was opened
+        if _con is None or self._local.pid != os.getpid():
+            _con = self._connect()
+            self._local.connection = _con
+            self._local.pid = os.getpid()
+            self._local.depth = 0
+        return _con
+
+    @contextmanager
+    def batch(self):
+        """
+        Runs everything done by this thread within the block in one transaction.
+        """
+        _con = self.connection
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield
+            finally:
+                self._local.depth -= 1
+            return
+
+        self._local.depth = 1
+        _con.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except Exception:
+            _con.execute("ROLLBACK")
+            raise
+        else:
+            _con.execute("COMMIT")
+        finally:
+            self._local.depth = 0
+
+    def close(self):
+        _con = getattr(self._local, "connection", None)
+        if _con is not None:
+            _con.close()
+            self._local.connection = None
+
+    # ---- the basic operations ----
+
+    def _set(self, information_type: str, item: str, value: Any, ttl: Optional[int] = None):
+        _expires_at = time.time() + ttl if ttl else None
+        self.connection.execute(SQL_SET, (information_type, self.key_conv.serialize(item),
+                                          self.value_conv.serialize(value), _expires_at))
+
+    def _get(self, information_type: str, item: str) -> Any:
+        _row = self.connection.execute(
+            SQL_GET, (information_type, self.key_conv.serialize(item), time.time())).fetchone()
+        if _row is None:
+            raise KeyError(item)
+        return self.value_conv.deserialize(_row[0])
+
+    def _delete(self, information_type: str, item: str) -> int:
+        _cur = self.connection.execute(SQL_DELETE,
+                                       (information_type, self.key_conv.serialize(item)))
+        return _cur.rowcount
+
+    # ---- information type interface ----
+
+    def store(self, information_type: str, value: Any, key: Optional[str] = "",
+              ttl: Optional[int] = None):
+        self._set(information_type, key, value, ttl)
+
+    def fetch(self, information_type: str, key: Optional[str] = ""):
+        try:
+            return self._get(information_type, key)
+        except KeyError:
+            return None
+
+    def delete(self, information_type: str, key: Optional[str] = ""):
+        self._delete(information_type, key)
+
+    def keys_by_information_type(self, information_type: str) -> list:
+        _rows = self.connection.execute(SQL_KEYS, (information_type, time.time()))
+        return [self.key_conv.deserialize(_row[0]) for _row in _rows]
+
+    # ---- dictionary interface ----
+
+    def __setitem__(self, item, value):
+        self._set("", item, value)
+
+    def __getitem__(self, item):
+        return self._get("", item)
+
+    def __delitem__(self, item):
+        if not self._delete("", item):
+            raise KeyError(item)
+
+    def __contains__(self, item):
+        try:
+            self._get("", item)
+        except KeyError:
+            return False
+        return True
+
+    def get(self, item, default=None):
+        try:
+            return self[item]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return iter(self.keys_by_information_type(""))
+
+    def items(self):
+        for _key, _val in self.connection.execute(SQL_ITEMS, ("", time.time())).fetchall():
+            yield self.key_conv.deserialize(_key), self.value_conv.deserialize(_val)
+
+    def __iter__(self):
+        return self.keys()
+
+    def __len__(self):
+        return self.connection.execute(SQL_COUNT, ("", time.time())).fetchone()[0]
+
+    def update(self, ava: dict):
+        with self.batch():
+            for key, val in ava.items():
+                self[key] = val
+
+    def clear(self):
+        """
+        Removes what is stored through the dictionary interface. Information stored by
+        information type is left alone.
+        """
+        self.connection.execute(SQL_CLEAR, ("",))
+
+    def purge_expired(self, limit: Optional[int] = 500) -> int:
+        """Removes at most limit expired records."""
+        return self.connection.execute(SQL_PURGE, (time.time(), limit)).rowcount
+
+    def dump(self):
+        return {k: v for k, v in self.items()}
+
+    def load(self, info: dict):
+        self.update(info)
+
+    def load_directory(self, fdir: str, key_conv: Optional[str] = "",
+                       value_conv: Optional[str] = ""):
+        """
+        Imports what a one-file-per-key storage (like FilesystemDB) has in a directory.
+        The converters are the ones that storage used.
+        """
+        _key_conv = importer(key_conv)() if key_conv else self.key_conv
+        _value_conv = importer(value_conv)() if value_conv else self.value_conv
+        n = 0
+        with self.batch():
+            for _fname in os.listdir(fdir):
+                _path = os.path.join(fdir, _fname)
+                if _fname.endswith(".lock") or not os.path.isfile(_path):
+                    continue
+                with open(_path, "r") as fp:
+                    _value = _value_conv.deserialize(fp.read().strip())
+                self[_key_conv.deserialize(_fname)] = _value
+                n += 1
+        logger.info("Imported %d items from %s", n, fdir)
+        return n
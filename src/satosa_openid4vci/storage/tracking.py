@@ -0,0 +1,251 @@
+"""
+A storage wrapper that keeps track of what has changed and only writes that.
+
+Configured in place of the storage a persistence layer uses::
+
+    persistence:
+      class: satosa_idpyop.persistence.openid_provider.OPPersistence
+      kwargs:
+        storage:
+          class: satosa_openid4vci.storage.tracking.ChangeTrackingStorage
+          kwargs:
+            storage:
+              class: satosa_idpyop.core.storage.file.FilesystemDBNoCache
+              kwargs:
+                fdir: op_storage
+                key_conv: idpyoidc.util.Base64
+                value_conv: idpyoidc.util.JSON
+"""
+from collections import Counter
+from collections import OrderedDict
+from contextlib import nullcontext
+import copy
+import hashlib
+import inspect
+import json
+import logging
+import threading
+from typing import Any
+from typing import Callable
+from typing import Optional
+
+from idpyoidc.server.util import execute
+
+from satosa_openid4vci.storage.expiry import ExpiryPolicy
+
+logger = logging.getLogger(__name__)
+
+
+def value_digest(value: Any) -> Optional[bytes]:
+    """
+    Digest of a value as it would be serialized. None if the value can not be serialized
+    in which case it will always be regarded as changed.
+    """
+    try:
+        _txt = json.dumps(value, sort_keys=True, default=str)
+    except (TypeError, ValueError):
+        return None
+    return hashlib.blake2b(_txt.encode("utf-8"), digest_size=16).digest()
+
+
+class ChangeTrackingStorage(object):
+    """
+    Wraps a storage instance. Writes are deferred between :py:meth:`begin` and
+    :py:meth:`commit`, in which case only the last value written for each key is written and
+    reads see the pending values. Deferral is per thread.
+
+    Within such a unit of work a digest of every value read is remembered and a write of the
+    value that was read is skipped. Nothing is remembered between units of work: the storage
+    may be shared with other processes which may have changed the value since. Outside a unit
+    of work every write is done.
+
+    If the wrapped storage can store a time to live with a record, records of information
+    types given in ttl get one, see :py:mod:`satosa_openid4vci.storage.expiry`.
+
+    :param storage: A storage instance or a configuration of one
+    :param max_tracked: The maximum number of digests to remember in a unit of work
+    :param ttl: Information type pattern to time to live (seconds)
+    """
+
+    def __init__(self, storage: Any, max_tracked: Optional[int] = 10000,
+                 ttl: Optional[dict] = None, **kwargs):
+        if isinstance(storage, dict) and "class" in storage:
+            storage = execute(storage)
+        self.storage = storage
+        self.max_tracked = max_tracked
+        self.expiry = ExpiryPolicy(ttl)
+        try:
+            self._native_ttl = "ttl" in inspect.signature(storage.store).parameters
+        except (AttributeError, TypeError, ValueError):
+            self._native_ttl = False
+        self.stats = Counter()
+        self._local = threading.local()
+
+    def __getattr__(self, item):
+        # Everything not handled here is handled by the wrapped storage
+        if item == "storage":
+            raise AttributeError(item)
+        return getattr(self.storage, item)
+
+    # ---- tracking ----
+
+    @property
+    def touched(self) -> set:
+        """The keys written to or deleted during this thread's current unit of work."""
+        _pending = self._pending
+        return set(_pending.keys()) if _pending else set()
+
+    @property
+    def _pending(self) -> Optional[OrderedDict]:
+        return getattr(self._local, "pending", None)
+
+    @property
+    def _seen(self) -> Optional[OrderedDict]:
+        """What was read during this thread's current unit of work."""
+        return getattr(self._local, "seen", None)
+
+    def _remember(self, key: tuple, digest: Optional[bytes]):
+        _seen = self._seen
+        if _seen is None:
+            return
+        if digest is None:
+            _seen.pop(key, None)
+            return
+        _seen[key] = digest
+        _seen.move_to_end(key)
+        while len(_seen) > self.max_tracked:
+            _seen.popitem(last=False)
+
+    def _write(self, key: tuple, value: Any, writer: Callable):
+        digest = value_digest(value)
+        _pending = self._pending
+        _seen = self._seen
+        if digest is not None and _seen is not None and _seen.get(key) == digest:
+            if _pending:
+                # Changed back to what is in the storage
+                _pending.pop(key, None)
+            self.stats["skipped"] += 1
+            return
+
+        if _pending is not None:
+            # A copy, what is written is what the digest was taken of even if the caller goes
+            # on changing the value
+            _pending[key] = ("store", copy.deepcopy(value), writer, digest)
+            _pending.move_to_end(key)
+        else:
+            writer(value)
+            self.stats["written"] += 1
+
+    def _delete(self, key: tuple, deleter: Callable):
+        _pending = self._pending
+        if _pending is not None:
+            _pending[key] = ("delete", None, deleter, None)
+            _pending.move_to_end(key)
+        else:
+            deleter()
+            self.stats["deleted"] += 1
+
+    def _read(self, key: tuple, reader: Callable):
+        _pending = self._pending
+        if _pending and key in _pending:
+            _op, _value, _, _ = _pending[key]
+            if _op == "delete":
+                raise KeyError(key)
+            # like a read from the storage, what the caller gets is its own
+            return copy.deepcopy(_value)
+
+        value = reader()
+        self.stats["read"] += 1
+        self._remember(key, value_digest(value))
+        return value
+
+    # ---- unit of work ----
+
+    def begin(self):
+        """Start deferring writes made by this thread."""
+        if self._pending is None:
+            self._local.pending = OrderedDict()
+            self._local.seen = OrderedDict()
+
+    def commit(self) -> set:
+        """
+        Write what has changed since :py:meth:`begin`.
+
+        :return: The keys that were written or deleted
+        """
+        _pending = self._pending
+        self._local.pending = None
+        self._local.seen = None
+        if not _pending:
+            return set()
+
+        # Storages that can batch writes (a pipeline, a transaction) get them all at once
+        _batch = getattr(self.storage, "batch", None)
+        with _batch() if _batch else nullcontext():
+            for key, (_op, _value, _func, digest) in _pending.items():
+                if _op == "delete":
+                    _func()
+                    self.stats["deleted"] += 1
+                else:
+                    _func(_value)
+                    self.stats["written"] += 1
+        logger.debug("Committed %d change(s)", len(_pending))
+        return set(_pending.keys())
+
+    def rollback(self):
+        """Forget writes deferred since :py:meth:`begin`."""
+        self._local.pending = None
+        self._local.seen = None
+
+    # ---- information type interface ----
+
+    def store(self, information_type: str, value: Any, key: Optional[str] = ""):
+        _kwargs = {}
+        if self._native_ttl and self.expiry:
+            _ttl = self.expiry.ttl_for(information_type)
+            if _ttl:
+                _kwargs["ttl"] = _ttl
+        self._write((information_type, key), value,
+                    lambda _value: self.storage.store(information_type=information_type,
+                                                      value=_value, key=key, **_kwargs))
+
+    def fetch(self, information_type: str, key: Optional[str] = ""):
+        return self._read((information_type, key),
+                          lambda: self.storage.fetch(information_type=information_type, key=key))
+
+    def delete(self, information_type: str, key: Optional[str] = ""):
+        self._delete((information_type, key),
+                     lambda: self.storage.delete(information_type=information_type, key=key))
+
+    # ---- dictionary interface ----
+
+    def __setitem__(self, item, value):
+        self._write((None, item), value, lambda _value: self.storage.__setitem__(item, _value))
+
+    def __getitem__(self, item):
+        return self._read((None, item), lambda: self.storage[item])
+
+    def __delitem__(self, item):
+        self._delete((None, item), lambda: self.storage.__delitem__(item))
+
+    def __contains__(self, item):
+        _pending = self._pending
+        if _pending and (None, item) in _pending:
+            return _pending[(None, item)][0] == "store"
+        return item in self.storage
+
+    def __len__(self):
+        return len(self.storage)
+
+    def __iter__(self):
+        return iter(self.storage)
+
+    def get(self, item, default=None):
+        try:
+            return self[item]
+        except KeyError:
+            return default
+
+    def update(self, ava: dict):
+        for key, val in ava.items():
+            self[key] = val
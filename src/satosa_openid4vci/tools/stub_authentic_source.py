@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+A stand-in for an authentic source, for tests and load tests. It is an ASGI application that
+answers every POST with a credential made from the request body.
+
+Used in-process with httpx.ASGITransport or served with an ASGI server::
+
+    stub_authentic_source.py [port] [delay]
+"""
+import asyncio
+import base64
+import json
+import sys
+from typing import Optional
+
+
+class StubAuthenticSource(object):
+    """
+    :param delay: Seconds to wait before answering, simulates the authentic source's latency
+    """
+
+    def __init__(self, delay: Optional[float] = 0):
+        self.delay = delay
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @staticmethod
+    def make_credential(body: dict) -> str:
+        _payload = base64.urlsafe_b64encode(json.dumps(body, sort_keys=True).encode())
+        return f"eyJhbGciOiJub25lIn0.{_payload.decode().rstrip('=')}.~"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+
+        _body = b""
+        while True:
+            _message = await receive()
+            _body += _message.get("body", b"")
+            if not _message.get("more_body"):
+                break
+
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            _request = json.loads(_body) if _body else {}
+            self.requests.append(_request)
+            _resp = json.dumps({"credential": self.make_credential(_request)}).encode()
+        finally:
+            self.in_flight -= 1
+
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": _resp})
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    _port = int(sys.argv[1]) if len(sys.argv) > 1 else 8088
+    _delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0
+    uvicorn.run(StubAuthenticSource(_delay), port=_port)
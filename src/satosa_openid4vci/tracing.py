@@ -0,0 +1,349 @@
+"""
+Optional tracing of the issuance flow.
+
+The spans follow the OpenTelemetry model (128 bit trace id, 64 bit span id, parent span id,
+start and end time in nanoseconds, attributes and a status) so exported spans can be fed to
+any OpenTelemetry compatible backend. Tracing is off unless a ``tracing`` block is present in
+the frontend configuration::
+
+    tracing:
+      exporter:
+        class: satosa_openid4vci.tracing.LoggingSpanExporter
+
+One issuance is handled in several HTTP requests, PAR, authorization, the backend round trip,
+token and credential. The spans of one request are kept together and exported when the
+request is done. Before that the request can be correlated with earlier requests through a
+key they have in common (request_uri, authorization code, access token), all requests
+correlated that way end up in the same trace.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any
+from typing import Callable
+from typing import Optional
+
+from cryptojwt.utils import importer
+
+logger = logging.getLogger(__name__)
+
+STATUS_UNSET = "UNSET"
+STATUS_OK = "OK"
+STATUS_ERROR = "ERROR"
+
+
+def _new_id(n_bytes: int) -> str:
+    return os.urandom(n_bytes).hex()
+
+
+def _digest(key: str) -> str:
+    # Correlation keys can be secrets (codes, tokens), only digests are kept
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class Span(object):
+    """
+    :param name: What is being done
+    :param trace_id: The trace the span belongs to, 32 hex characters
+    :param parent_id: Span id of the parent span
+    :param attributes: Initial attributes
+    """
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_time", "end_time",
+                 "attributes", "status", "status_description")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None,
+                 attributes: Optional[dict] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.start_time = time.time_ns()
+        self.end_time = None
+        self.attributes = dict(attributes or {})
+        self.status = STATUS_UNSET
+        self.status_description = ""
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_status(self, status: str, description: Optional[str] = ""):
+        self.status = status
+        self.status_description = description
+
+    def end(self):
+        if self.end_time is None:
+            self.end_time = time.time_ns()
+
+    @property
+    def duration(self) -> float:
+        """Seconds, 0 for a span that has not ended."""
+        if self.end_time is None:
+            return 0
+        return (self.end_time - self.start_time) / 1e9
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "start_time_unix_nano": self.start_time,
+            "end_time_unix_nano": self.end_time,
+            "attributes": self.attributes,
+            "status": {"code": self.status, "message": self.status_description},
+        }
+
+
+class _NoopSpan(object):
+    """What is handed out when tracing is off."""
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_status(self, status: str, description: Optional[str] = ""):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class InMemorySpanExporter(object):
+    """Keeps the exported spans, for tests."""
+
+    def __init__(self, **kwargs):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def export(self, spans: list):
+        with self._lock:
+            self.spans.extend(spans)
+
+    def get_finished_spans(self) -> list:
+        with self._lock:
+            return list(self.spans)
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+
+
+class LoggingSpanExporter(object):
+    """Writes each span as one JSON document to the log."""
+
+    def __init__(self, level: Optional[str] = "info", **kwargs):
+        self.level = logging.getLevelName(level.upper())
+
+    def export(self, spans: list):
+        if not logger.isEnabledFor(self.level):
+            return
+        for _span in spans:
+            logger.log(self.level, json.dumps(_span.to_dict()))
+
+
+class _Trace(object):
+    """The spans of one request."""
+
+    __slots__ = ("trace_id", "stack", "finished")
+
+    def __init__(self):
+        self.trace_id = _new_id(16)
+        self.stack = []
+        self.finished = []
+
+
+class Tracer(object):
+    """
+    :param exporter: Gets the spans of a request when the request is done
+    :param max_correlations: How many correlation keys to remember
+    """
+
+    def __init__(self, exporter: Optional[Any] = None, max_correlations: Optional[int] = 10000):
+        self.exporter = exporter or InMemorySpanExporter()
+        self.max_correlations = max_correlations
+        self._correlations = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _trace(self) -> Optional[_Trace]:
+        return getattr(self._local, "trace", None)
+
+    def current_span(self):
+        _trace = self._trace()
+        if _trace and _trace.stack:
+            return _trace.stack[-1]
+        return NOOP_SPAN
+
+    @contextmanager
+    def start_as_current_span(self, name: str, attributes: Optional[dict] = None):
+        _trace = self._trace()
+        _root = _trace is None
+        if _root:
+            _trace = self._local.trace = _Trace()
+
+        _parent = _trace.stack[-1].span_id if _trace.stack else None
+        _span = Span(name, _trace.trace_id, _parent, attributes)
+        _trace.stack.append(_span)
+        try:
+            yield _span
+        except Exception as err:
+            _span.set_status(STATUS_ERROR, f"{err.__class__.__name__}: {err}")
+            raise
+        else:
+            if _span.status == STATUS_UNSET:
+                _span.set_status(STATUS_OK)
+        finally:
+            _span.end()
+            _trace.stack.pop()
+            _trace.finished.append(_span)
+            if _root:
+                self._local.trace = None
+                self._export(_trace)
+
+    def _export(self, trace: _Trace):
+        for _span in trace.finished:
+            _span.trace_id = trace.trace_id
+        try:
+            self.exporter.export(trace.finished)
+        except Exception as err:  # pragma: no cover
+            logger.warning("Exporting spans failed: %s", err)
+
+    def _remember(self, digest: str, trace_id: str):
+        self._correlations[digest] = trace_id
+        self._correlations.move_to_end(digest)
+        while len(self._correlations) > self.max_correlations:
+            self._correlations.popitem(last=False)
+
+    def correlate(self, key: str):
+        """
+        Joins the current request to the trace of earlier requests that were correlated with
+        the same key, or makes the key refer to the current trace.
+        """
+        _trace = self._trace()
+        if _trace is None or not key:
+            return
+        _key = _digest(key)
+        with self._lock:
+            _trace_id = self._correlations.get(_key)
+            if _trace_id:
+                _trace.trace_id = _trace_id
+            self._remember(_key, _trace.trace_id)
+
+
+_tracer = None
+
+
+def configure(conf: Optional[dict] = None) -> Optional[Tracer]:
+    """
+    Turns tracing on, or off if conf is None.
+    """
+    global _tracer
+    if conf is None:
+        _tracer = None
+        return None
+
+    _exporter_conf = conf.get("exporter")
+    if _exporter_conf:
+        _exporter = importer(_exporter_conf["class"])(**_exporter_conf.get("kwargs", {}))
+    else:
+        _exporter = LoggingSpanExporter()
+    _tracer = Tracer(_exporter, conf.get("max_correlations", 10000))
+    return _tracer
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+@contextmanager
+def _noop():
+    yield NOOP_SPAN
+
+
+def span(name: str, **attributes):
+    """
+    A span as a context manager, a no-op when tracing is off.
+    """
+    if _tracer is None:
+        return _noop()
+    return _tracer.start_as_current_span(name, attributes)
+
+
+def correlate(key: str):
+    if _tracer is not None:
+        _tracer.correlate(key)
+
+
+def current_span():
+    if _tracer is None:
+        return NOOP_SPAN
+    return _tracer.current_span()
+
+
+def correlate_response(response: Any, claim: str):
+    """
+    Correlates with the value of a claim in a JSON response body.
+    """
+    if _tracer is None:
+        return
+    _message = getattr(response, "message", None)
+    try:
+        _value = json.loads(_message).get(claim) if _message else None
+    except (TypeError, ValueError, AttributeError):
+        return
+    if isinstance(_value, str):
+        _tracer.correlate(_value)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """
+    Decorator running a function or method within a span named after it.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        _name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _tracer.start_as_current_span(_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TracedConstructor(object):
+    """
+    Wraps a credential constructor so that each call is a span.
+
+    :param constructor: The credential constructor
+    :param name: The credential type it constructs
+    """
+
+    def __init__(self, constructor: Any, name: str):
+        self.constructor = constructor
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        with span("credential_constructor", credential_type=self.name):
+            return self.constructor(*args, **kwargs)
+
+    def __getattr__(self, item):
+        return getattr(self.constructor, item)
+
+    def __setattr__(self, key, value):
+        # Configuring the wrapper, e.g. its signing algorithm or HTTP client, configures the
+        # constructor
+        if key in ("constructor", "name"):
+            object.__setattr__(self, key, value)
+        else:
+            setattr(self.constructor, key, value)
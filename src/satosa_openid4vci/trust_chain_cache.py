@@ -0,0 +1,196 @@
+"""
+Cache of verified trust chains.
+
+Finding out whether a wallet provider, or any other entity, belongs to the federation means
+collecting its trust chains, entity configurations and subordinate statements from the
+federation, and verifying the signatures on all of them. The federation entity keeps the
+chains it has verified in process memory, unbounded and only for the process that did the
+work. This cache keeps them, keyed by entity id, the arguments the chains were asked for with
+and trust anchor, in a storage that all workers can share, for at most ``ttl`` seconds and
+never beyond the expiry of the chain::
+
+    trust_chain_cache:
+      ttl: 3600
+      storage:
+        class: satosa_openid4vci.storage.redis_db.RedisDB
+        kwargs:
+          url: redis://localhost:6379/0
+          prefix: "trust_chain:"
+
+The storage must be shared by all workers. Without a storage configuration the federation
+entity's persistence storage is used.
+
+A chain is cached as it dumps itself, together with its class, and read from the cache by
+loading the dump into a new instance of that class. So what comes out of the cache is a trust
+chain of the same kind, with the same attributes, as the federation entity produced.
+"""
+import hashlib
+import inspect
+import json
+import logging
+import time
+from typing import Any
+from typing import Callable
+from typing import Optional
+
+from cryptojwt.utils import importer
+from idpyoidc.server.util import execute
+
+from satosa_openid4vci.storage.tracking import ChangeTrackingStorage
+
+logger = logging.getLogger(__name__)
+
+INFORMATION_TYPE = "trust_chain"
+INDEX_TYPE = "trust_chain_anchors"
+
+def _key(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+def variant(args: tuple, kwargs: dict) -> str:
+    """
+    Tells apart chains asked for with different arguments, like a trust anchor or entity
+    types, besides the entity id.
+    """
+    if not args and not kwargs:
+        return ""
+    return json.dumps([list(args), kwargs], sort_keys=True, default=str)
+
+
+def serialize_chain(chain: Any) -> Optional[dict]:
+    """
+    :return: The chain's class and dump, None if the chain can not dump itself
+    """
+    if not callable(getattr(chain, "dump", None)):
+        return None
+    return {"class": f"{type(chain).__module__}.{type(chain).__qualname__}",
+            "dump": chain.dump()}
+
+
+def deserialize_chain(info: dict) -> Any:
+    _chain = importer(info["class"])()
+    _chain.load(info["dump"])
+    return _chain
+
+
+class TrustChainCache(object):
+    """
+    :param storage: A storage instance or a configuration of one, shared by all workers
+    :param ttl: Max seconds a verified chain is kept
+    """
+
+    def __init__(self, storage: Any, ttl: Optional[int] = 3600, **kwargs):
+        if storage is None:
+            raise ValueError("The trust chain cache needs a storage shared by all workers")
+        if isinstance(storage, dict) and "class" in storage:
+            storage = execute(storage)
+        if isinstance(storage, ChangeTrackingStorage):
+            # Verified chains are kept whatever becomes of the request's unit of work
+            storage = storage.storage
+        self.storage = storage
+        self.ttl = ttl
+        try:
+            self._native_ttl = "ttl" in inspect.signature(storage.store).parameters
+        except (TypeError, ValueError):  # pragma: no cover
+            self._native_ttl = False
+
+    def _store(self, information_type: str, key: str, value: Any, ttl: int):
+        _kwargs = {"ttl": ttl} if self._native_ttl else {}
+        self.storage.store(information_type=information_type, value=value, key=key, **_kwargs)
+
+    def get(self, entity_id: str, trust_anchor: Optional[str] = None,
+            variant: Optional[str] = "") -> list:
+        """
+        :param variant: See :py:func:`variant`
+        :return: The cached chains of entity_id, those ending in trust_anchor if it is given
+        """
+        if trust_anchor:
+            _anchors = [trust_anchor]
+        else:
+            _anchors = self.storage.fetch(information_type=INDEX_TYPE,
+                                          key=_key(entity_id, variant)) or []
+
+        _now = time.time()
+        chains = []
+        for _anchor in _anchors:
+            _chain_key = _key(entity_id, variant, _anchor)
+            _info = self.storage.fetch(information_type=INFORMATION_TYPE, key=_chain_key)
+            if not _info:
+                continue
+            if _info["expires"] > _now and "class" in _info["chain"]:
+                chains.append(deserialize_chain(_info["chain"]))
+            elif not self._native_ttl:
+                self.storage.delete(information_type=INFORMATION_TYPE, key=_chain_key)
+        return chains
+
+    def put(self, entity_id: str, chains: list, variant: Optional[str] = ""):
+        """
+        Stores verified chains of entity_id.
+        """
+        _now = time.time()
+        _anchors = []
+        _max_ttl = 0
+        for _chain in chains:
+            _info = serialize_chain(_chain)
+            _anchor = getattr(_chain, "anchor", None)
+            if _info is None or not _anchor:
+                logger.debug("Trust chain of %s can not be cached", entity_id)
+                continue
+            _expires = _now + self.ttl
+            if getattr(_chain, "exp", None):
+                _expires = min(_expires, _chain.exp)
+            _ttl = int(_expires - _now)
+            if _ttl <= 0:
+                continue
+            self._store(INFORMATION_TYPE, _key(entity_id, variant, _anchor),
+                        {"chain": _info, "expires": _expires}, _ttl)
+            _anchors.append(_anchor)
+            _max_ttl = max(_max_ttl, _ttl)
+
+        if _anchors:
+            self._store(INDEX_TYPE, _key(entity_id, variant), _anchors, _max_ttl)
+
+    def delete(self, entity_id: str, variant: Optional[str] = ""):
+        _index_key = _key(entity_id, variant)
+        _anchors = self.storage.fetch(information_type=INDEX_TYPE, key=_index_key) or []
+        for _anchor in _anchors:
+            self.storage.delete(information_type=INFORMATION_TYPE,
+                                key=_key(entity_id, variant, _anchor))
+        self.storage.delete(information_type=INDEX_TYPE, key=_index_key)
+
+    def resolve(self, entity_id: str, collect: Callable, variant: Optional[str] = "") -> list:
+        """
+        The verified chains of entity_id, from the cache or, if there are none there,
+        collected and verified by collect.
+        """
+        chains = self.get(entity_id, variant=variant)
+        if chains:
+            logger.debug("Trust chains of %s from the cache", entity_id)
+            return chains
+
+        chains = collect(entity_id) or []
+        if chains:
+            self.put(entity_id, chains, variant)
+        return chains
+
+    def install(self, federation_entity: Any):
+        """
+        Puts the cache in front of the federation entity's trust chain collection.
+        """
+        _collect_chains = getattr(federation_entity, "get_verified_trust_chains", None)
+        if _collect_chains is None:  # pragma: no cover
+            logger.warning("The federation entity does not collect trust chains")
+            return
+
+        def _collect(entity_id: str, *args, **kwargs):
+            # The federation entity's own unbounded memory must not outlive our ttl
+            _memory = getattr(federation_entity, "trust_chain", None)
+            if isinstance(_memory, dict):
+                _memory.pop(entity_id, None)
+            return _collect_chains(entity_id, *args, **kwargs)
+
+        def get_verified_trust_chains(entity_id: str, *args, **kwargs):
+            return self.resolve(entity_id, lambda eid: _collect(eid, *args, **kwargs),
+                                variant(args, kwargs))
+
+        federation_entity.get_verified_trust_chains = get_verified_trust_chains
@@ -0,0 +1,176 @@
+"""
+Request scoped access to the persistence layers of the guises.
+
+Within a unit of work every persisted object is restored at most once, store operations and
+session manager flushes are collected and all of it is written in one go when the unit of work
+ends.
+"""
+from contextlib import contextmanager
+import functools
+import json
+import logging
+import threading
+from typing import Any
+from typing import Callable
+from typing import Optional
+
+from satosa_openid4vci.metrics import timed
+from satosa_openid4vci.storage.tracking import ChangeTrackingStorage
+from satosa_openid4vci.tracing import span
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def _args_key(args: tuple):
+    """A hashable key for the arguments of a call."""
+    try:
+        hash(args)
+    except TypeError:
+        return json.dumps(args, sort_keys=True, default=str)
+    return args
+
+
+def current_unit_of_work() -> Optional["UnitOfWork"]:
+    return getattr(_local, "unit_of_work", None)
+
+
+class UnitOfWork(object):
+    """
+    :param server: The combo of guises, the application's server
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self._loaded = {}
+        self._stores = []
+        self._flush = []
+
+    @staticmethod
+    def _persistence(entity):
+        return getattr(entity, "persistence", None)
+
+    def _storages(self):
+        for _guise, _entity in self.server.items():
+            _storage = getattr(self._persistence(_entity), "storage", None)
+            if isinstance(_storage, ChangeTrackingStorage):
+                yield _storage
+
+    def _load(self, key: tuple, func: Callable, *args):
+        if key not in self._loaded:
+            with span(f"persistence.{func.__name__}"), timed(func.__name__):
+                self._loaded[key] = func(*args)
+        return self._loaded[key]
+
+    # ---- loading ----
+
+    def restore_state(self, entity, *args):
+        _persistence = self._persistence(entity)
+        return self._load(("state", id(entity), _args_key(args)), _persistence.restore_state,
+                          *args)
+
+    def restore_pushed_authorization(self, entity, request_uri: str):
+        _persistence = self._persistence(entity)
+        return self._load(("par", id(entity), request_uri),
+                          _persistence.restore_pushed_authorization, request_uri)
+
+    def restore_client_info(self, entity, client_id: str):
+        _persistence = self._persistence(entity)
+        return self._load(("client", id(entity), client_id),
+                          _persistence.restore_client_info, client_id)
+
+    def load_claims(self, entity, client_id: str):
+        _persistence = self._persistence(entity)
+        return self._load(("claims", id(entity), client_id),
+                          _persistence.load_claims, client_id)
+
+    # ---- storing ----
+
+    def _store(self, entity, method: str, *args, **kwargs):
+        _call = (entity, method, args, kwargs)
+        for _stored in self._stores:
+            if _stored[0] is entity and _stored[1:] == _call[1:]:
+                return
+        self._stores.append(_call)
+
+    def store_state(self, entity, *args, **kwargs):
+        self._store(entity, "store_state", *args, **kwargs)
+
+    def store_client_info(self, entity, client_id: str):
+        self._store(entity, "store_client_info", client_id)
+
+    def store_pushed_authorization(self, entity, *args):
+        self._store(entity, "store_pushed_authorization", *args)
+
+    def store_claims(self, entity, claims: dict, client_subject_id: str):
+        self._store(entity, "store_claims", claims, client_subject_id)
+
+    def flush_session_manager(self, entity):
+        if not any(_entity is entity for _entity in self._flush):
+            self._flush.append(entity)
+
+    # ---- the unit of work ----
+
+    def begin(self):
+        for _storage in self._storages():
+            _storage.begin()
+
+    def commit(self):
+        for _entity, _method, _args, _kwargs in self._stores:
+            with span(f"persistence.{_method}"), timed(_method):
+                getattr(self._persistence(_entity), _method)(*_args, **_kwargs)
+        for _storage in self._storages():
+            with span("storage.commit"), timed("commit"):
+                _storage.commit()
+        self._flush_session_managers()
+        logger.debug("Unit of work committed %d store operation(s)", len(self._stores))
+
+    def rollback(self):
+        # Nothing from a failed request is written, session managers included
+        for _storage in self._storages():
+            _storage.rollback()
+        self._flush = []
+
+    def _flush_session_managers(self):
+        for _entity in self._flush:
+            with span("persistence.flush_session_manager"), timed("flush_session_manager"):
+                self._persistence(_entity).flush_session_manager()
+        self._flush = []
+
+
+@contextmanager
+def unit_of_work(server):
+    """
+    Starts a unit of work unless one is already active in which case that one is used.
+    """
+    _uow = current_unit_of_work()
+    if _uow is not None:
+        yield _uow
+        return
+
+    _uow = UnitOfWork(server)
+    _local.unit_of_work = _uow
+    _uow.begin()
+    try:
+        yield _uow
+    except Exception:
+        _uow.rollback()
+        raise
+    else:
+        _uow.commit()
+    finally:
+        _local.unit_of_work = None
+
+
+def request_scoped(func: Callable) -> Callable:
+    """
+    Decorator for endpoint methods, runs the method within a unit of work.
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs) -> Any:
+        with unit_of_work(self.app.server):
+            return func(self, *args, **kwargs)
+
+    return wrapper
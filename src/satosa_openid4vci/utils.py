@@ -1,6 +1,7 @@
 """
 The OpenID4vci (Credential Issuer) frontend module for the satosa proxy
 """
+import functools
 import logging
 from typing import Optional
 
@@ -23,6 +24,10 @@ except ImportError:
         pass
 import satosa.logging_util as lu
 
+from satosa_openid4vci.client_lookup import ClientLookup
+from satosa_openid4vci.metrics import ERRORS
+from satosa_openid4vci.unit_of_work import current_unit_of_work
+
 logger = logging.getLogger(__name__)
 
 IGNORED_HEADERS = ["cookie", "user-agent"]
@@ -32,6 +37,9 @@ class Openid4VCIUtils(object):
     """
     Utilities used by all wrapper endpoints
     """
+    # Where load_cdb finds clients, straight in the persistence layer unless the frontend is
+    # configured with a client index or cache
+    client_lookup = ClientLookup()
 
     def __init__(self, app=None):  # pragma: no cover
         self.app = app
@@ -52,6 +60,7 @@ class Openid4VCIUtils(object):
                 ClientAuthenticationError,
         ) as err:
             logger.error(err)
+            ERRORS.inc("parse_request")
             response = JsonResponse(
                 {"error": "unauthorized_client", "error_description": str(err)},
                 status="403",
@@ -83,8 +92,8 @@ class Openid4VCIUtils(object):
             proc_req = endpoint.process_request(parse_req, http_info=http_info)
             return proc_req
         except Exception as err:  # pragma: no cover
-            logger.error(
-                f"In endpoint.process_request: {parse_req.__dict__} - {err}")
+            logger.error("In endpoint.process_request: %s - %s", parse_req.__dict__, err)
+            ERRORS.inc("process_request")
             response = JsonResponse(
                 {
                     "error": "invalid_request",
@@ -95,6 +104,8 @@ class Openid4VCIUtils(object):
             return self.send_response(response)
 
     def log_request(self, context: ExtendedContext, msg: str, level: Optional[str] = "info"):
+        if not logger.isEnabledFor(logging.getLevelName(level.upper())):
+            return
         _msg = f"{msg}: {context.request}"
         logline = lu.LOG_FMT.format(
             id=lu.get_session_id(context.state), message=_msg)
@@ -108,6 +119,7 @@ class Openid4VCIUtils(object):
         _msg = f'[Openid4VCIUtils] Something went wrong ... {excp or ""}'
         msg = msg or _msg
         logger.error(msg)
+        ERRORS.inc("handle_error")
         response = JsonResponse(msg, status=status)
         return self.send_response(response)
 
@@ -116,7 +128,12 @@ class Openid4VCIUtils(object):
 
     def send_response(self, response):
         _entity_type = self.get_entity_type()
-        _entity_type.persistence.flush_session_manager()
+        _uow = current_unit_of_work()
+        if _uow:
+            # done once when the unit of work ends
+            _uow.flush_session_manager(_entity_type)
+        else:
+            _entity_type.persistence.flush_session_manager()
         return response
 
     def load_cdb(self, context: ExtendedContext, client_id: Optional[str] = None) -> dict:
@@ -131,13 +148,19 @@ class Openid4VCIUtils(object):
         _entity_type = self.get_entity_type()
         _ec = _entity_type.context
         _persistence = _entity_type.persistence
+        _uow = current_unit_of_work()
 
+        _lookup = self.client_lookup
         if client_id:
-            client_info = _persistence.restore_client_info(client_id)
+            if _uow:
+                _load = functools.partial(_uow.restore_client_info, _entity_type, client_id)
+            else:
+                _load = functools.partial(_persistence.restore_client_info, client_id)
+            client_info = _lookup.by_client_id(client_id, _load)
         elif "Basic " in getattr(context, "request_authorization", ""):
             # here even for introspection endpoint
-            client_info = _persistence.restore_client_info_by_basic_auth(
-                context.request_authorization) or {}
+            client_info = _lookup.by_basic_auth(_persistence,
+                                                context.request_authorization) or {}
             client_id = client_info.get("client_id")
         elif context.request and context.request.get(
                 "client_assertion"
@@ -158,8 +181,8 @@ class Openid4VCIUtils(object):
             client_info = _persistence.restore_client_info(client_id)
 
         elif "Bearer " in getattr(context, "request_authorization", ""):
-            client_info = _persistence.restore_client_info_by_bearer_token(
-                context.request_authorization) or {}
+            client_info = _lookup.by_bearer_token(_persistence,
+                                                  context.request_authorization) or {}
             client_id = client_info.get("client_id")
 
         else:  # pragma: no cover
@@ -168,11 +191,14 @@ class Openid4VCIUtils(object):
             logger.warning(_msg)
             raise InvalidClient(_msg)
 
+        if client_info and _lookup.cache is not None:
+            # What the persistence layer does when the client information is restored
+            _ec.cdb[client_info.get("client_id", client_id)] = client_info
+
         if client_info:
-            logger.debug(
-                f"Loaded oidcop client: {client_info}")
+            logger.debug("Loaded oidcop client: %s", client_info)
         else:  # pragma: no cover
-            logger.info(f'Cannot find "{client_id}" in client DB')
+            logger.info('Cannot find "%s" in client DB', client_id)
             raise UnknownClient(client_id)
 
         # TODO - consider to handle also basic auth for clients ...
@@ -0,0 +1,103 @@
+import time
+
+from cryptojwt import JWT
+from cryptojwt.key_jar import build_keyjar
+from satosa.context import Context
+
+from satosa_openid4vci.response_cache import JWKSResponseCache
+from satosa_openid4vci.response_cache import SignedStatementCache
+from satosa_openid4vci.response_cache import etag_matches
+from satosa_openid4vci.response_cache import keyjar_generation
+
+KEY_DEFS = [
+    {"type": "RSA", "use": ["sig"]},
+    {"type": "EC", "crv": "P-256", "use": ["sig"]},
+]
+
+
+def _headers(response):
+    return {k: v for k, v in response.headers}
+
+
+class TestJWKSResponseCache(object):
+
+    def setup_method(self):
+        self.keyjar = build_keyjar(KEY_DEFS)
+        self.cache = JWKSResponseCache(max_age=600)
+
+    def test_lookup_is_cached(self):
+        _entry = self.cache.lookup("oas", self.keyjar)
+        assert self.cache.lookup("oas", self.keyjar) is _entry
+        assert _entry.body.startswith(b'{"keys":')
+
+    def test_rotation_invalidates(self):
+        _entry = self.cache.lookup("oas", self.keyjar)
+        self.keyjar.rotate_keys(KEY_DEFS)
+        assert keyjar_generation(self.keyjar) != _entry.generation
+        _new = self.cache.lookup("oas", self.keyjar)
+        assert _new.etag != _entry.etag
+
+    def test_response(self):
+        context = Context()
+        context.http_headers = {}
+        response = self.cache.response(context, "oas", self.keyjar)
+        assert response.status == "200 OK"
+        _etag = _headers(response)["ETag"]
+        assert _headers(response)["Cache-Control"] == "public, max-age=600"
+
+        context.http_headers = {"HTTP_IF_NONE_MATCH": _etag}
+        response = self.cache.response(context, "oas", self.keyjar)
+        assert response.status == "304 Not Modified"
+        assert response.message == ""
+
+
+def test_etag_matches():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('"abc"', 'W/"abc", "def"')
+    assert etag_matches('"abc"', "*")
+    assert not etag_matches('"abc"', '"def"')
+    assert not etag_matches('"abc"', "")
+
+
+class TestSignedStatementCache(object):
+
+    def setup_method(self):
+        self.keyjar = build_keyjar(KEY_DEFS)
+        self.signed = 0
+        self.state = "A"
+        self.cache = SignedStatementCache(sign=self._sign, fingerprint=lambda: self.state,
+                                          check_interval=0)
+
+    def _sign(self):
+        self.signed += 1
+        _jwt = JWT(self.keyjar, sign_alg="ES256", lifetime=3600)
+        return _jwt.pack({"state": self.state})
+
+    def _wait_for(self, signed):
+        for _ in range(100):
+            if self.signed == signed and not self.cache._refreshing:
+                return
+            time.sleep(0.01)
+
+    def test_signs_once(self):
+        _jws = self.cache.get()
+        assert self.cache.get() == _jws
+        assert self.signed == 1
+
+    def test_change_refreshes_in_background(self):
+        _jws = self.cache.get()
+        self.state = "B"
+        # The old statement is served while the new one is signed
+        assert self.cache.get() == _jws
+        self._wait_for(2)
+        assert self.cache.get() != _jws
+        assert self.signed == 2
+
+    def test_refresh_fraction(self):
+        self.cache.warm()
+        _entry = self.cache._entry
+        assert _entry.refresh_at == _entry.issued_at + 1800
+        self.cache._entry = _entry._replace(refresh_at=0)
+        self.cache.get()
+        self._wait_for(2)
+        assert self.signed == 2
@@ -0,0 +1,127 @@
+import pytest
+
+from satosa_openid4vci.storage.tracking import ChangeTrackingStorage
+
+
+class Storage(object):
+    """Minimal information type storage"""
+
+    def __init__(self):
+        self.db = {}
+        self.writes = 0
+
+    def store(self, information_type, value, key=""):
+        self.writes += 1
+        self.db[(information_type, key)] = value
+
+    def fetch(self, information_type, key=""):
+        return self.db.get((information_type, key))
+
+    def delete(self, information_type, key=""):
+        del self.db[(information_type, key)]
+
+
+@pytest.fixture
+def storage():
+    return ChangeTrackingStorage(storage=Storage())
+
+
+def test_unchanged_value_not_written(storage):
+    storage.storage.store("client", {"client_id": "client_1"}, key="client_1")
+    storage.begin()
+    storage.fetch("client", key="client_1")
+    storage.store("client", {"client_id": "client_1"}, key="client_1")
+    storage.commit()
+    assert storage.storage.writes == 1
+    assert storage.stats["skipped"] == 1
+
+    storage.begin()
+    storage.fetch("client", key="client_1")
+    storage.store("client", {"client_id": "client_1", "jwks": {}}, key="client_1")
+    storage.commit()
+    assert storage.storage.writes == 2
+
+
+def test_read_value_not_written_back(storage):
+    storage.storage.store("claims", {"email": "diana@example.org"}, key="diana")
+    storage.begin()
+    _claims = storage.fetch("claims", key="diana")
+    storage.store("claims", _claims, key="diana")
+    storage.commit()
+    assert storage.storage.writes == 1
+
+
+def test_nothing_remembered_between_units_of_work():
+    shared = Storage()
+    worker_a = ChangeTrackingStorage(storage=shared)
+    worker_b = ChangeTrackingStorage(storage=shared)
+
+    worker_a.begin()
+    assert worker_a.fetch("claims", key="diana") is None
+    worker_a.store("claims", {"email": "diana@example.org"}, key="diana")
+    worker_a.commit()
+
+    # Another worker changes the value in the shared storage
+    worker_b.store("claims", {"email": "diana@example.com"}, key="diana")
+
+    # Worker A writes what it wrote before, which must not be mistaken for a no-op
+    worker_a.begin()
+    worker_a.store("claims", {"email": "diana@example.org"}, key="diana")
+    worker_a.commit()
+    assert shared.db[("claims", "diana")] == {"email": "diana@example.org"}
+
+    # Outside a unit of work every write is done
+    worker_a.store("claims", {"email": "diana@example.org"}, key="diana")
+    assert shared.writes == 4
+
+
+def test_deferred_writes(storage):
+    storage.begin()
+    storage.store("par", {"state": 1}, key="urn:1")
+    storage.store("par", {"state": 2}, key="urn:1")
+    storage.store("client", {"client_id": "client_1"}, key="client_1")
+    assert storage.storage.writes == 0
+    assert storage.fetch("par", key="urn:1") == {"state": 2}
+    assert storage.touched == {("par", "urn:1"), ("client", "client_1")}
+
+    assert storage.commit() == {("par", "urn:1"), ("client", "client_1")}
+    assert storage.storage.writes == 2
+    assert storage.storage.db[("par", "urn:1")] == {"state": 2}
+
+
+def test_value_changed_after_deferred_write(storage):
+    storage.begin()
+    _value = {"state": 1}
+    storage.store("par", _value, key="urn:1")
+    _value["state"] = 2
+    storage.fetch("par", key="urn:1")["state"] = 3
+    storage.commit()
+    assert storage.storage.db[("par", "urn:1")] == {"state": 1}
+
+    # what was committed is known to be in the storage
+    storage.begin()
+    storage.fetch("par", key="urn:1")
+    storage.store("par", {"state": 1}, key="urn:1")
+    storage.commit()
+    assert storage.storage.writes == 1
+
+
+def test_rollback(storage):
+    storage.begin()
+    storage.store("par", {"state": 1}, key="urn:1")
+    storage.delete("par", key="urn:1")
+    storage.rollback()
+    assert storage.commit() == set()
+    assert storage.storage.writes == 0
+
+
+def test_dictionary_interface():
+    storage = ChangeTrackingStorage(storage={})
+    storage.begin()
+    storage["a"] = {"b": 1}
+    storage["a"] = {"b": 1}
+    storage.commit()
+    assert storage.stats["written"] == 1
+    assert storage.get("a") == {"b": 1}
+    del storage["a"]
+    assert "a" not in storage
@@ -0,0 +1,93 @@
+import pytest
+
+from satosa_openid4vci.storage.tracking import ChangeTrackingStorage
+from satosa_openid4vci.unit_of_work import current_unit_of_work
+from satosa_openid4vci.unit_of_work import unit_of_work
+
+
+class Persistence(object):
+
+    def __init__(self):
+        self.storage = ChangeTrackingStorage(storage={})
+        self.calls = []
+        self.client = {}
+
+    def restore_state(self, *args):
+        self.calls.append("restore_state")
+
+    def restore_client_info(self, client_id):
+        self.calls.append("restore_client_info")
+        return self.storage.get(f"client_{client_id}")
+
+    def store_client_info(self, client_id):
+        self.calls.append("store_client_info")
+        self.storage[f"client_{client_id}"] = self.client[client_id]
+
+    def store_state(self, *args):
+        self.calls.append("store_state")
+
+    def flush_session_manager(self):
+        self.calls.append("flush_session_manager")
+
+
+class Entity(object):
+
+    def __init__(self):
+        self.persistence = Persistence()
+
+
+@pytest.fixture
+def server():
+    return {"oauth_authorization_server": Entity(), "federation_entity": Entity()}
+
+
+def test_loads_once(server):
+    _oas = server["oauth_authorization_server"]
+    with unit_of_work(server) as uow:
+        uow.restore_state(_oas, {}, {})
+        uow.restore_state(_oas, {}, {})
+        uow.restore_client_info(_oas, "client_1")
+        uow.restore_client_info(_oas, "client_1")
+    assert _oas.persistence.calls == ["restore_state", "restore_client_info"]
+
+
+def test_restore_state_by_arguments(server):
+    _oas = server["oauth_authorization_server"]
+    with unit_of_work(server) as uow:
+        uow.restore_state(_oas, {"client_id": "client_1"}, {})
+        uow.restore_state(_oas, {"client_id": "client_2"}, {})
+        uow.restore_state(_oas, {"client_id": "client_1"}, {})
+        uow.restore_state(_oas, "client_1")
+        uow.restore_state(_oas, "client_1")
+    assert _oas.persistence.calls == ["restore_state"] * 3
+
+
+def test_writes_at_the_end(server):
+    _oas = server["oauth_authorization_server"]
+    _oas.persistence.client["client_1"] = {"client_id": "client_1"}
+    with unit_of_work(server) as uow:
+        uow.store_client_info(_oas, "client_1")
+        uow.store_client_info(_oas, "client_1")
+        uow.flush_session_manager(_oas)
+        uow.flush_session_manager(_oas)
+        assert _oas.persistence.calls == []
+    assert _oas.persistence.calls == ["store_client_info", "flush_session_manager"]
+    assert _oas.persistence.storage.storage["client_client_1"] == {"client_id": "client_1"}
+    assert current_unit_of_work() is None
+
+
+def test_nested(server):
+    with unit_of_work(server) as uow:
+        with unit_of_work(server) as inner:
+            assert inner is uow
+
+
+def test_rollback(server):
+    _oas = server["oauth_authorization_server"]
+    with pytest.raises(ValueError):
+        with unit_of_work(server) as uow:
+            uow.store_state(_oas)
+            uow.flush_session_manager(_oas)
+            raise ValueError()
+    # Neither the stores nor the session manager are written
+    assert _oas.persistence.calls == []
@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+from satosa_openid4vci.storage.memory import InMemoryRedis
+from satosa_openid4vci.storage.redis_db import RedisDB
+from satosa_openid4vci.storage.tracking import ChangeTrackingStorage
+
+
+@pytest.fixture
+def db():
+    return RedisDB(client=InMemoryRedis(), prefix="oci:", key_conv="idpyoidc.util.Base64",
+                   value_conv="idpyoidc.util.JSON")
+
+
+def test_information_types(db):
+    db.store("client", {"client_id": "client_1"}, key="client_1")
+    db.store("client", {"client_id": "client_2"}, key="client_2")
+    db.store("par", {"state": "abc"}, key="urn:uuid:1")
+
+    assert db.fetch("client", key="client_1") == {"client_id": "client_1"}
+    assert db.fetch("client", key="client_3") is None
+    assert set(db.keys_by_information_type("client")) == {"client_1", "client_2"}
+    assert db.fetch_many("client", ["client_1", "client_3"]) == {
+        "client_1": {"client_id": "client_1"}}
+
+    db.delete("par", key="urn:uuid:1")
+    assert db.fetch("par", key="urn:uuid:1") is None
+
+
+def test_dictionary_interface(db):
+    db["a"] = {"b": 1}
+    assert db["a"] == {"b": 1}
+    assert "a" in db
+    assert dict(db.items()) == {"a": {"b": 1}}
+    assert list(db) == ["a"]
+    assert len(db) == 1
+    del db["a"]
+    with pytest.raises(KeyError):
+        db["a"]
+    assert db.get("a") is None
+
+
+def test_batch(db):
+    with db.batch():
+        db["a"] = 1
+        db.store("client", {"client_id": "client_1"}, key="client_1")
+        assert db.get("a") is None
+    assert db["a"] == 1
+    assert db.fetch("client", key="client_1") == {"client_id": "client_1"}
+
+
+def test_ttl(db):
+    db.store("par", {"state": "abc"}, key="urn:uuid:1", ttl=1)
+    assert db.client.ttl("oci:par:" + db.key_conv.serialize("urn:uuid:1")) in (0, 1)
+    db.client._expires["oci:par:" + db.key_conv.serialize("urn:uuid:1")] = time.time() - 1
+    assert db.fetch("par", key="urn:uuid:1") is None
+
+
+def test_shared_memory_instance():
+    _db1 = RedisDB(url="memory://test_14", prefix="a:")
+    _db2 = RedisDB(url="memory://test_14", prefix="a:")
+    _db1["x"] = "y"
+    _db1.store("client", {"client_id": "client_1"}, key="client_1")
+    assert _db2["x"] == "y"
+    _db1.clear()
+    assert "x" not in _db2
+    # Only the dictionary interface is cleared
+    assert _db2.fetch("client", key="client_1") == {"client_id": "client_1"}
+
+
+def test_change_tracking_commit_uses_pipeline(db):
+    storage = ChangeTrackingStorage(storage=db)
+    storage.begin()
+    storage.store("client", {"client_id": "client_1"}, key="client_1")
+    storage.store("par", {"state": "abc"}, key="urn:uuid:1")
+    storage.commit()
+    assert db.fetch("par", key="urn:uuid:1") == {"state": "abc"}
+    assert storage.stats["written"] == 2
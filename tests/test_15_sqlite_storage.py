@@ -0,0 +1,110 @@
+import os
+import threading
+
+import pytest
+
+from satosa_openid4vci.storage.sqlite_db import SQLiteDB
+
+
+@pytest.fixture
+def db(tmp_path):
+    return SQLiteDB(db_file=str(tmp_path / "storage.sqlite"), key_conv="idpyoidc.util.Base64",
+                    value_conv="idpyoidc.util.JSON")
+
+
+def test_wal_mode(db):
+    assert db.connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_information_types(db):
+    db.store("client", {"client_id": "client_1"}, key="client_1")
+    db.store("client", {"client_id": "client_2"}, key="client_2")
+    db.store("client", {"client_id": "client_2", "x": 1}, key="client_2")
+    assert db.fetch("client", key="client_2") == {"client_id": "client_2", "x": 1}
+    assert db.fetch("client", key="client_3") is None
+    assert set(db.keys_by_information_type("client")) == {"client_1", "client_2"}
+    db.delete("client", key="client_1")
+    assert db.keys_by_information_type("client") == ["client_2"]
+
+
+def test_dictionary_interface(db):
+    db["a"] = {"b": 1}
+    assert db["a"] == {"b": 1}
+    assert "a" in db
+    assert len(db) == 1
+    assert dict(db.items()) == {"a": {"b": 1}}
+    assert list(db) == ["a"]
+    del db["a"]
+    with pytest.raises(KeyError):
+        del db["a"]
+    assert db.get("a") is None
+
+
+def test_clear(db):
+    db["a"] = 1
+    db.store("client", {"client_id": "client_1"}, key="client_1")
+    db.clear()
+    assert "a" not in db
+    assert db.fetch("client", key="client_1") == {"client_id": "client_1"}
+
+
+def test_batch_rollback(db):
+    with pytest.raises(ValueError):
+        with db.batch():
+            db["a"] = 1
+            raise ValueError()
+    assert "a" not in db
+
+
+def test_ttl(db):
+    db.store("par", {"state": "abc"}, key="urn:uuid:1", ttl=-1)
+    assert db.fetch("par", key="urn:uuid:1") is None
+    db.store("par", {"state": "abc"}, key="urn:uuid:2", ttl=60)
+    assert db.fetch("par", key="urn:uuid:2") == {"state": "abc"}
+
+
+def test_threads_share_database(db):
+    def _writer(n):
+        db.store("session", {"n": n}, key=str(n))
+
+    _threads = [threading.Thread(target=_writer, args=(i,)) for i in range(8)]
+    for _t in _threads:
+        _t.start()
+    for _t in _threads:
+        _t.join()
+    assert len(db.keys_by_information_type("session")) == 8
+
+
+def test_load_directory(db, tmp_path):
+    fdir = tmp_path / "op_storage"
+    os.makedirs(fdir)
+    _name = db.key_conv.serialize("client_1")
+    with open(fdir / _name, "w") as fp:
+        fp.write('{"client_id": "client_1"}')
+    with open(fdir / f"{_name}.lock", "w") as fp:
+        fp.write("")
+
+    assert db.load_directory(str(fdir)) == 1
+    assert db["client_1"] == {"client_id": "client_1"}
+
+
+def test_no_connection_after_init(db):
+    assert getattr(db._local, "connection", None) is None
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_forked_process_connects_again(db):
+    db.store("client", {"client_id": "parent"}, key="parent")
+    _parent_connection = db.connection
+    _pid = os.fork()
+    if _pid == 0:  # pragma: no cover
+        try:
+            _ok = db.connection is not _parent_connection
+            db.store("client", {"client_id": "child"}, key="child")
+        except Exception:
+            _ok = False
+        os._exit(0 if _ok else 1)
+    _, _status = os.waitpid(_pid, 0)
+    assert os.WEXITSTATUS(_status) == 0
+    assert db.fetch("client", key="child") == {"client_id": "child"}
+    assert db.connection is _parent_connection
@@ -0,0 +1,94 @@
+import os
+import time
+
+from idpyoidc.util import Base64
+
+from satosa_openid4vci.storage.expiry import ExpiryPolicy
+from satosa_openid4vci.storage.expiry import Sweeper
+from satosa_openid4vci.storage.expiry import purge_directory
+from satosa_openid4vci.storage.sqlite_db import SQLiteDB
+from satosa_openid4vci.storage.tracking import ChangeTrackingStorage
+
+
+def _write(fdir, name, age=0):
+    _path = os.path.join(fdir, Base64().serialize(name))
+    with open(_path, "w") as fp:
+        fp.write("{}")
+    if age:
+        _then = time.time() - age
+        os.utime(_path, (_then, _then))
+    return _path
+
+
+def test_policy():
+    policy = ExpiryPolicy({"par": 60, "session*": 3600}, default=None)
+    assert policy.ttl_for("par") == 60
+    assert policy.ttl_for("session_abc") == 3600
+    assert policy.ttl_for("client") is None
+    assert not ExpiryPolicy()
+    assert ExpiryPolicy(default=10).ttl_for("anything") == 10
+
+
+def test_purge_directory(tmp_path):
+    fdir = str(tmp_path)
+    _old = _write(fdir, "par_1", age=1000)
+    _write(fdir, "par_2")
+    _write(fdir, "client_1", age=100000)
+    with open(f"{_old}.lock", "w") as fp:
+        fp.write("")
+
+    policy = ExpiryPolicy({"par*": 600})
+    assert purge_directory(fdir, policy, key_conv=Base64(), dry_run=True) == ["par_1"]
+    assert os.path.exists(_old)
+
+    assert purge_directory(fdir, policy, key_conv=Base64()) == ["par_1"]
+    assert not os.path.exists(_old)
+    assert not os.path.exists(f"{_old}.lock")
+    assert len(os.listdir(fdir)) == 2
+
+
+def test_purge_directory_limit(tmp_path):
+    fdir = str(tmp_path)
+    for i in range(5):
+        _write(fdir, f"par_{i}", age=1000)
+    policy = ExpiryPolicy({"par*": 600})
+    assert len(purge_directory(fdir, policy, key_conv=Base64(), limit=2)) == 2
+    assert len(os.listdir(fdir)) == 3
+
+
+def test_sqlite_ttl_through_tracking(tmp_path):
+    db = SQLiteDB(db_file=str(tmp_path / "storage.sqlite"))
+    storage = ChangeTrackingStorage(db, ttl={"par": 600})
+    storage.store(information_type="par", value={"a": 1}, key="urn:1")
+    storage.store(information_type="client", value={"b": 1}, key="client_1")
+
+    _rows = dict(db.connection.execute("SELECT information_type, expires_at FROM storage"))
+    assert _rows["par"] > time.time()
+    assert _rows["client"] is None
+
+    db.connection.execute("UPDATE storage SET expires_at = ? WHERE information_type = 'par'",
+                          (time.time() - 1,))
+    assert storage.fetch(information_type="par", key="urn:1") is None
+    assert Sweeper([storage]).sweep() == 1
+    assert db.connection.execute("SELECT count(*) FROM storage").fetchone()[0] == 1
+
+
+def test_one_sweeper_per_lock_file(tmp_path):
+    db = SQLiteDB(db_file=str(tmp_path / "storage.sqlite"))
+    _lock_file = str(tmp_path / "gc.lock")
+    first = Sweeper([db], lock_file=_lock_file)
+    second = Sweeper([db], lock_file=_lock_file)
+    assert first.has_lock()
+    assert not second.has_lock()
+    first.stop()
+    assert second.has_lock()
+    second.stop()
+
+
+def test_file_storage_not_swept(tmp_path):
+    class FileStorage(object):
+        fdir = str(tmp_path)
+
+    _write(str(tmp_path), "par_1", age=3600)
+    assert Sweeper([FileStorage()]).sweep() == 0
+    assert len(os.listdir(tmp_path)) == 1
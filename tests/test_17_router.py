@@ -0,0 +1,42 @@
+from satosa_openid4vci.router import Router
+
+
+def _handler(name):
+    def _func(context):
+        return name
+
+    return _func
+
+
+URL_MAP = [
+    ("^.well-known/openid-federation", _handler("entity_configuration")),
+    ("^authorization", _handler("authorization")),
+    ("^token", _handler("token")),
+    ("^credential", _handler("credential")),
+    ("^credential/deferred", _handler("deferred_credential")),
+    ("^static/jwks.json", _handler("jwks")),
+    ("^token", _handler("token_2")),
+]
+
+
+def test_exact():
+    router = Router(URL_MAP)
+    assert len(router) == 6
+    assert router.match("token")(None) == "token"
+    assert router.match("/credential/")(None) == "credential"
+    assert router.match("credential/deferred")(None) == "deferred_credential"
+    assert router.match(".well-known/openid-federation")(None) == "entity_configuration"
+
+
+def test_prefix():
+    router = Router(URL_MAP)
+    assert router.match("credential/foo")(None) == "credential"
+    assert router.match("credential/deferred/1")(None) == "deferred_credential"
+    assert router.match("static/jwks.json/x")(None) == "jwks"
+
+
+def test_no_match():
+    router = Router(URL_MAP)
+    assert router.match("static") is None
+    assert router.match("unknown/token") is None
+    assert router.match("") is None
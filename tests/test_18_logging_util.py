@@ -0,0 +1,27 @@
+import logging
+
+from satosa_openid4vci.logging_util import Lazy
+from satosa_openid4vci.logging_util import banner
+
+
+def test_lazy_not_evaluated_when_disabled(caplog):
+    calls = []
+
+    def _expensive():
+        calls.append(1)
+        return "expensive"
+
+    logger = logging.getLogger("test_lazy")
+    with caplog.at_level(logging.INFO, logger="test_lazy"):
+        logger.debug("value: %s", Lazy(_expensive))
+    assert calls == []
+
+    with caplog.at_level(logging.DEBUG, logger="test_lazy"):
+        logger.debug("value: %s", Lazy(_expensive))
+    assert calls
+    assert "value: expensive" in caplog.text
+
+
+def test_banner():
+    assert banner("Token", "*", 3) == "***Token***"
+    assert banner("Token", "*", 3) is banner("Token", "*", 3)
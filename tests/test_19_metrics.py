@@ -0,0 +1,91 @@
+import json
+import os
+
+from satosa.context import Context
+from satosa.response import Response
+
+from satosa_openid4vci.metrics import Counter
+from satosa_openid4vci.metrics import Histogram
+from satosa_openid4vci.metrics import MultiprocessMetrics
+from satosa_openid4vci.metrics import REQUEST_LATENCY
+from satosa_openid4vci.metrics import RESPONSES
+from satosa_openid4vci.metrics import Registry
+from satosa_openid4vci.metrics import STORAGE_LATENCY
+from satosa_openid4vci.metrics import instrument
+from satosa_openid4vci.metrics import metrics_response
+from satosa_openid4vci.metrics import response_size
+from satosa_openid4vci.metrics import timed
+
+
+def test_exposition():
+    registry = Registry()
+    counter = registry.register(Counter("errors", "Errors", ("source",)))
+    histogram = registry.register(Histogram("latency", "Latency", ("endpoint",),
+                                            buckets=(0.1, 1.0)))
+    counter.inc("parse_request")
+    counter.inc("parse_request")
+    histogram.observe(0.05, "token")
+    histogram.observe(0.5, "token")
+    histogram.observe(5, "token")
+
+    text = registry.exposition()
+    assert "# TYPE errors counter" in text
+    assert 'errors_total{source="parse_request"} 2' in text
+    assert 'latency_bucket{endpoint="token",le="0.1"} 1' in text
+    assert 'latency_bucket{endpoint="token",le="1.0"} 2' in text
+    assert 'latency_bucket{endpoint="token",le="+Inf"} 3' in text
+    assert 'latency_count{endpoint="token"} 3' in text
+
+
+def test_instrument():
+    def _handler(context):
+        return Response("hello", status="403")
+
+    _before = REQUEST_LATENCY.count("test")
+    context = Context()
+    context.request = {"a": "b"}
+    instrument("test", _handler)(context)
+    assert REQUEST_LATENCY.count("test") == _before + 1
+    assert RESPONSES.value("test", "403") >= 1
+
+
+def test_timed():
+    _before = STORAGE_LATENCY.count("restore_state")
+    with timed("restore_state"):
+        pass
+    assert STORAGE_LATENCY.count("restore_state") == _before + 1
+    assert "oid4vci_storage_duration_seconds_count" in metrics_response().message
+
+
+def test_response_size_in_bytes():
+    assert response_size(Response("åäö")) == 6
+    assert response_size(Response([b"ab", "å"])) == 4
+
+
+def _worker_registry():
+    registry = Registry()
+    registry.register(Counter("errors", "Errors", ("source",)))
+    registry.register(Histogram("latency", "Latency", ("endpoint",), buckets=(0.1, 1.0)))
+    return registry
+
+
+def test_multiprocess(tmp_path):
+    # another worker's metrics, as written to the shared directory
+    other = _worker_registry()
+    other.metrics["errors"].inc("parse_request")
+    other.metrics["latency"].observe(0.5, "token")
+    with open(tmp_path / "metrics-1.json", "w") as fp:
+        json.dump(other.snapshot(), fp)
+
+    registry = _worker_registry()
+    registry.metrics["errors"].inc("parse_request", amount=2)
+    registry.metrics["latency"].observe(0.05, "token")
+    shared = MultiprocessMetrics(str(tmp_path), registry=registry, interval=0)
+    shared.maybe_write()
+    assert (tmp_path / f"metrics-{os.getpid()}.json").exists()
+
+    text = shared.exposition()
+    assert 'errors_total{source="parse_request"} 3' in text
+    assert 'latency_bucket{endpoint="token",le="0.1"} 1' in text
+    assert 'latency_bucket{endpoint="token",le="1.0"} 2' in text
+    assert 'latency_count{endpoint="token"} 2' in text
@@ -0,0 +1,91 @@
+import pytest
+
+from satosa_openid4vci import tracing
+from satosa_openid4vci.tracing import NOOP_SPAN
+from satosa_openid4vci.tracing import STATUS_ERROR
+from satosa_openid4vci.tracing import STATUS_OK
+from satosa_openid4vci.tracing import TracedConstructor
+from satosa_openid4vci.tracing import correlate
+from satosa_openid4vci.tracing import span
+from satosa_openid4vci.tracing import traced
+
+
+@pytest.fixture
+def exporter():
+    tracer = tracing.configure(
+        {"exporter": {"class": "satosa_openid4vci.tracing.InMemorySpanExporter"}})
+    yield tracer.exporter
+    tracing.configure(None)
+
+
+def test_off():
+    with span("nothing") as _span:
+        assert _span is NOOP_SPAN
+
+
+def test_nested_spans(exporter):
+    with span("endpoint", path="token") as _outer:
+        with span("persistence.restore_state") as _inner:
+            pass
+        # not exported until the request is done
+        assert exporter.get_finished_spans() == []
+
+    _spans = exporter.get_finished_spans()
+    assert [s.name for s in _spans] == ["persistence.restore_state", "endpoint"]
+    assert _inner.parent_id == _outer.span_id
+    assert _inner.trace_id == _outer.trace_id
+    assert _outer.attributes == {"path": "token"}
+    assert _outer.status == STATUS_OK
+    assert _outer.end_time >= _outer.start_time
+
+
+def test_error_status(exporter):
+    @traced()
+    def _fail():
+        raise ValueError("bad")
+
+    with pytest.raises(ValueError):
+        _fail()
+    _span = exporter.get_finished_spans()[0]
+    assert _span.status == STATUS_ERROR
+    assert "bad" in _span.status_description
+
+
+def test_correlation(exporter):
+    with span("pushed_authorization_endpoint"):
+        correlate("urn:uuid:1")
+    with span("authorization_endpoint"):
+        correlate("urn:uuid:1")
+        correlate("code_1")
+    with span("token_endpoint"):
+        correlate("code_1")
+    with span("other"):
+        correlate("urn:uuid:2")
+
+    _trace_ids = [s.trace_id for s in exporter.get_finished_spans()]
+    assert len(set(_trace_ids[:3])) == 1
+    assert _trace_ids[3] != _trace_ids[0]
+
+
+def test_traced_constructor(exporter):
+    _constructor = TracedConstructor(lambda user: {"user": user}, "PIDCredential")
+    with span("credential_endpoint"):
+        assert _constructor("diana") == {"user": "diana"}
+    _spans = exporter.get_finished_spans()
+    assert _spans[0].name == "credential_constructor"
+    assert _spans[0].attributes["credential_type"] == "PIDCredential"
+
+
+def test_traced_constructor_configuration():
+    class Constructor(object):
+        httpc = None
+        sign_alg = "ES256"
+
+    _inner = Constructor()
+    _constructor = TracedConstructor(_inner, "PIDCredential")
+    _constructor.httpc = "pooled"
+    _constructor.sign_alg = "EdDSA"
+    assert _inner.httpc == "pooled"
+    assert _inner.sign_alg == "EdDSA"
+    assert _constructor.httpc == "pooled"
+    assert _constructor.name == "PIDCredential"
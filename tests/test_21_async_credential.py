@@ -0,0 +1,271 @@
+import asyncio
+import json
+import threading
+import time
+
+import httpx
+from idpyoidc.message import Message
+import pytest
+from satosa.context import Context
+
+from satosa_openid4vci.async_credential import AsyncCredentialIssuance
+from satosa_openid4vci.async_credential import CollectingConstructor
+from satosa_openid4vci.async_credential import install_collectors
+from satosa_openid4vci.endpoint_wrapper.credential import CredentialEndpointWrapper
+from satosa_openid4vci.tools.stub_authentic_source import StubAuthenticSource
+from satosa_openid4vci.tracing import TracedConstructor
+
+CLAIMS = {"given_name": "Diana", "family_name": "Krall"}
+
+
+class Constructor(object):
+    """Builds the authentic source request from its arguments, like the real constructor."""
+
+    def __init__(self, url, body, httpc):
+        self.url = url
+        self.body = body
+        self.httpc = httpc
+
+    def __call__(self, user_id, client_id, request, claims, **kwargs):
+        _body = dict(self.body)
+        _body.update({"identity": claims, "client_id": client_id, "user_id": user_id,
+                      "cnf": request.get("proof")})
+        _resp = self.httpc("POST", self.url, data=json.dumps(_body),
+                           headers={"Content-Type": "application/json"}, verify=False,
+                           timeout=5)
+        _resp.raise_for_status()
+        return _resp.json()["credential"]
+
+
+class Endpoint(object):
+    def __init__(self, httpc):
+        self.credential_constructor = {
+            "PIDCredential": Constructor("https://as.example.org/credential",
+                                         {"document_type": "PID"}, httpc)}
+
+    def parse_request(self, request, http_info=None):
+        return Message(**request)
+
+    def process_request(self, request, extra_claims=None):
+        _constructor = self.credential_constructor[request["credential_identifier"]]
+        _credential = _constructor(user_id="diana", client_id=request["client_id"],
+                                   request=request, claims=extra_claims)
+        return {"response_args": {"credential": _credential}}
+
+
+class Persistence(object):
+    def restore_state(self, request, http_info):
+        pass
+
+    def load_claims(self, client_id):
+        return dict(CLAIMS)
+
+    def flush_session_manager(self):
+        pass
+
+
+class Guise(object):
+    def __init__(self, endpoint, server):
+        self.persistence = Persistence()
+        self.endpoint = endpoint
+        self.server = server
+
+    def get_endpoint(self, name):
+        return self.endpoint
+
+    def upstream_get(self, what):
+        return self.server if what == "unit" else None
+
+
+class Server(dict):
+    def upstream_get(self, what):
+        return None
+
+
+class Wrapper(CredentialEndpointWrapper):
+    """The parts of satosa_idpyop's EndPointWrapper the credential wrapper uses."""
+
+    def __init__(self, guise):
+        self.guise = guise
+        self.endpoint = guise.endpoint
+
+    def upstream_get(self, what):
+        return self.guise if what == "unit" else None
+
+    def parse_request(self, request, http_info=None):
+        return self.endpoint.parse_request(request, http_info)
+
+    def process_request(self, request, parse_req, http_info, extra_claims=None):
+        return self.endpoint.process_request(parse_req, extra_claims=extra_claims)
+
+    def clean_up(self):
+        pass
+
+
+class Frontend(object):
+    def __init__(self, httpc):
+        self.app = type("App", (), {})()
+        self.app.server = Server()
+        _guise = Guise(Endpoint(httpc), self.app.server)
+        self.app.server["openid_credential_issuer"] = _guise
+        self.app.server["oauth_authorization_server"] = _guise
+        self.endpoint_wrapper = {"credential": Wrapper(_guise)}
+
+    def get_entity_type(self):
+        return self.app.server["openid_credential_issuer"]
+
+
+class Recorder(object):
+    """Called like requests.request, blocks like it and answers like the stub authentic source."""
+
+    def __init__(self, delay=0.05, status=200):
+        self.delay = delay
+        self.status = status
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, method, url, **kwargs):
+        _body = json.loads(kwargs["data"])
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+                self.requests.append(_body)
+        return httpx.Response(
+            self.status, json={"credential": StubAuthenticSource.make_credential(_body)},
+            request=httpx.Request(method, url))
+
+
+def _request(client_id):
+    return {"client_id": client_id, "credential_identifier": "PIDCredential",
+            "proof": {"proof_type": "jwt", "jwt": f"proof-of-{client_id}"}}
+
+
+def _context(request):
+    context = Context()
+    context.request = request
+    context.http_headers = {}
+    return context
+
+
+@pytest.fixture
+def recorder():
+    return Recorder()
+
+
+@pytest.fixture
+def issuance(recorder):
+    return AsyncCredentialIssuance(Frontend(recorder))
+
+
+def _post(issuance, requests):
+    async def _run():
+        _client = httpx.AsyncClient(transport=httpx.ASGITransport(app=issuance.asgi_app()),
+                                    base_url="https://issuer.example.org")
+        _responses = await asyncio.gather(*[
+            _client.post("/credential", json=r) for r in requests])
+        await _client.aclose()
+        await issuance.aclose()
+        return _responses
+
+    return asyncio.run(_run())
+
+
+def _constructors(issuance):
+    return issuance.frontend.app.server["openid_credential_issuer"].endpoint \
+        .credential_constructor
+
+
+def test_constructor_outside_collection(issuance, recorder):
+    _constructor = _constructors(issuance)["PIDCredential"]
+    assert isinstance(_constructor, CollectingConstructor)
+    _credential = _constructor(user_id="diana", client_id="wallet", request={}, claims={})
+    assert _credential.startswith("eyJ")
+    assert len(recorder.requests) == 1
+
+
+def test_configure_through_wrapper(issuance):
+    _constructor = _constructors(issuance)["PIDCredential"]
+    _constructor.httpc = "pooled"
+    assert _constructor.constructor.httpc == "pooled"
+
+
+def test_same_request_as_synchronous(issuance, recorder):
+    _wrapper = issuance.wrapper
+    _sync = json.loads(_wrapper(_context(_request("client_0"))).message)
+
+    _responses = _post(issuance, [_request("client_0")])
+    assert _responses[0].status_code == 200
+    assert recorder.requests[0] == recorder.requests[1] == {
+        "document_type": "PID", "identity": CLAIMS, "client_id": "client_0",
+        "user_id": "diana", "cnf": {"proof_type": "jwt", "jwt": "proof-of-client_0"}}
+    assert _responses[0].json() == _sync
+
+
+def test_concurrent_issuance(issuance, recorder):
+    _responses = _post(issuance, [_request(f"client_{i}") for i in range(20)])
+    assert all(r.status_code == 200 for r in _responses)
+    assert len(recorder.requests) == 20
+    assert sorted(r["client_id"] for r in recorder.requests) == sorted(
+        f"client_{i}" for i in range(20))
+    for _response in _responses:
+        assert _response.json()["credential"].startswith("eyJ")
+    # the blocking authentic source calls overlapped
+    assert recorder.max_in_flight > 1
+
+
+def test_bounded_pool(recorder):
+    issuance = AsyncCredentialIssuance(Frontend(recorder), max_workers=2)
+    _responses = _post(issuance, [_request(f"client_{i}") for i in range(6)])
+    assert all(r.status_code == 200 for r in _responses)
+    assert recorder.max_in_flight <= 2
+
+
+def test_with_tracing_and_deferred(recorder):
+    _frontend = Frontend(recorder)
+    _endpoint = _frontend.app.server["openid_credential_issuer"].endpoint
+    _original = _endpoint.credential_constructor["PIDCredential"]
+    # the order OpenID4VCIFrontend wraps them in: deferred issuance, tracing, async issuance
+    install_collectors(_endpoint)
+    for _name, _constructor in _endpoint.credential_constructor.items():
+        _endpoint.credential_constructor[_name] = TracedConstructor(_constructor, _name)
+    issuance = AsyncCredentialIssuance(_frontend)
+
+    _constructor = _endpoint.credential_constructor["PIDCredential"]
+    assert isinstance(_constructor, TracedConstructor)
+    _constructor.httpc = recorder
+    assert _original.httpc is recorder
+
+    _responses = _post(issuance, [_request("client_0"), _request("client_1")])
+    assert [r.status_code for r in _responses] == [200, 200]
+    assert sorted(r["client_id"] for r in recorder.requests) == ["client_0", "client_1"]
+
+
+def test_authentic_source_error():
+    issuance = AsyncCredentialIssuance(Frontend(Recorder(status=500)))
+    _responses = _post(issuance, [_request("client_0")])
+    assert _responses[0].status_code == 500
+    assert _responses[0].json()["error"] == "server_error"
+
+
+def test_timeout():
+    issuance = AsyncCredentialIssuance(Frontend(Recorder(delay=0.5)), timeout=0.05)
+    _responses = _post(issuance, [_request("client_0")])
+    assert _responses[0].status_code == 500
+
+
+def test_not_found(issuance):
+    async def _run():
+        _client = httpx.AsyncClient(transport=httpx.ASGITransport(app=issuance.asgi_app()),
+                                    base_url="https://issuer.example.org")
+        _resp = await _client.get("/token")
+        await _client.aclose()
+        return _resp
+
+    assert asyncio.run(_run()).status_code == 404
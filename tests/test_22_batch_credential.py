@@ -0,0 +1,99 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import time
+
+from idpyoidc.message import Message
+import pytest
+from satosa.context import Context
+from satosa_idpyop.core.response import JsonResponse
+
+from satosa_openid4vci.async_credential import install_collectors
+from satosa_openid4vci.endpoint_wrapper.batch_credential import BatchCredentialEndpointWrapper
+
+
+class Constructor(object):
+    def __init__(self, vct):
+        self.vct = vct
+
+    def __call__(self, user_id, **kwargs):
+        time.sleep(0.1)
+        return f"{self.vct}:{user_id}"
+
+
+class Endpoint(object):
+    request_cls = Message
+
+    def __init__(self):
+        self.authentications = 0
+        self.credential_constructor = {"PID": Constructor("PID"), "EHIC": Constructor("EHIC")}
+
+    def upstream_get(self, *args):
+        return None
+
+    def parse_request(self, request, http_info=None):
+        self.authentications += 1
+        return Message(client_id="wallet", **request)
+
+
+class Wrapper(BatchCredentialEndpointWrapper):
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.max_batch_size = 3
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        install_collectors(endpoint)
+
+    def parse_request(self, request, http_info=None):
+        if request.get("vct") == "unauthorized":
+            return JsonResponse({"error": "unauthorized_client"}, status="403")
+        return self.endpoint.parse_request(request, http_info)
+
+    def _restore_state(self, request, http_info):
+        pass
+
+    def _load_claims(self, client_id):
+        return {"given_name": "Diana"}
+
+    def process_request(self, request, parse_req, http_info, extra_claims=None):
+        _constructor = self.endpoint.credential_constructor[parse_req["vct"]]
+        return {"response_args": {"credential": _constructor(user_id="diana"), "c_nonce": "n1"}}
+
+    def clean_up(self):
+        pass
+
+
+def _context(requests):
+    context = Context()
+    context.request = {"credential_requests": requests}
+    context.http_headers = {}
+    return context
+
+
+def test_batch():
+    endpoint = Endpoint()
+    wrapper = Wrapper(endpoint)
+    _start = time.time()
+    response = wrapper(_context([{"vct": "PID"}, {"vct": "EHIC"}, {"vct": "PID"}]))
+    # the three constructors ran in parallel
+    assert time.time() - _start < 0.25
+    # each credential request is parsed like one to the credential endpoint
+    assert endpoint.authentications == 3
+
+    _info = json.loads(response.message)
+    assert _info["credential_responses"] == [{"credential": "PID:diana"},
+                                             {"credential": "EHIC:diana"},
+                                             {"credential": "PID:diana"}]
+    assert _info["c_nonce"] == "n1"
+
+
+@pytest.mark.parametrize("requests", [[], "not json", [{"vct": "PID"}] * 4])
+def test_invalid_batch(requests):
+    response = Wrapper(Endpoint())(_context(requests))
+    assert response.status == "400"
+    assert json.loads(response.message)["error"] == "invalid_request"
+
+
+def test_unauthorized_item():
+    endpoint = Endpoint()
+    response = Wrapper(endpoint)(_context([{"vct": "PID"}, {"vct": "unauthorized"}]))
+    assert response.status == "403"
+    assert json.loads(response.message)["error"] == "unauthorized_client"
@@ -0,0 +1,187 @@
+import json
+import threading
+import time
+
+from idpyoidc.message import Message
+import pytest
+from satosa.context import Context
+
+from satosa_openid4vci.async_credential import collecting
+from satosa_openid4vci.async_credential import install_collectors
+from satosa_openid4vci.deferred import DeferredIssuance
+from satosa_openid4vci.deferred import LocalJobQueue
+from satosa_openid4vci.deferred import STATUS_FAILED
+from satosa_openid4vci.deferred import STATUS_PENDING
+from satosa_openid4vci.deferred import STATUS_READY
+from satosa_openid4vci.endpoint_wrapper.credential import CredentialEndpointWrapper
+from satosa_openid4vci.endpoint_wrapper.deferred_credential import \
+    DeferredCredentialEndpointWrapper
+from satosa_openid4vci.storage.redis_db import RedisDB
+from satosa_openid4vci.storage.tracking import ChangeTrackingStorage
+
+
+class Constructor(object):
+    def __init__(self, release=None):
+        self.release = release
+
+    def __call__(self, user_id, **kwargs):
+        if self.release:
+            self.release.wait(5)
+        if user_id == "nobody":
+            raise ValueError("no such user")
+        return f"PID:{user_id}"
+
+
+class Endpoint(object):
+    request_cls = Message
+
+    def __init__(self, release=None):
+        self.credential_constructor = {"PID": Constructor(release)}
+        install_collectors(self)
+
+    def client_authentication(self, request, http_info, **kwargs):
+        return {"client_id": "wallet", "method": "dpop_client_auth"}
+
+
+def _issuance(**kwargs):
+    return DeferredIssuance(storage=RedisDB(url="memory://test_23"), max_workers=2, **kwargs)
+
+
+def _calls(endpoint, user_id="diana"):
+    with collecting() as _calls:
+        _credential = endpoint.credential_constructor["PID"](user_id=user_id)
+    return {"credential": _credential, "c_nonce": "n1"}, _calls
+
+
+def _wait(issuance, transaction_id, client_id="wallet"):
+    for _ in range(100):
+        _info = issuance.storage.fetch(information_type="deferred_credential",
+                                       key=transaction_id)
+        if _info["status"] != STATUS_PENDING:
+            return issuance.fetch(transaction_id, client_id)
+        time.sleep(0.01)
+
+
+def test_deferred_issuance():
+    _release = threading.Event()
+    issuance = _issuance()
+    _response, _recorded = _calls(Endpoint(_release))
+    transaction_id = issuance.submit(_response, _recorded, "wallet")
+
+    assert issuance.fetch(transaction_id, "wallet")["status"] == STATUS_PENDING
+    # Only the client that asked for the credential gets it
+    assert issuance.fetch(transaction_id, "other") is None
+
+    _release.set()
+    _info = _wait(issuance, transaction_id)
+    assert _info["status"] == STATUS_READY
+    assert _info["response"] == {"credential": "PID:diana", "c_nonce": "n1"}
+    # Handed out once
+    assert issuance.fetch(transaction_id, "wallet") is None
+
+
+def test_deferred_issuance_failed():
+    issuance = _issuance()
+    transaction_id = issuance.submit(*_calls(Endpoint(), "nobody"), "wallet")
+    assert _wait(issuance, transaction_id)["status"] == STATUS_FAILED
+
+
+def test_queue_full():
+    _release = threading.Event()
+    issuance = _issuance(queue=LocalJobQueue(max_workers=1, max_pending=1))
+    _endpoint = Endpoint(_release)
+    assert issuance.submit(*_calls(_endpoint), "wallet")
+    assert issuance.submit(*_calls(_endpoint), "wallet") is None
+    _release.set()
+
+
+class Wrapper(CredentialEndpointWrapper):
+    def __init__(self, endpoint, deferred):
+        self.endpoint = endpoint
+        self.deferred = deferred
+
+    def handle_request(self, context):
+        _credential = self.endpoint.credential_constructor["PID"](user_id="diana")
+        return {"response_args": {"credential": _credential, "c_nonce": "n1"}}, {}, "wallet"
+
+    def clean_up(self):
+        pass
+
+
+class PollingWrapper(DeferredCredentialEndpointWrapper):
+    def __init__(self, endpoint, deferred):
+        self.endpoint = endpoint
+        self.deferred = deferred
+
+    def _restore_state(self, request, http_info):
+        pass
+
+    def clean_up(self):
+        pass
+
+
+def _context(request):
+    context = Context()
+    context.request = request
+    context.http_headers = {}
+    return context
+
+
+def test_deferred_credential_endpoint():
+    _release = threading.Event()
+    endpoint = Endpoint(_release)
+    issuance = _issuance(interval=2)
+
+    response = Wrapper(endpoint, issuance)(_context({"vct": "PID"}))
+    assert response.status == "202"
+    _info = json.loads(response.message)
+    assert _info["c_nonce"] == "n1"
+    transaction_id = _info["transaction_id"]
+
+    poll = PollingWrapper(endpoint, issuance)
+    response = poll(_context({"transaction_id": transaction_id}))
+    assert response.status == "400"
+    assert json.loads(response.message) == {"error": "issuance_pending", "interval": 2}
+
+    _release.set()
+    issuance.queue.shutdown()
+    response = poll(_context({"transaction_id": transaction_id}))
+    assert json.loads(response.message)["credential"] == "PID:diana"
+
+    response = poll(_context({"transaction_id": transaction_id}))
+    assert json.loads(response.message)["error"] == "invalid_transaction_id"
+
+
+def test_storage_required():
+    with pytest.raises(ValueError):
+        DeferredIssuance(storage=None)
+
+
+def test_change_tracking_storage_unwrapped():
+    _storage = RedisDB(url="memory://test_23_tracking")
+    issuance = DeferredIssuance(storage=ChangeTrackingStorage(_storage))
+    assert issuance.storage is _storage
+
+
+class Storage(object):
+    """A storage without a time to live."""
+
+    def __init__(self):
+        self.db = {}
+
+    def store(self, information_type, value, key=""):
+        self.db[(information_type, key)] = value
+
+    def fetch(self, information_type, key=""):
+        return self.db.get((information_type, key))
+
+    def delete(self, information_type, key=""):
+        self.db.pop((information_type, key), None)
+
+
+def test_expired_without_native_ttl():
+    issuance = DeferredIssuance(storage=Storage(), ttl=10)
+    issuance._store("t1", {"status": STATUS_READY, "client_id": "wallet",
+                           "created": time.time() - 11})
+    assert issuance.fetch("t1", "wallet") is None
+    assert issuance.storage.db == {}
@@ -0,0 +1,113 @@
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+import json
+import threading
+import time
+
+import pytest
+import requests
+
+from satosa_openid4vci.http_client import PooledHTTPClient
+from satosa_openid4vci.http_client import h2
+from satosa_openid4vci.http_client import httpx_arguments
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.server.connections.add(self.client_address)
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+        time.sleep(self.server.delay)
+        _body = self.rfile.read(int(self.headers["Content-Length"]))
+        _resp = json.dumps({"credential": json.loads(_body)["document_type"]}).encode()
+        with self.server.lock:
+            self.server.in_flight -= 1
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(_resp)))
+        self.end_headers()
+        self.wfile.write(_resp)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    _server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    _server.connections = set()
+    _server.lock = threading.Lock()
+    _server.in_flight = 0
+    _server.max_in_flight = 0
+    _server.delay = 0
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    yield _server
+    _server.shutdown()
+
+
+def _url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/credential"
+
+
+def test_connections_reused(server):
+    client = PooledHTTPClient(http2=False)
+    for _type in ["PID", "EHIC", "PDA1"]:
+        _resp = client("POST", _url(server), data=json.dumps({"document_type": _type}),
+                       headers={"Content-Type": "application/json"})
+        assert _resp.json() == {"credential": _type}
+    assert len(server.connections) == 1
+    client.close()
+
+
+def test_no_keep_alive(server):
+    client = PooledHTTPClient(http2=False, keep_alive=False)
+    for _type in ["PID", "EHIC"]:
+        client("POST", _url(server), data=json.dumps({"document_type": _type}))
+    assert len(server.connections) == 2
+
+
+def test_max_per_host(server):
+    server.delay = 0.05
+    client = PooledHTTPClient(http2=False, max_per_host=2)
+    _threads = [threading.Thread(target=client, args=("POST", _url(server)),
+                                 kwargs={"data": json.dumps({"document_type": "PID"})})
+                for _ in range(6)]
+    for _thread in _threads:
+        _thread.start()
+    for _thread in _threads:
+        _thread.join()
+    assert server.max_in_flight == 2
+
+
+def test_httpx_arguments():
+    _client, _request = httpx_arguments({"data": "{}", "verify": False, "stream": True,
+                                         "allow_redirects": False, "timeout": 5})
+    assert _client == {"verify": False, "stream": True}
+    assert _request == {"content": "{}", "follow_redirects": False, "timeout": 5}
+
+
+def test_http2_is_opt_in():
+    client = PooledHTTPClient()
+    assert client.http2 is False
+    assert isinstance(client.session, requests.Session)
+
+
+@pytest.mark.skipif(h2 is None, reason="needs httpx[http2]")
+def test_http2_client_level_params(server):
+    client = PooledHTTPClient(http2=True)
+    _session, _kwargs = client._session_for({"data": "{}", "verify": True})
+    assert _session is client.session
+    assert _kwargs == {"content": "{}"}
+    for _params in [{"verify": False}, {"cert": "client.pem"},
+                    {"proxies": {"https": "http://proxy.example.org"}}]:
+        _session, _kwargs = client._session_for(dict(_params, data="{}"))
+        assert _session is client.http1_session
+        assert _kwargs == dict(_params, data="{}")
+
+    _resp = client("POST", _url(server), data=json.dumps({"document_type": "PID"}),
+                   verify=False)
+    assert _resp.json() == {"credential": "PID"}
+    client.close()
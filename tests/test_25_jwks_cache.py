@@ -0,0 +1,190 @@
+import time
+
+from cryptojwt import JWT
+from cryptojwt.jwk.ec import new_ec_key
+from cryptojwt.key_jar import KeyJar
+import pytest
+
+from satosa_openid4vci.jwks_cache import JWKSCache
+from satosa_openid4vci.jwks_cache import JWKSKeyJar
+from satosa_openid4vci.jwks_cache import cache_ttl
+
+URL = "https://as.example.com/.well-known/jwks"
+ISSUER = "https://as.example.com"
+
+
+class Response(object):
+    def __init__(self, info, cache_control=""):
+        self.status_code = 200
+        self.info = info
+        self.headers = {"Cache-Control": cache_control} if cache_control else {}
+
+    def json(self):
+        return self.info
+
+
+class AuthenticSource(object):
+    def __init__(self, cache_control="", issuer=ISSUER):
+        self.cache_control = cache_control
+        self.issuer = issuer
+        self.keys = [new_ec_key("P-256", kid="k1")]
+        self.fetches = 0
+
+    def __call__(self, method, url, **kwargs):
+        self.fetches += 1
+        _jwks = {"keys": [k.serialize() for k in self.keys]}
+        if self.issuer:
+            return Response({"issuer": self.issuer, "jwks": _jwks}, self.cache_control)
+        return Response(_jwks, self.cache_control)
+
+
+def _cache(source, **kwargs):
+    return JWKSCache(httpc=source, issuers={URL: ISSUER}, **kwargs)
+
+
+@pytest.mark.parametrize("value, ttl", [("", 10), ("public, max-age=600", 600),
+                                        ("no-store", 0), ("max-age = 5", 5)])
+def test_cache_ttl(value, ttl):
+    assert cache_ttl(value, 10) == ttl
+
+
+def test_fetched_once():
+    source = AuthenticSource("max-age=600")
+    keyjar = KeyJar()
+    cache = _cache(source, keyjar=keyjar)
+    for _ in range(5):
+        assert cache.get(URL).kids() == ["k1"]
+    assert source.fetches == 1
+    assert cache.issuer(URL) == ISSUER
+    assert len(keyjar.get_issuer_keys(ISSUER)) == 1
+
+
+def test_nothing_fetched_on_register():
+    source = AuthenticSource()
+    cache = _cache(source)
+    cache.register(URL)
+    assert cache.issuer(URL) == ISSUER
+    assert source.fetches == 0
+    cache.refresh_due()
+    assert source.fetches == 1
+
+
+def test_bound_to_url():
+    source = AuthenticSource(issuer=None)
+    keyjar = KeyJar()
+    JWKSCache(httpc=source, keyjar=keyjar).get(URL)
+    assert len(keyjar.get_issuer_keys(URL)) == 1
+
+
+@pytest.mark.parametrize("issuers", [None, {URL: "https://other.example.com"}])
+def test_issuer_mismatch(issuers):
+    keyjar = KeyJar()
+    cache = JWKSCache(httpc=AuthenticSource(), keyjar=keyjar, issuers=issuers)
+    with pytest.raises(ValueError):
+        cache.get(URL)
+    assert keyjar.owners() == []
+
+
+def test_expired():
+    source = AuthenticSource("max-age=1")
+    cache = _cache(source, min_ttl=0, refresh_ahead=0)
+    cache.get(URL)
+    cache._entries[URL].expires = time.time() - 1
+    cache.get(URL)
+    assert source.fetches == 2
+
+
+def test_background_refresh():
+    source = AuthenticSource("max-age=100")
+    keyjar = KeyJar()
+    cache = _cache(source, keyjar=keyjar, refresh_ahead=0.5)
+    cache.get(URL)
+    # Within the refresh window, the cached keys are returned at once
+    cache._entries[URL].fetched -= 60
+    cache._entries[URL].expires -= 60
+    source.keys = [new_ec_key("P-256", kid="k2")]
+    assert cache.get(URL).kids() == ["k1"]
+    for _ in range(100):
+        if source.fetches == 2 and not cache._entries[URL].refreshing:
+            break
+        time.sleep(0.01)
+    assert cache.get(URL).kids() == ["k2"]
+    # The old keys are replaced in the keyjar
+    assert [k.kid for k in keyjar.get_issuer_keys(ISSUER)] == ["k2"]
+
+
+def test_kid_miss_rate_limited():
+    source = AuthenticSource("max-age=600")
+    cache = _cache(source, kid_miss_interval=30)
+    assert cache.get_key(URL, "k1").kid == "k1"
+    source.keys.append(new_ec_key("P-256", kid="k2"))
+    # Fetched less than kid_miss_interval ago
+    assert cache.get_key(URL, "k2") is None
+    assert source.fetches == 1
+
+    cache._entries[URL].last_fetch -= 31
+    assert cache.get_key(URL, "k2").kid == "k2"
+    assert cache.get_key(URL, "k3") is None
+    assert source.fetches == 2
+
+
+def test_refresh_due():
+    source = AuthenticSource("max-age=100")
+    cache = _cache(source)
+    cache.get(URL)
+    cache.refresh_due()
+    assert source.fetches == 1
+    cache._entries[URL].fetched -= 90
+    cache._entries[URL].expires -= 90
+    cache.refresh_due()
+    assert source.fetches == 2
+
+
+def test_kid_miss_on_verification():
+    source = AuthenticSource("max-age=600")
+    keyjar = KeyJar()
+    cache = _cache(source, keyjar=keyjar, kid_miss_interval=0)
+    cache.get(URL)
+
+    # The authentic source rotates its keys and signs with the new one
+    _signer = KeyJar()
+    _key = new_ec_key("P-256", kid="k2")
+    _signer.add_keys(ISSUER, [_key])
+    source.keys = [_key]
+    _jwt = JWT(_signer, iss=ISSUER, sign_alg="ES256").pack({"sub": "diana"})
+
+    assert JWT(keyjar).unpack(_jwt)["sub"] == "diana"
+    assert source.fetches == 2
+    assert isinstance(keyjar, JWKSKeyJar)
+    assert "get_jwt_verify_keys" not in vars(keyjar)
+
+
+def test_kid_miss_other_issuer():
+    source = AuthenticSource("max-age=600")
+    keyjar = JWKSKeyJar()
+    cache = _cache(source, keyjar=keyjar, kid_miss_interval=0)
+    assert keyjar.jwks_cache is cache
+
+    _signer = KeyJar()
+    _signer.add_keys("https://other.example.com", [new_ec_key("P-256", kid="k9")])
+    _jwt = JWT(_signer, iss="https://other.example.com", sign_alg="ES256").pack({"sub": "x"})
+    with pytest.raises(Exception):
+        JWT(keyjar).unpack(_jwt)
+    assert source.fetches == 0
+
+
+def test_memoize():
+    source = AuthenticSource("max-age=600")
+    cache = _cache(source, min_ttl=0)
+    _calls = []
+
+    def fetch_jwks():
+        _calls.append(1)
+        return {"keys": len(_calls)}
+
+    fetch = cache.memoize(URL, fetch_jwks)
+    assert fetch() == {"keys": 1}
+    assert fetch() == {"keys": 1}
+    cache._entries[URL].expires = time.time() - 1
+    assert fetch() == {"keys": 2}
+    assert source.fetches == 2
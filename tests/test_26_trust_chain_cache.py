@@ -0,0 +1,185 @@
+import time
+
+from idpyoidc.impexp import ImpExp
+import pytest
+
+from satosa_openid4vci.storage.redis_db import RedisDB
+from satosa_openid4vci.trust_chain_cache import TrustChainCache
+
+WALLET_PROVIDER = "https://wp.example.org"
+TRUST_ANCHOR = "https://ta.example.org"
+OTHER_ANCHOR = "https://other-ta.example.org"
+
+
+class TrustChain(ImpExp):
+    """Like fedservice's TrustChain, the result of collecting and verifying a chain."""
+    parameter = {
+        "anchor": "",
+        "chain": [],
+        "combined_policy": {},
+        "exp": 0,
+        "iss_path": [],
+        "metadata": {},
+        "verified_chain": [],
+    }
+
+    def __init__(self, exp=0, verified_chain=None):
+        ImpExp.__init__(self)
+        self.anchor = ""
+        self.chain = []
+        self.iss_path = []
+        self.err = {}
+        self.metadata = {}
+        self.exp = exp
+        self.verified_chain = verified_chain
+        self.combined_policy = {}
+
+    def export_chain(self):
+        return list(reversed(self.chain))
+
+
+def _trust_chain(anchor, exp):
+    _chain = TrustChain(exp=exp)
+    _chain.anchor = anchor
+    _chain.iss_path = [WALLET_PROVIDER, "https://ia.example.org", anchor]
+    _chain.chain = [f"statement-by-{p}" for p in reversed(_chain.iss_path)]
+    _chain.metadata = {"wallet_provider": {"jwks": {"keys": []}}}
+    _chain.combined_policy = {"wallet_provider": {"jwks": {"essential": True}}}
+    _chain.verified_chain = [{"iss": p} for p in _chain.iss_path]
+    return _chain
+
+
+class FederationEntity(object):
+    def __init__(self, exp=None):
+        self.exp = exp or int(time.time()) + 86400
+        self.collected = 0
+        self.trust_chain = {}
+
+    def get_verified_trust_chains(self, entity_id, trust_anchor=TRUST_ANCHOR):
+        if entity_id in self.trust_chain:
+            return self.trust_chain[entity_id]
+        self.collected += 1
+        _chains = [_trust_chain(trust_anchor, self.exp)] if entity_id == WALLET_PROVIDER else []
+        self.trust_chain[entity_id] = _chains
+        return _chains
+
+
+def _cache(name, **kwargs):
+    return TrustChainCache(storage=RedisDB(url=f"memory://{name}"), **kwargs)
+
+
+def test_shared_between_workers():
+    # Two workers, each with its own federation entity, sharing the storage
+    _workers = [FederationEntity(), FederationEntity()]
+    for _entity in _workers:
+        _cache("test_26_shared").install(_entity)
+
+    _chains = _workers[0].get_verified_trust_chains(WALLET_PROVIDER)
+    assert _chains[0].anchor == TRUST_ANCHOR
+    _chains = _workers[1].get_verified_trust_chains(WALLET_PROVIDER)
+    assert _chains[0].iss_path[-1] == TRUST_ANCHOR
+    assert _chains[0].metadata == {"wallet_provider": {"jwks": {"keys": []}}}
+    assert [_entity.collected for _entity in _workers] == [1, 0]
+
+
+def test_by_trust_anchor():
+    cache = _cache("test_26_anchor")
+    cache.put(WALLET_PROVIDER, [_trust_chain(TRUST_ANCHOR, int(time.time()) + 60)])
+    assert len(cache.get(WALLET_PROVIDER, TRUST_ANCHOR)) == 1
+    assert cache.get(WALLET_PROVIDER, "https://other.example.org") == []
+    cache.delete(WALLET_PROVIDER)
+    assert cache.get(WALLET_PROVIDER) == []
+
+
+def test_bounded_by_chain_expiry():
+    entity = FederationEntity(exp=int(time.time()) + 1)
+    cache = _cache("test_26_expiry", ttl=3600)
+    cache.install(entity)
+    entity.get_verified_trust_chains(WALLET_PROVIDER)
+    time.sleep(1.1)
+    # Expired, collected again even though the federation entity remembers the chain
+    entity.get_verified_trust_chains(WALLET_PROVIDER)
+    assert entity.collected == 2
+
+
+def test_unknown_entity_not_cached():
+    entity = FederationEntity()
+    _cache("test_26_unknown").install(entity)
+    assert entity.get_verified_trust_chains("https://unknown.example.org") == []
+    entity.trust_chain = {}
+    entity.get_verified_trust_chains("https://unknown.example.org")
+    assert entity.collected == 2
+
+
+def test_by_arguments():
+    entity = FederationEntity()
+    _cache("test_26_arguments").install(entity)
+    assert entity.get_verified_trust_chains(WALLET_PROVIDER)[0].anchor == TRUST_ANCHOR
+    _chains = entity.get_verified_trust_chains(WALLET_PROVIDER, trust_anchor=OTHER_ANCHOR)
+    assert _chains[0].anchor == OTHER_ANCHOR
+    assert entity.collected == 2
+    # Both from the cache
+    _chains = entity.get_verified_trust_chains(WALLET_PROVIDER, trust_anchor=OTHER_ANCHOR)
+    assert _chains[0].anchor == OTHER_ANCHOR
+    assert entity.get_verified_trust_chains(WALLET_PROVIDER)[0].anchor == TRUST_ANCHOR
+    assert entity.collected == 2
+
+
+def test_storage_required():
+    with pytest.raises(ValueError):
+        TrustChainCache(storage=None)
+
+
+class Storage(object):
+    """A storage without a time to live."""
+
+    def __init__(self):
+        self.db = {}
+
+    def store(self, information_type, value, key=""):
+        self.db[(information_type, key)] = value
+
+    def fetch(self, information_type, key=""):
+        return self.db.get((information_type, key))
+
+    def delete(self, information_type, key=""):
+        self.db.pop((information_type, key), None)
+
+
+def test_expired_removed_without_native_ttl():
+    cache = TrustChainCache(storage=Storage())
+    cache.put(WALLET_PROVIDER, [_trust_chain(TRUST_ANCHOR, int(time.time()) + 60)])
+    assert len(cache.get(WALLET_PROVIDER)) == 1
+    for (_type, _), _value in cache.storage.db.items():
+        if _type == "trust_chain":
+            _value["expires"] = time.time() - 1
+    assert cache.get(WALLET_PROVIDER) == []
+    assert [_type for _type, _ in cache.storage.db] == ["trust_chain_anchors"]
+
+
+def test_hit_used_like_miss():
+    def _consume(chains):
+        # what a consumer of the federation entity's chains does with them
+        _chain = chains[0]
+        return (type(_chain), _chain.anchor, _chain.exp, _chain.iss_path, _chain.metadata,
+                _chain.combined_policy, _chain.verified_chain, _chain.export_chain())
+
+    _workers = [FederationEntity(), FederationEntity()]
+    for _entity in _workers:
+        _cache("test_26_consumer").install(_entity)
+
+    _miss = _consume(_workers[0].get_verified_trust_chains(WALLET_PROVIDER))
+    _hit = _consume(_workers[1].get_verified_trust_chains(WALLET_PROVIDER))
+    assert [_entity.collected for _entity in _workers] == [1, 0]
+    assert _hit == _miss
+    assert _hit[0] is TrustChain
+
+
+def test_chain_without_dump_not_cached():
+    class Chain(object):
+        anchor = TRUST_ANCHOR
+        exp = int(time.time()) + 60
+
+    cache = _cache("test_26_no_dump")
+    cache.put(WALLET_PROVIDER, [Chain()])
+    assert cache.get(WALLET_PROVIDER) == []
@@ -0,0 +1,129 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import pytest
+
+from satosa_openid4vci.client_cache import BY_BEARER_TOKEN
+from satosa_openid4vci.client_cache import BY_CLIENT_ID
+from satosa_openid4vci.client_cache import ClientInfoCache
+from satosa_openid4vci.client_lookup import ClientLookup
+
+
+class Persistence(object):
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.clients = {"wallet": {"client_id": "wallet", "redirect_uris": ["https://w/cb"]}}
+        self.lookups = 0
+
+    def restore_client_info(self, client_id):
+        self.lookups += 1
+        time.sleep(self.delay)
+        return self.clients.get(client_id)
+
+    def restore_client_info_by_bearer_token(self, authorization):
+        self.lookups += 1
+        if authorization == "Bearer AT":
+            return self.clients["wallet"]
+        return None
+
+    def store_client_info(self, client_id):
+        self.clients[client_id] = {"client_id": client_id, "redirect_uris": ["https://new/cb"]}
+
+
+def _lookup(cache, persistence, client_id):
+    return cache.lookup(BY_CLIENT_ID, client_id,
+                        lambda: persistence.restore_client_info(client_id))
+
+
+def test_positive_and_negative():
+    persistence = Persistence()
+    cache = ClientInfoCache()
+    for _ in range(3):
+        assert _lookup(cache, persistence, "wallet")["client_id"] == "wallet"
+        assert _lookup(cache, persistence, "bogus") is None
+    assert persistence.lookups == 2
+    assert cache.hits == 4
+
+
+def test_copies_handed_out():
+    persistence = Persistence()
+    cache = ClientInfoCache()
+    _lookup(cache, persistence, "wallet")["redirect_uris"].append("https://evil/cb")
+    assert _lookup(cache, persistence, "wallet")["redirect_uris"] == ["https://w/cb"]
+
+
+def test_expiry():
+    persistence = Persistence()
+    cache = ClientInfoCache(negative_ttl=0)
+    _lookup(cache, persistence, "bogus")
+    _lookup(cache, persistence, "bogus")
+    assert persistence.lookups == 2
+
+
+def test_single_flight():
+    persistence = Persistence(delay=0.1)
+    cache = ClientInfoCache()
+    with ThreadPoolExecutor(max_workers=10) as _pool:
+        _results = list(_pool.map(lambda _: _lookup(cache, persistence, "wallet"), range(10)))
+    assert persistence.lookups == 1
+    assert all(_r["client_id"] == "wallet" for _r in _results)
+
+
+def test_error_not_cached():
+    cache = ClientInfoCache()
+
+    def _load():
+        raise ConnectionError("storage down")
+
+    with pytest.raises(ConnectionError):
+        cache.lookup(BY_CLIENT_ID, "wallet", _load)
+    assert cache.lookup(BY_CLIENT_ID, "wallet", lambda: {"client_id": "wallet"})
+
+
+def test_invalidated_on_write():
+    persistence = Persistence()
+    cache = ClientInfoCache()
+    ClientLookup(cache=cache).install(persistence)
+
+    _lookup(cache, persistence, "new")
+    assert cache.lookup(BY_BEARER_TOKEN, "Bearer AT",
+                        lambda: persistence.restore_client_info_by_bearer_token("Bearer AT"))
+    persistence.store_client_info("new")
+    assert _lookup(cache, persistence, "new")["client_id"] == "new"
+
+    persistence.store_client_info("wallet")
+    _info = cache.lookup(BY_BEARER_TOKEN, "Bearer AT",
+                         lambda: persistence.restore_client_info_by_bearer_token("Bearer AT"))
+    assert _info["redirect_uris"] == ["https://new/cb"]
+
+
+def test_write_during_lookup():
+    persistence = Persistence()
+    cache = ClientInfoCache()
+    ClientLookup(cache=cache).install(persistence)
+    _started = threading.Event()
+    _written = threading.Event()
+
+    def _load():
+        _info = persistence.restore_client_info("wallet")
+        _started.set()
+        _written.wait(5)
+        return _info
+
+    _thread = threading.Thread(target=cache.lookup, args=(BY_CLIENT_ID, "wallet", _load))
+    _thread.start()
+    _started.wait(5)
+    persistence.store_client_info("wallet")
+    _written.set()
+    _thread.join()
+    # What was read before the write is not kept
+    assert _lookup(cache, persistence, "wallet")["redirect_uris"] == ["https://new/cb"]
+
+
+def test_max_size():
+    persistence = Persistence()
+    cache = ClientInfoCache(max_size=2)
+    for _client_id in ["a", "b", "c"]:
+        _lookup(cache, persistence, _client_id)
+    assert len(cache._entries) == 2
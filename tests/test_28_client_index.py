@@ -0,0 +1,185 @@
+import base64
+import json
+import time
+
+from satosa_openid4vci.client_cache import ClientInfoCache
+from satosa_openid4vci.client_index import ClientIndex
+from satosa_openid4vci.client_index import basic_credentials
+from satosa_openid4vci.client_lookup import ClientLookup
+from satosa_openid4vci.storage.redis_db import RedisDB
+
+
+def _basic(client_id, secret):
+    return "Basic " + base64.b64encode(f"{client_id}:{secret}".encode()).decode()
+
+
+class Context(object):
+    def __init__(self):
+        self.cdb = {}
+
+
+class Persistence(object):
+    """Looks up clients the slow way, by going through all of them."""
+
+    def __init__(self, context):
+        self.context = context
+        self.clients = {}
+        self.tokens = {}
+        self.scans = 0
+
+    def restore_client_info(self, client_id):
+        return self.clients.get(client_id)
+
+    def restore_client_info_by_bearer_token(self, authorization):
+        self.scans += 1
+        _token = authorization[len("Bearer "):]
+        for _client_id, _tokens in self.tokens.items():
+            if _token in _tokens:
+                return self.clients[_client_id]
+
+    def restore_client_info_by_basic_auth(self, authorization):
+        self.scans += 1
+        _client_id, _secret = basic_credentials(authorization)
+        for _info in self.clients.values():
+            if _info["client_id"] == _client_id and _info["client_secret"] == _secret:
+                return _info
+
+    def store_client_info(self, client_id):
+        self.clients[client_id] = self.context.cdb[client_id]
+
+
+def _setup(name, cache=None):
+    context = Context()
+    persistence = Persistence(context)
+    index = ClientIndex(RedisDB(url=f"memory://{name}"))
+    lookup = ClientLookup(index, cache)
+    lookup.install(persistence, context)
+    return context, persistence, lookup
+
+
+def test_basic_credentials():
+    assert basic_credentials(_basic("wallet", "s:cret")) == ("wallet", "s:cret")
+    assert basic_credentials("Basic !!!") is None
+    assert basic_credentials("Basic " + base64.b64encode(b"no colon").decode()) is None
+
+
+def test_basic_auth_indexed_on_write():
+    context, persistence, lookup = _setup("test_28_basic")
+    context.cdb["wallet"] = {"client_id": "wallet", "client_secret": "secret"}
+    persistence.store_client_info("wallet")
+
+    _info = lookup.by_basic_auth(persistence, _basic("wallet", "secret"))
+    assert _info["client_id"] == "wallet"
+    assert persistence.scans == 0
+    assert lookup.by_basic_auth(persistence, _basic("wallet", "wrong")) is None
+    assert persistence.scans == 1
+
+
+def test_secret_rotated_and_client_removed():
+    context, persistence, lookup = _setup("test_28_rotate")
+    context.cdb["wallet"] = {"client_id": "wallet", "client_secret": "old"}
+    persistence.store_client_info("wallet")
+    assert lookup.index.client_by_basic_auth(_basic("wallet", "old")) == "wallet"
+
+    context.cdb["wallet"] = {"client_id": "wallet", "client_secret": "new"}
+    persistence.store_client_info("wallet")
+    assert lookup.index.client_by_basic_auth(_basic("wallet", "old")) is None
+    assert lookup.index.client_by_basic_auth(_basic("wallet", "new")) == "wallet"
+    assert len(lookup.index.storage.keys_by_information_type("client_by_basic")) == 1
+
+    context.cdb["wallet"] = {"client_id": "wallet"}
+    persistence.store_client_info("wallet")
+    assert lookup.index.client_by_basic_auth(_basic("wallet", "new")) is None
+    assert lookup.index.storage.keys_by_information_type("client_by_basic") == []
+
+
+def test_secret_keyed_digest():
+    _storage = Storage()
+    index = ClientIndex(_storage, key="server-side key")
+    index.add_client("wallet", "secret")
+    _record = _storage.db[("client_by_basic", "wallet")]
+    assert _record["secret"] != "secret"
+    assert _record["expires_at"] > time.time()
+    # another worker with the same key
+    assert ClientIndex(_storage, key="server-side key").client_by_basic_auth(
+        _basic("wallet", "secret")) == "wallet"
+    assert ClientIndex(_storage, key="other key").client_by_basic_auth(
+        _basic("wallet", "secret")) is None
+
+
+def test_bearer_token_indexed_on_issue():
+    context, persistence, lookup = _setup("test_28_token")
+    persistence.clients["wallet"] = {"client_id": "wallet"}
+
+    class Response(object):
+        message = json.dumps({"access_token": "AT1", "token_type": "DPoP", "expires_in": 60})
+
+    lookup.index.add_token_response(Response(), "wallet")
+    assert lookup.by_bearer_token(persistence, "Bearer AT1")["client_id"] == "wallet"
+    assert persistence.scans == 0
+
+
+def test_bearer_token_indexed_on_lookup():
+    context, persistence, lookup = _setup("test_28_repair")
+    persistence.clients["wallet"] = {"client_id": "wallet"}
+    persistence.tokens["wallet"] = ["AT2"]
+    for _ in range(3):
+        _info = lookup.by_bearer_token(persistence, "Bearer AT2")
+        assert _info["client_id"] == "wallet"
+    assert persistence.scans == 1
+    assert lookup.by_bearer_token(persistence, "Bearer unknown") is None
+
+
+class Storage(object):
+    """A storage without a time to live, like FilesystemDBNoCache."""
+
+    def __init__(self):
+        self.db = {}
+
+    def store(self, information_type, value, key=""):
+        self.db[(information_type, key)] = value
+
+    def fetch(self, information_type, key=""):
+        return self.db.get((information_type, key))
+
+    def delete(self, information_type, key=""):
+        self.db.pop((information_type, key), None)
+
+
+def test_expiry_without_native_ttl():
+    context = Context()
+    persistence = Persistence(context)
+    index = ClientIndex(Storage())
+    lookup = ClientLookup(index)
+    lookup.install(persistence, context)
+    persistence.clients["wallet"] = {"client_id": "wallet"}
+    persistence.tokens["wallet"] = ["AT3"]
+
+    index.add_token("AT3", "wallet", expires_in=60)
+    assert lookup.by_bearer_token(persistence, "Bearer AT3")["client_id"] == "wallet"
+    assert persistence.scans == 0
+
+    for _value in index.storage.db.values():
+        _value["expires_at"] = time.time() - 1
+    assert index.client_by_bearer_token("Bearer AT3") is None
+    assert index.storage.db == {}
+    # Looked up the old way and indexed again
+    assert lookup.by_bearer_token(persistence, "Bearer AT3")["client_id"] == "wallet"
+    assert persistence.scans == 1
+    assert len(index.storage.db) == 1
+
+
+def test_with_client_cache():
+    context, persistence, lookup = _setup("test_28_cache", cache=ClientInfoCache())
+    context.cdb["wallet"] = {"client_id": "wallet", "client_secret": "old"}
+    persistence.store_client_info("wallet")
+    for _ in range(3):
+        assert lookup.by_basic_auth(persistence, _basic("wallet", "old"))["client_id"] == "wallet"
+    assert lookup.cache.hits == 2
+    assert persistence.scans == 0
+
+    # the index is updated and the cache emptied whichever was set up first
+    context.cdb["wallet"] = {"client_id": "wallet", "client_secret": "new"}
+    persistence.store_client_info("wallet")
+    assert lookup.by_basic_auth(persistence, _basic("wallet", "old")) is None
+    assert lookup.by_basic_auth(persistence, _basic("wallet", "new"))["client_secret"] == "new"
@@ -0,0 +1,131 @@
+import json
+import random
+import string
+from urllib.parse import urlencode
+
+import pytest
+
+from satosa_openid4vci.authorization_details import AuthorizationDetailsError
+from satosa_openid4vci.authorization_details import AuthorizationDetailsValidator
+from satosa_openid4vci.authorization_details import decode_authorization_details
+from satosa_openid4vci.authorization_details import parse_authorization_details
+
+PID = {"type": "openid_credential", "format": "vc+sd-jwt", "vct": "PID"}
+EHIC = {"type": "openid_credential", "format": "vc+sd-jwt", "vct": "EHIC"}
+
+SUPPORTED = {
+    "PIDCredential": {"format": "vc+sd-jwt", "vct": "PID"},
+    "EHICCredential": {"format": "vc+sd-jwt", "vct": "EHIC"},
+    "mDL": {"format": "mso_mdoc", "doctype": "org.iso.18013.5.1.mDL"},
+    "Diploma": {"format": "jwt_vc_json",
+                "credential_definition": {"type": ["VerifiableCredential", "Diploma"]}},
+}
+
+
+def _bracketed(details, quote='"', sep=","):
+    return "[" + sep.join(f"{quote}{urlencode(d)}{quote}" for d in details) + "]"
+
+
+@pytest.mark.parametrize("value", [
+    [PID, EHIC],
+    json.dumps([PID, EHIC]),
+    json.dumps([urlencode(PID), urlencode(EHIC)]),
+    _bracketed([PID, EHIC]),
+    _bracketed([PID, EHIC], quote="'", sep=" , "),
+    [urlencode(PID), json.dumps(EHIC)],
+])
+def test_forms(value):
+    assert parse_authorization_details(value) == [PID, EHIC]
+
+
+def test_single():
+    assert parse_authorization_details(json.dumps(PID)) == [PID]
+    assert parse_authorization_details(urlencode(PID)) == [PID]
+    assert parse_authorization_details(PID) == [PID]
+    assert parse_authorization_details("") == []
+
+
+def test_comma_in_value():
+    # The old decoding split on every comma
+    _detail = dict(PID, vct="PID,v2")
+    assert parse_authorization_details(_bracketed([_detail, EHIC])) == [_detail, EHIC]
+
+
+@pytest.mark.parametrize("value", ["[\"type=openid_credential", "no equal sign", "{not json",
+                                   "[1, 2]", "[[]]", 42])
+def test_malformed(value):
+    with pytest.raises(AuthorizationDetailsError):
+        parse_authorization_details(value)
+
+
+def test_decode_request():
+    _request = {"client_id": "wallet", "authorization_details": _bracketed([PID])}
+    assert decode_authorization_details(_request)["authorization_details"] == [PID]
+    assert decode_authorization_details({"client_id": "wallet"}) == {"client_id": "wallet"}
+
+
+def test_validate():
+    validator = AuthorizationDetailsValidator(SUPPORTED)
+    assert validator.validate([
+        PID,
+        {"type": "openid_credential", "credential_configuration_id": "EHICCredential"},
+        {"type": "openid_credential", "format": "mso_mdoc", "doctype": "org.iso.18013.5.1.mDL"},
+        {"type": "openid_credential", "format": "jwt_vc_json",
+         "credential_definition": {"type": ["Diploma", "VerifiableCredential"]}},
+    ]) == ["PIDCredential", "EHICCredential", "mDL", "Diploma"]
+
+
+@pytest.mark.parametrize("detail", [
+    dict(PID, type="payment"),
+    dict(PID, vct="Unknown"),
+    dict(PID, format="ldp_vc"),
+    {"type": "openid_credential", "credential_configuration_id": "Unknown"},
+    {"type": "openid_credential"},
+    dict(PID, vct=["unhashable"]),
+    {"type": "openid_credential", "format": "vc+sd-jwt", "doctype": "org.iso.18013.5.1.mDL"},
+])
+def test_not_supported(detail):
+    with pytest.raises(AuthorizationDetailsError):
+        AuthorizationDetailsValidator(SUPPORTED, strict=True).validate([detail])
+    # let through unless strict
+    assert AuthorizationDetailsValidator(SUPPORTED).validate([detail, PID]) == [
+        None, "PIDCredential"]
+
+
+def test_no_configurations():
+    assert not AuthorizationDetailsValidator({})
+
+
+def _random_detail(rnd):
+    _alphabet = string.ascii_letters + string.digits + ",+/&=%\"' []{}:"
+    _detail = {"type": "openid_credential",
+               "format": rnd.choice(["vc+sd-jwt", "mso_mdoc", "jwt_vc_json"])}
+    for _ in range(rnd.randint(0, 3)):
+        _key = rnd.choice(["vct", "doctype", "credential_configuration_id", "x"])
+        _detail[_key] = "".join(rnd.choice(_alphabet) for _ in range(rnd.randint(1, 20)))
+    return _detail
+
+
+def test_fuzz_round_trip():
+    rnd = random.Random(9396)
+    for _ in range(500):
+        _details = [_random_detail(rnd) for _ in range(rnd.randint(1, 4))]
+        assert parse_authorization_details(json.dumps(_details)) == _details
+        assert parse_authorization_details(
+            json.dumps([urlencode(d) for d in _details])) == _details
+        if not any("\"" in v for d in _details for v in d.values()):
+            assert parse_authorization_details(_bracketed(_details)) == _details
+
+
+def test_fuzz_garbage():
+    rnd = random.Random(4711)
+    _alphabet = string.printable
+    validator = AuthorizationDetailsValidator(SUPPORTED)
+    for _ in range(2000):
+        _value = "".join(rnd.choice(_alphabet) for _ in range(rnd.randint(0, 60)))
+        if rnd.random() < 0.5:
+            _value = "[" + _value + "]"
+        try:
+            validator.validate(parse_authorization_details(_value))
+        except AuthorizationDetailsError:
+            pass
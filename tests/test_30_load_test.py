@@ -0,0 +1,121 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from satosa_openid4vci.storage.redis_db import RedisDB
+from satosa_openid4vci.storage.tracking import ChangeTrackingStorage
+from satosa_openid4vci.tools.stub_authentic_source import StubAuthenticSource
+from script.load_test import AuthenticSourceClient
+from script.load_test import LatencyRecorder
+from script.load_test import StorageOpCounter
+from script.load_test import compare
+from script.load_test import is_ok
+from script.load_test import percentile
+from script.load_test import report
+from script.load_test import response_info
+
+
+class Response(object):
+    def __init__(self, message, status="200 OK"):
+        self.message = message
+        self.status = status
+
+
+def test_percentile():
+    _values = list(range(1, 101))
+    assert percentile(_values, 50) == 50
+    assert percentile(_values, 95) == 95
+    assert percentile(_values, 99) == 99
+    assert percentile(_values, 100) == 100
+    assert percentile([7], 99) == 7
+    assert percentile([], 50) == 0.0
+
+
+def test_latency_summary():
+    recorder = LatencyRecorder()
+    for _ms in range(1, 101):
+        recorder.record("token", _ms / 1000)
+    recorder.record("credential", 0.2, ok=False)
+
+    summary = recorder.summary(wall_time=2.0)
+    assert summary["token"]["count"] == 100
+    assert summary["token"]["errors"] == 0
+    assert summary["token"]["p50_ms"] == 50
+    assert summary["token"]["p99_ms"] == 99
+    assert summary["token"]["max_ms"] == 100
+    assert summary["token"]["requests_per_second"] == 50
+    assert summary["credential"]["errors"] == 1
+
+
+def test_storage_ops_counted_below_change_tracking():
+    _db = RedisDB(url="memory://load_test")
+    storage = ChangeTrackingStorage(_db)
+    counter = StorageOpCounter()
+    counter.install(storage)
+    counter.install(storage)  # only once
+
+    storage.store(information_type="client", value={"a": 1}, key="c1")
+    storage.begin()
+    storage.fetch(information_type="client", key="c1")
+    storage.store(information_type="client", value={"a": 1}, key="c1")  # unchanged, not written
+    storage.delete(information_type="client", key="c2")
+    storage.commit()
+
+    _counts = counter.snapshot()
+    assert _counts["store"] == 1
+    assert _counts["fetch"] == 1
+    assert _counts["delete"] == 1
+
+
+def test_authentic_source_client():
+    stub = StubAuthenticSource(delay=0.05)
+    client = AuthenticSourceClient(stub)
+    try:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            _responses = list(executor.map(
+                lambda n: client("POST", "https://as.example.com/credential",
+                                 data=json.dumps({"n": n}), verify=False, timeout=5),
+                range(8)))
+    finally:
+        client.close()
+
+    assert [r.status_code for r in _responses] == [200] * 8
+    assert _responses[3].json()["credential"] == StubAuthenticSource.make_credential({"n": 3})
+    assert len(stub.requests) == 8
+    assert stub.max_in_flight > 1
+
+
+@pytest.mark.parametrize("response,ok", [
+    (Response('{"access_token": "abc"}'), True),
+    (Response("", "303 See Other"), True),
+    (Response('{"error": "invalid_grant"}', "400 Bad Request"), False),
+    (Response('{"error": "invalid_client"}'), False),
+])
+def test_is_ok(response, ok):
+    assert is_ok(response) is ok
+
+
+def test_response_info():
+    assert response_info(Response(['{"a": ', '1}'])) == {"a": 1}
+    assert response_info(Response("not json")) == {}
+
+
+def test_compare_and_report():
+    _endpoint = {"count": 10, "errors": 0, "p50_ms": 10.0, "p95_ms": 20.0, "p99_ms": 40.0,
+                 "mean_ms": 12.0, "max_ms": 50.0, "requests_per_second": 100.0}
+    previous = {"endpoints": {"token": _endpoint},
+                "flows": {"started": 10, "completed": 10, "wall_time_s": 1.0, "per_second": 10}}
+    current = {"endpoints": {"token": dict(_endpoint, p95_ms=10.0),
+                             "credential": _endpoint},
+               "flows": {"started": 10, "completed": 10, "wall_time_s": 0.5, "per_second": 20},
+               "storage": {"per_flow": {"store": 5.0, "fetch": 12.0}}}
+
+    lines = compare(current, previous)
+    assert len(lines) == 2
+    assert "p95_ms -50.0%" in lines[0]
+    assert lines[1].endswith("+100.0%")
+
+    _report = report(current)
+    assert _report[1].startswith("token")
+    assert "store 5.0" in _report[-1]
@@ -0,0 +1,167 @@
+from cryptojwt import JWT
+from cryptojwt.jws.jws import factory
+from cryptojwt.key_jar import build_keyjar
+import pytest
+
+from satosa_openid4vci.response_cache import JWKSResponseCache
+from satosa_openid4vci.signing_policy import SigningPolicy
+from satosa_openid4vci.signing_policy import order_jwks
+from satosa_openid4vci.signing_policy import signing_policy
+
+ISSUER_ID = "https://ci.example.com"
+
+KEY_DEFS = [
+    {"type": "RSA", "use": ["sig"]},
+    {"type": "EC", "crv": "P-256", "use": ["sig"]},
+]
+
+
+@pytest.fixture
+def keyjar():
+    return build_keyjar(KEY_DEFS, issuer_id=ISSUER_ID)
+
+
+def _alg(jws):
+    return factory(jws).jwt.headers["alg"]
+
+
+class JWTToken(object):
+    def __init__(self, alg="ES256"):
+        self.alg = alg
+        self.issuer = ISSUER_ID
+
+
+class TokenHandler(object):
+    def __init__(self, handler):
+        self.handler = handler
+
+    def __getitem__(self, typ):
+        return self.handler[typ]
+
+
+class Constructor(object):
+    sign_alg = "RS256"
+
+
+class Endpoint(object):
+    def __init__(self, **kwargs):
+        for _key, _val in kwargs.items():
+            setattr(self, _key, _val)
+
+
+class Context(object):
+    def __init__(self, **kwargs):
+        for _key, _val in kwargs.items():
+            setattr(self, _key, _val)
+
+
+class Guise(object):
+    def __init__(self, context, endpoints=None):
+        self.context = context
+        self.endpoint = endpoints or {}
+
+    def get_endpoint(self, name):
+        return self.endpoint.get(name)
+
+
+class TrustMarkIssuer(object):
+    def __init__(self, keyjar):
+        self.keyjar = keyjar
+
+    def create_trust_mark(self, trust_mark_id, entity_id):
+        return JWT(self.keyjar, iss=ISSUER_ID).pack({"id": trust_mark_id, "sub": entity_id})
+
+
+def test_defaults():
+    policy = SigningPolicy()
+    assert policy.algorithm("access_token") == "ES256"
+    assert policy.algorithm("credential", allowed=["RS256"]) == "RS256"
+    assert policy.algorithm("credential", allowed=["PS256"]) is None
+    assert policy.jwks_order[0] == "EC"
+
+
+@pytest.mark.parametrize("conf", [None, False, {}])
+def test_opt_in(conf):
+    assert signing_policy(conf) is None
+
+
+def test_configured():
+    assert signing_policy(True).algorithm("credential") == "ES256"
+    _policy = signing_policy({"credential": ["RS256"]})
+    assert _policy.algorithm("credential") == "RS256"
+    assert _policy.algorithm("access_token") == "ES256"
+
+
+def test_algorithm_needs_a_key():
+    policy = SigningPolicy(entity_configuration="ES256")
+    rsa_only = build_keyjar([{"type": "RSA", "use": ["sig"]}], issuer_id=ISSUER_ID)
+    assert policy.algorithm("entity_configuration", rsa_only) is None
+    policy = SigningPolicy(entity_configuration=["ES256", "RS256"])
+    assert policy.algorithm("entity_configuration", rsa_only, [ISSUER_ID]) == "RS256"
+
+
+def test_preferred_first():
+    policy = SigningPolicy(credential=["ES256"])
+    assert policy.preferred_first("credential", ["RS256", "PS256", "ES256"]) == [
+        "ES256", "RS256", "PS256"]
+
+
+def test_order_jwks(keyjar):
+    jwks = keyjar.export_jwks(issuer_id=ISSUER_ID)
+    assert [k["kty"] for k in jwks["keys"]] == ["RSA", "EC"]
+    assert [k["kty"] for k in order_jwks(jwks, ["EC", "RSA"])["keys"]] == ["EC", "RSA"]
+    # Unknown key types last
+    assert [k["kty"] for k in order_jwks(jwks, ["EC"])["keys"]] == ["EC", "RSA"]
+
+
+def test_jwks_response_cache_key_order(keyjar):
+    cache = JWKSResponseCache(key_order=["EC", "RSA"])
+    _entry = cache.lookup("openid_credential_issuer", keyjar, ISSUER_ID)
+    assert _entry.body.index(b'"EC"') < _entry.body.index(b'"RSA"')
+
+
+def test_resign(keyjar):
+    _jws = JWT(keyjar, iss=ISSUER_ID).pack({"sub": ISSUER_ID}, jws_headers={
+        "typ": "entity-statement+jwt"})
+    assert _alg(_jws) == "RS256"
+
+    _resigned = SigningPolicy().resign(_jws, "entity_configuration", keyjar)
+    assert _alg(_resigned) == "ES256"
+    _jwt = factory(_resigned).jwt
+    assert _jwt.headers["typ"] == "entity-statement+jwt"
+    assert _jwt.headers["kid"] == keyjar.get_signing_key("EC", issuer_id=ISSUER_ID)[0].kid
+    assert _jwt.part[1] == factory(_jws).jwt.part[1]
+    assert JWT(keyjar).unpack(_resigned)["sub"] == ISSUER_ID
+
+
+def test_resign_keeps_what_is_allowed(keyjar):
+    _jws = JWT(keyjar, iss=ISSUER_ID, sign_alg="ES256").pack({"sub": ISSUER_ID})
+    assert SigningPolicy().resign(_jws, "trust_mark", keyjar) == _jws
+    policy = SigningPolicy(trust_mark=["RS256"])
+    assert _alg(policy.resign(_jws, "trust_mark", keyjar)) == "RS256"
+
+
+def test_install(keyjar):
+    _tokens = {"access_token": JWTToken("RS256"), "refresh_token": JWTToken("RS256")}
+    _supported = {"PID": {"credential_signing_alg_values_supported": ["RS256", "ES256"]}}
+    _server = {
+        "oauth_authorization_server": Guise(Context(
+            keyjar=keyjar,
+            session_manager=Context(token_handler=TokenHandler(_tokens)))),
+        "openid_credential_issuer": Guise(
+            Context(keyjar=keyjar,
+                    provider_info={"credential_configurations_supported": _supported}),
+            {"credential": Endpoint(credential_constructor={"PID": Constructor()})}),
+        "federation_entity": Guise(
+            Context(keyjar=keyjar),
+            {"status": Endpoint(trust_mark_issuer=TrustMarkIssuer(keyjar))}),
+    }
+    SigningPolicy(refresh_token=["RS256"]).install(_server)
+
+    assert _tokens["access_token"].alg == "ES256"
+    assert _tokens["refresh_token"].alg == "RS256"
+    assert _supported["PID"]["credential_signing_alg_values_supported"] == ["ES256", "RS256"]
+    _constructor = _server["openid_credential_issuer"].endpoint["credential"]
+    assert _constructor.credential_constructor["PID"].sign_alg == "ES256"
+    _issuer = _server["federation_entity"].endpoint["status"].trust_mark_issuer
+    assert _alg(_issuer.create_trust_mark("https://tm.example.com", ISSUER_ID)) == "ES256"
@@ -0,0 +1,119 @@
+from urllib.parse import urlencode
+
+import pytest
+
+from satosa_openid4vci.authorization_details import AuthorizationDetailsError
+from satosa_openid4vci.authorization_details import AuthorizationDetailsValidator
+from satosa_openid4vci.credential_index import CredentialConfigurationIndex
+from satosa_openid4vci.endpoint_wrapper.authorization import AuthorizationEndpointWrapper
+
+SUPPORTED = {
+    "PIDCredential": {
+        "format": "vc+sd-jwt",
+        "vct": "PID",
+        "cryptographic_binding_methods_supported": ["jwk"],
+        "credential_signing_alg_values_supported": ["ES256", "RS256"],
+        "proof_types_supported": {"jwt": {"proof_signing_alg_values_supported": ["ES256"]}},
+        "claims": {"given_name": {"mandatory": True}, "family_name": {"mandatory": True},
+                   "birth_date": {}},
+    },
+    "EHICCredential": {
+        "format": "vc+sd-jwt",
+        "vct": "EHIC",
+        "claims": [{"path": ["social_security_pin"], "mandatory": True},
+                   {"path": ["institution", "name"]}],
+    },
+    "mDL": {"format": "mso_mdoc", "doctype": "org.iso.18013.5.1.mDL",
+            "claims": {"org.iso.18013.5.1": {"given_name": {}, "portrait": {}}}},
+    "Diploma": {"format": "jwt_vc_json",
+                "credential_definition": {"type": ["VerifiableCredential", "Diploma"],
+                                          "credentialSubject": {"degree": {}}}},
+    "Open": {"format": "vc+sd-jwt", "vct": "Open"},
+}
+
+PID = {"type": "openid_credential", "format": "vc+sd-jwt", "vct": "PID"}
+EHIC = {"type": "openid_credential", "format": "vc+sd-jwt", "vct": "EHIC"}
+OPEN = {"type": "openid_credential", "format": "vc+sd-jwt", "vct": "Open"}
+
+
+@pytest.fixture
+def index():
+    return CredentialConfigurationIndex(SUPPORTED, constructors={"PIDCredential": "ctor"})
+
+
+def test_compiled(index):
+    _pid = index["PIDCredential"]
+    assert _pid.claims == {"given_name", "family_name", "birth_date"}
+    assert _pid.mandatory == {"given_name", "family_name"}
+    assert _pid.binding_methods == {"jwk"}
+    assert _pid.signing_algs == ("ES256", "RS256")
+    assert _pid.proof_types == {"jwt"}
+    assert _pid.proof_signing_algs == {"ES256"}
+    assert _pid.constructor == "ctor"
+
+    assert index["EHICCredential"].claims == {"social_security_pin", "name"}
+    assert index["EHICCredential"].mandatory == {"social_security_pin"}
+    assert index["mDL"].claims == {"given_name", "portrait"}
+    assert index["Diploma"].claims == {"degree"}
+    assert index["Diploma"].types == {"VerifiableCredential", "Diploma"}
+    assert index["Open"].claims is None
+    assert index.get("Unknown") is None
+
+
+def test_immutable(index):
+    with pytest.raises(TypeError):
+        index.configurations["Other"] = None
+    with pytest.raises(TypeError):
+        index.by_vct[("vc+sd-jwt", "Other")] = "Other"
+
+
+def test_lookup(index):
+    assert index.by_vct[("vc+sd-jwt", "PID")] == "PIDCredential"
+    assert index.by_doctype[("mso_mdoc", "org.iso.18013.5.1.mDL")] == "mDL"
+    assert index.by_type[("jwt_vc_json", frozenset(["Diploma", "VerifiableCredential"]))] == \
+        "Diploma"
+    assert "mDL" in index
+    assert not CredentialConfigurationIndex({})
+
+
+def test_claims(index):
+    assert index.claims(["PIDCredential", "mDL"]) == {"given_name", "family_name",
+                                                      "birth_date", "portrait"}
+    assert index.claims(["PIDCredential", "Open"]) is None
+
+    _claims = {"given_name": "Diana", "family_name": "Krall", "email": "diana@example.com"}
+    assert index.filter_claims("PIDCredential", _claims) == {"given_name": "Diana",
+                                                             "family_name": "Krall"}
+    assert index.filter_claims("Open", _claims) == _claims
+    assert index.missing_claims("PIDCredential", ["given_name"]) == {"family_name"}
+    assert not index.missing_claims("PIDCredential", _claims)
+
+
+def test_validator_uses_index(index):
+    validator = AuthorizationDetailsValidator(index, strict=True)
+    assert validator.index is index
+    assert validator.validate([PID, EHIC]) == ["PIDCredential", "EHICCredential"]
+    with pytest.raises(AuthorizationDetailsError):
+        validator.validate([dict(PID, vct="Other")])
+
+
+class Wrapper(AuthorizationEndpointWrapper):
+    def __init__(self, validator):
+        self.authorization_details_validator = validator
+
+
+CLAIMS_SUPPORTED = ["given_name", "family_name", "birth_date", "email", "portrait"]
+
+
+@pytest.mark.parametrize("details, claims", [
+    (None, CLAIMS_SUPPORTED),
+    ([PID], ["given_name", "family_name", "birth_date"]),
+    ([urlencode(PID)], ["given_name", "family_name", "birth_date"]),
+    ([PID, OPEN], CLAIMS_SUPPORTED),
+    # None of the claims of the credential are in claims_supported
+    ([EHIC], CLAIMS_SUPPORTED),
+])
+def test_requested_claims(index, details, claims):
+    wrapper = Wrapper(AuthorizationDetailsValidator(index))
+    _request = {"authorization_details": details} if details else {}
+    assert wrapper.requested_claims(_request, CLAIMS_SUPPORTED) == claims
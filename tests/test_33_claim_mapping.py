@@ -0,0 +1,85 @@
+import os
+
+import pytest
+from satosa.attribute_mapping import AttributeMapper
+from satosa_idpyop.core.claims import combine_claim_values
+import yaml
+
+from satosa_openid4vci.claim_mapping import ClaimMappingPlans
+
+BASEDIR = os.path.abspath(os.path.dirname(__file__))
+
+with open(os.path.join(BASEDIR, "..", "openid4vci_oidc", "internal_attributes.yaml")) as fp:
+    INTERNAL_ATTRIBUTES = yaml.safe_load(fp)
+
+CLAIMS_SUPPORTED = ["sub", "name", "given_name", "family_name", "email", "nickname",
+                    "address"]
+
+ATTRIBUTES = [
+    {"givenname": ["Diana", "Maria"], "surname": ["Krall"], "mail": ["diana@example.com",
+                                                                     "dk@example.org"],
+     "edupersontargetedid": ["abc123"], "displayname": []},
+    {"givenname": [], "name": ["Diana Krall"], "unknown": ["x"]},
+    {},
+]
+
+
+def _current(converter, attributes):
+    """What handle_authn_response did before the plans."""
+    _claims = converter.from_internal("openid", attributes)
+    claims = {k: v for k, v in _claims.items() if v}
+    return dict([i for i in combine_claim_values(claims.items())])
+
+
+@pytest.fixture
+def converter():
+    return AttributeMapper(INTERNAL_ATTRIBUTES)
+
+
+@pytest.mark.parametrize("attributes", ATTRIBUTES)
+def test_claims(converter, attributes):
+    plan = ClaimMappingPlans(converter).get("openid")
+    assert plan.claims(attributes) == _current(converter, attributes)
+
+
+def test_claims_values(converter):
+    _claims = ClaimMappingPlans(converter).get("openid").claims(ATTRIBUTES[0])
+    assert _claims["given_name"] == "Diana Maria"
+    assert _claims["email"] == "diana@example.com"
+    assert "nickname" not in _claims
+
+
+def test_nested():
+    converter = AttributeMapper({"attributes": {
+        "locality": {"openid": ["place_of_birth.locality"]},
+        "country": {"openid": ["place_of_birth.country"]},
+        "schacurn": {"openid": ["urn:schac:example.org"]}}})
+    attributes = {"locality": ["Nanaimo"], "schacurn": ["x"]}
+    plan = ClaimMappingPlans(converter).get("openid")
+    assert plan.claims(attributes) == _current(converter, attributes)
+    assert plan.claims(attributes)["place_of_birth"] == {"locality": ["Nanaimo"]}
+    # Later nested attributes replace earlier ones, as in AttributeMapper.from_internal
+    attributes["country"] = ["CA"]
+    assert plan.claims(attributes) == _current(converter, attributes)
+
+
+def test_attributes(converter):
+    plan = ClaimMappingPlans(converter).get("openid", CLAIMS_SUPPORTED)
+    assert sorted(plan.attributes) == sorted(
+        converter.to_internal_filter("openid", CLAIMS_SUPPORTED))
+
+
+def test_compiled_once(converter):
+    plans = ClaimMappingPlans(converter)
+    _plan = plans.get("openid", CLAIMS_SUPPORTED)
+    assert plans.get("openid", list(reversed(CLAIMS_SUPPORTED))) is _plan
+    assert plans.get("openid", ["email"]) is not _plan
+    assert plans.get("saml", CLAIMS_SUPPORTED) is not _plan
+    plans.invalidate()
+    assert plans.get("openid", CLAIMS_SUPPORTED) is not _plan
+
+
+def test_unknown_profile(converter):
+    plan = ClaimMappingPlans(converter).get("nonexistent", CLAIMS_SUPPORTED)
+    assert plan.attributes == []
+    assert plan.claims(ATTRIBUTES[0]) == {}